@@ -0,0 +1,79 @@
+"""
+
+Benchmark of the reads of the curated layer: bytes fetched from S3 and wall time of a query
+with DatasetReader (manifest pruning, ranged GETs of the footers and of the projected column
+chunks) against downloading every object of the dataset. S3 is replaced in-process by moto.
+
+Usage (from the repository root, with benchmarks/requirements.txt installed):
+
+    $ PYTHONPATH=. python benchmarks/curated_read.py --records 5000
+
+"""
+
+import os, time, argparse, tempfile
+
+# offline defaults for the Airflow Variables and connections read by the modules
+os.environ.setdefault('AIRFLOW_VAR_TMP_DIR', tempfile.mkdtemp() + os.sep)
+os.environ.setdefault('AIRFLOW_VAR_DAGS_CUSTOM_PARAMS', '{}')
+os.environ.setdefault('AIRFLOW_CONN_AWS_DEFAULT', 'aws://benchmark:benchmark@/?region_name=us-east-1')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from moto import mock_aws
+from benchmarks.synthetic import make_characters
+from src.modules.base.ndjson import write_records
+from src.modules.base.metrics import RunMetrics
+from src.modules.disney import DisneyCurated, CHARACTERS_CURATED_PREFIX
+from hooks import S3Hook
+
+# (name, columns, filters) of the measured queries
+QUERIES = (
+    ('one month', ['id', 'name', 'updated_month'], [('updated_month', '=', '2021-06')]),
+    ('one id', ['id', 'films'], [('id', '=', 42)]),
+    ('all ids', ['id'], [])
+)
+
+def full_download(s3_hook):
+    tables = []
+    for file in s3_hook.iter_files(prefix = CHARACTERS_CURATED_PREFIX, filter_by_ext = '.parquet'):
+        if '/_' not in file['file_path'][len(CHARACTERS_CURATED_PREFIX) - 1:]:
+            body = s3_hook.client.get_object(Bucket = s3_hook.bucket_name, Key = file['file_path'])['Body'].read()
+            tables.append(pq.read_table(pa.BufferReader(body)))
+
+    return pa.concat_tables(tables, promote_options = 'permissive')
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type = int, default = 5_000)
+    args = parser.parse_args()
+
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket = DisneyCurated.bucket)
+
+        module = DisneyCurated()
+        module.full_refresh = True
+        write_records(module.temp_file_path, make_characters(args.records))
+        module.load()
+
+        started = time.perf_counter()
+        rows = full_download(module.s3_hook).num_rows
+        size = sum(file['size'] for file in module.s3_hook.iter_files(prefix = CHARACTERS_CURATED_PREFIX))
+        print(f"{'full download':<14} {rows:>8} rows  {size / 2 ** 20:>9.2f} MB  {time.perf_counter() - started:>8.3f}s")
+
+        for name, columns, filters in QUERIES:
+            metrics = RunMetrics('benchmark')
+            reader = module.dataset_reader(CHARACTERS_CURATED_PREFIX)
+            reader.s3_hook = S3Hook(module.bucket, metrics = metrics)
+
+            started = time.perf_counter()
+            rows = reader.read(columns = columns, filters = filters).num_rows
+            elapsed = time.perf_counter() - started
+            fetched = metrics.summary()['counters'].get('s3.range_get.bytes_in', 0)
+
+            print(f'{name:<14} {rows:>8} rows  {fetched / 2 ** 20:>9.2f} MB  {elapsed:>8.3f}s')
+
+if __name__ == '__main__':
+    main()
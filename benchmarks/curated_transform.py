@@ -0,0 +1,62 @@
+"""
+
+Benchmark of the curated transform: records/second of the legacy per-record DataFrames
+against the batched, column-wise transform used by DisneyCurated.
+
+Usage (from the repository root):
+
+    $ PYTHONPATH=. python benchmarks/curated_transform.py --records 2000 --batch-size 1000
+
+"""
+
+import os, time, argparse
+
+# offline defaults for the Airflow Variables read by src.config.env
+os.environ.setdefault('AIRFLOW_VAR_TMP_DIR', '/tmp/')
+os.environ.setdefault('AIRFLOW_VAR_DAGS_CUSTOM_PARAMS', '{}')
+
+import pandas as pd
+
+from benchmarks.synthetic import make_characters
+from src.modules.base.ndjson import batched
+from src.modules.disney import DisneyCurated
+
+def legacy_transform(module, characters):
+    # one DataFrame per character, as DisneyCurated did before the batched engine
+    for character in characters:
+        df = pd.DataFrame.from_dict(character, orient='index').T
+        for key, value in character.items():
+            if isinstance(value, list):
+                df = df.explode(str(key))
+        module.transform(df.reset_index(drop=True))
+
+def batched_transform(module, characters, batch_size):
+    for batch in batched(characters, batch_size):
+        module.transform(module.normalize_records(batch))
+
+def measure(name, fn, records):
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<10} {records:>8} records  {elapsed:>8.3f}s  {records / elapsed:>12.1f} records/s')
+    return records / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type = int, default = 2_000)
+    parser.add_argument('--batch-size', type = int, default = 1_000)
+    parser.add_argument('--max-list-size', type = int, default = 3)
+    args = parser.parse_args()
+
+    characters = make_characters(args.records, args.max_list_size)
+
+    # only `transform` and `normalize_records` are measured, the hooks are never built
+    module = DisneyCurated()
+
+    legacy = measure('legacy', lambda: legacy_transform(module, characters), args.records)
+    batch = measure('batched', lambda: batched_transform(module, characters, args.batch_size), args.records)
+
+    print(f'speedup    {batch / legacy:.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+
+Benchmark of the DAG file parsing: time per parse of `dags/disney_dags.py`, and quantity of
+Variables read from the metadata database and of connections resolved while parsing.
+
+Like the scheduler, every parse runs in a new process, forked from a parent that already
+imported Airflow, so nothing cached in the memory of a parse is seen by the next one. Modes:
+
+    - environment:     the Variables are `AIRFLOW_VAR_<KEY>` environment variables.
+    - metastore:       the Variables are stored in the metadata database (a temporary SQLite
+                       database, created by the benchmark).
+    - metastore-cache: same, with the Airflow secrets cache (`[secrets] use_cache`), shared by
+                       the parsing processes.
+
+Usage (from the repository root):
+
+    $ PYTHONPATH=. python benchmarks/dag_parse.py --parses 20
+
+"""
+
+import os, sys, time, shutil, argparse, tempfile, multiprocessing
+
+# a temporary metadata database, configured before Airflow is imported
+DATABASE_DIR = tempfile.mkdtemp(prefix = 'dag_parse_')
+os.environ['AIRFLOW__DATABASE__SQL_ALCHEMY_CONN'] = f'sqlite:///{DATABASE_DIR}/airflow.db'
+os.environ['AIRFLOW__SECRETS__USE_CACHE'] = 'True'
+
+# Variables read by src.config.env while parsing
+VARIABLES = {'TMP_DIR': '/tmp/', 'DAGS_CUSTOM_PARAMS': '{}'}
+
+from airflow.hooks.base import BaseHook
+from airflow.models.dagbag import DagBag
+from airflow.models.variable import Variable
+from airflow.secrets.cache import SecretCache
+from airflow.secrets.metastore import MetastoreBackend
+from airflow.utils import db
+
+DAG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dags', 'disney_dags.py')
+
+class CallCounter:
+    """
+
+    Counts the calls of a method, still calling the original one.
+
+    """
+
+    def __init__(self, cls, name):
+        self.cls, self.name = cls, name
+        self.descriptor = cls.__dict__[name]
+        self.original = getattr(cls, name)
+        self.calls = 0
+
+    def __enter__(self):
+        original = self.original
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return original(*args, **kwargs)
+
+        setattr(self.cls, self.name, counted)
+        return self
+
+    def __exit__(self, *exc):
+        setattr(self.cls, self.name, self.descriptor)
+
+def parse_once(connection):
+    # runs in the forked process of a single parse
+    try:
+        with CallCounter(MetastoreBackend, 'get_variable') as variables, CallCounter(BaseHook, 'get_connection') as connections:
+            start = time.perf_counter()
+            dagbag = DagBag(dag_folder = DAG_FILE, include_examples = False, safe_mode = False)
+            elapsed = time.perf_counter() - start
+
+        connection.send((elapsed, variables.calls, connections.calls, dict(dagbag.import_errors)))
+    except Exception as e:
+        connection.send((0, 0, 0, {DAG_FILE: repr(e)}))
+
+def parse(parses, mode):
+    for key, value in VARIABLES.items():
+        if mode == 'environment':
+            os.environ[f'AIRFLOW_VAR_{key}'] = value
+        else:
+            os.environ.pop(f'AIRFLOW_VAR_{key}', None)
+
+    # like the DAG processor manager, the cache is created before the parsing processes are forked
+    SecretCache.reset()
+    if mode == 'metastore-cache':
+        SecretCache.init()
+
+    context = multiprocessing.get_context('fork')
+    elapsed, variables, connections = 0, 0, 0
+
+    for _ in range(parses):
+        receiver, sender = context.Pipe(duplex = False)
+        process = context.Process(target = parse_once, args = (sender,))
+        process.start()
+        parse_elapsed, parse_variables, parse_connections, import_errors = receiver.recv()
+        process.join()
+
+        if import_errors:
+            raise RuntimeError(import_errors)
+
+        elapsed += parse_elapsed
+        variables += parse_variables
+        connections += parse_connections
+
+    print(f'{mode:<16} {parses:>5} parses  {elapsed / parses * 1000:>9.2f} ms/parse  '
+          f'{variables / parses:>6.2f} database variable lookups/parse  '
+          f'{connections / parses:>6.2f} connections/parse')
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--parses', type = int, default = 20)
+    args = parser.parse_args()
+
+    if sys.platform == 'win32':
+        raise SystemExit('The benchmark forks the parsing processes, like the scheduler.')
+
+    try:
+        db.initdb(load_connections = False)
+        for key, value in VARIABLES.items():
+            Variable.set(key, value)
+
+        for mode in ('environment', 'metastore', 'metastore-cache'):
+            parse(args.parses, mode)
+    finally:
+        shutil.rmtree(DATABASE_DIR, ignore_errors = True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+
+Local stand-in of the Disney API: a threaded HTTP server that serves synthetic characters
+(see benchmarks.synthetic) on `/character`, paginated with `page` and `pageSize` like the real
+API, with `ETag` validators so conditional requests are answered with `304 Not Modified`.
+
+Usage (from the repository root), to point the `disney_api` connection to it by hand:
+
+    $ PYTHONPATH=. python benchmarks/fake_api.py --records 5000 --port 8765
+
+"""
+
+import json, time, argparse, threading
+
+from hashlib import md5
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from benchmarks.synthetic import make_characters
+
+class FakeDisneyApi:
+    """
+
+    Serves `records` synthetic characters on a local port, in a background thread.
+    It is a context manager, and `url` is the base url of the running server.
+
+    Parameters:
+
+        - records(int): quantity of characters served.
+        - max_list_size(int): maximum size of the list fields of each character.
+        - latency(float): seconds of delay added to every response, to simulate the network.
+        - host(str): interface to listen on.
+        - port(int): port to listen on, 0 picks a free port.
+
+    """
+
+    def __init__(self, records, max_list_size = 3, latency = 0.0, host = '127.0.0.1', port = 0):
+        self.characters = make_characters(records, max_list_size)
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def page(self, page, page_size):
+        """
+
+        Returns the body of a page, with the same `info` metadata as the real API.
+
+        """
+
+        total_pages = max(1, -(-len(self.characters) // page_size))
+        data = self.characters[(page - 1) * page_size:page * page_size]
+
+        return {
+            'info': {
+                'count': len(data),
+                'totalPages': total_pages,
+                'previousPage': f'/character?page={page - 1}' if page > 1 else None,
+                'nextPage': f'/character?page={page + 1}' if page < total_pages else None
+            },
+            'data': data
+        }
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path.rstrip('/') != '/character':
+                    return self._send(404, b'{"error": "not found"}')
+
+                query = parse_qs(url.query)
+                page = int(query.get('page', ['1'])[0])
+                page_size = int(query.get('pageSize', ['50'])[0])
+
+                if api.latency:
+                    time.sleep(api.latency)
+
+                body = json.dumps(api.page(page, page_size)).encode()
+                etag = f'"{md5(body).hexdigest()}"'
+
+                with api._lock:
+                    api.requests += 1
+                    if self.headers.get('If-None-Match') == etag:
+                        api.not_modified += 1
+                        return self._send(304, b'', etag)
+
+                self._send(200, body, etag)
+
+            def _send(self, status, body, etag = None):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if etag:
+                    self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type = int, default = 5_000)
+    parser.add_argument('--max-list-size', type = int, default = 3)
+    parser.add_argument('--latency', type = float, default = 0.0)
+    parser.add_argument('--port', type = int, default = 8765)
+    args = parser.parse_args()
+
+    with FakeDisneyApi(args.records, args.max_list_size, args.latency, port = args.port) as api:
+        print(f'Serving {args.records} characters on {api.url}/character')
+        try:
+            api.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
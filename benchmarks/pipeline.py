@@ -0,0 +1,221 @@
+"""
+
+End-to-end benchmark of the Disney pipeline, fully offline: DisneyRaw extracts the characters
+from a local stand-in of the API (benchmarks.fake_api) and loads them to S3, then DisneyCurated
+transforms and loads them as Parquet. S3 is replaced in-process by moto.
+
+Each scale runs in its own process, so the peak memory of a scale is not inflated by the
+previous ones. For every stage (raw extract/load, curated extract/load) it reports the wall
+time, the throughput in records/s, how much the stage raised the peak RSS of the process and
+that peak, plus the latency percentiles of the requests sent to the API and to S3.
+
+Results are written as JSON, and `--compare` reports the throughput changes against a
+previous result file, exiting with an error when a stage got slower than `--threshold`.
+
+Usage (from the repository root, with benchmarks/requirements.txt installed):
+
+    $ PYTHONPATH=. python benchmarks/pipeline.py --scales 1000 5000 20000
+    $ PYTHONPATH=. python benchmarks/pipeline.py --compare benchmarks/results/<previous>.json
+
+"""
+
+import os, sys, json, time, argparse, platform, tempfile, subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, 'results')
+
+DEFAULT_SCALES = (1_000, 5_000, 20_000)
+# (module, stage) pairs measured for each scale, in execution order
+STAGES = (('raw', 'extract'), ('raw', 'load'), ('curated', 'extract'), ('curated', 'load'))
+# request latencies reported by the summary
+LATENCIES = ('disney_api.latency', 's3.upload.latency', 's3.download.latency')
+
+def offline_environment(stage_dir):
+    """
+
+    Airflow Variables and connections of the pipeline, as environment variables.
+
+    """
+
+    return {
+        'AIRFLOW_VAR_TMP_DIR': stage_dir,
+        'AIRFLOW_VAR_DAGS_CUSTOM_PARAMS': '{}',
+        'AIRFLOW_CONN_AWS_DEFAULT': 'aws://benchmark:benchmark@/?region_name=us-east-1',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'PYTHONPATH': os.pathsep.join(filter(None, [ROOT_DIR, os.environ.get('PYTHONPATH')]))
+    }
+
+def run_scale(records, max_list_size, latency):
+    """
+
+    Runs the whole pipeline once for `records` characters, in the current process,
+    and returns the metrics of every stage.
+
+    """
+
+    import boto3
+
+    from moto import mock_aws
+    from benchmarks.fake_api import FakeDisneyApi
+    from src.modules.base.metrics import peak_rss_bytes
+    from src.modules.disney import DisneyRaw, DisneyCurated
+
+    with FakeDisneyApi(records, max_list_size, latency) as api, mock_aws():
+        os.environ['AIRFLOW_CONN_DISNEY_API'] = api.url
+
+        s3 = boto3.client('s3')
+        for bucket in (DisneyRaw.bucket, DisneyCurated.bucket):
+            s3.create_bucket(Bucket = bucket)
+
+        modules = {'raw': DisneyRaw(), 'curated': DisneyCurated()}
+        stages = {}
+
+        for name, stage in STAGES:
+            module = modules[name]
+            started, peak_rss_before = time.perf_counter(), peak_rss_bytes()
+            getattr(module, stage)()
+            elapsed = time.perf_counter() - started
+            peak_rss = peak_rss_bytes()
+
+            stages[f'{name}.{stage}'] = {
+                'seconds': elapsed,
+                'records_per_second': records / elapsed,
+                # the peak RSS is a high-water mark of the process (see RunMetrics.stage)
+                'peak_rss_growth_bytes': peak_rss - peak_rss_before,
+                'process_peak_rss_bytes': peak_rss
+            }
+
+        summaries = {name: module.metrics.summary() for name, module in modules.items()}
+
+    latencies = {}
+    for summary in summaries.values():
+        for name, latency in summary['latencies'].items():
+            if name in LATENCIES:
+                latencies[name] = latency
+
+    return {
+        'records': records,
+        'stages': stages,
+        'latencies': latencies,
+        'counters': {name: summary['counters'] for name, summary in summaries.items()},
+        'api_requests': api.requests,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+def run_scale_process(records, max_list_size, latency):
+    """
+
+    Runs `run_scale` in a new process, with the offline environment and a fresh stage dir.
+
+    """
+
+    with tempfile.TemporaryDirectory() as stage_dir:
+        result_path = os.path.join(stage_dir, 'result.json')
+        env = {**os.environ, **offline_environment(stage_dir + os.sep)}
+        command = [sys.executable, os.path.abspath(__file__), '--worker', result_path,
+                   '--scales', str(records), '--max-list-size', str(max_list_size), '--latency', str(latency)]
+
+        completed = subprocess.run(command, env = env, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE, text = True)
+        if completed.returncode:
+            raise RuntimeError(f'Scale {records} failed:\n{completed.stderr[-4000:]}')
+
+        with open(result_path, 'r') as f:
+            return json.load(f)
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = ROOT_DIR, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def report(results):
+    print(f"{'records':>8}  {'stage':<16} {'seconds':>9} {'records/s':>12} {'RSS growth MB':>14} {'peak RSS MB':>12}")
+    for scale in results['scales']:
+        for stage, values in scale['stages'].items():
+            print(f"{scale['records']:>8}  {stage:<16} {values['seconds']:>9.3f} "
+                  f"{values['records_per_second']:>12.1f} {values['peak_rss_growth_bytes'] / 2 ** 20:>14.1f} "
+                  f"{values['process_peak_rss_bytes'] / 2 ** 20:>12.1f}")
+
+    print(f"\n{'records':>8}  {'requests':<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for scale in results['scales']:
+        for name, latency in scale['latencies'].items():
+            print(f"{scale['records']:>8}  {name:<20} {latency['count']:>7} {latency['p50'] * 1000:>9.2f} "
+                  f"{latency['p95'] * 1000:>9.2f} {latency['p99'] * 1000:>9.2f}")
+
+def compare(results, baseline, threshold):
+    """
+
+    Prints the throughput change of every stage against `baseline` and returns the list
+    of stages that got slower than `threshold` (i.g. 0.1 for 10%).
+
+    """
+
+    baseline_scales = {scale['records']: scale for scale in baseline['scales']}
+    regressions = []
+
+    print(f"\nComparison with {baseline.get('revision')} ({baseline.get('created_at')}):")
+    for scale in results['scales']:
+        previous = baseline_scales.get(scale['records'])
+        if not previous:
+            continue
+
+        for stage, values in scale['stages'].items():
+            if stage not in previous['stages']:
+                continue
+
+            change = values['records_per_second'] / previous['stages'][stage]['records_per_second'] - 1
+            regression = change < -threshold
+            if regression:
+                regressions.append(f"{scale['records']} {stage}")
+
+            print(f"{scale['records']:>8}  {stage:<16} {change:>+8.1%}{'  REGRESSION' if regression else ''}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description = __doc__, formatter_class = argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', type = int, nargs = '+', default = list(DEFAULT_SCALES),
+                        help = 'quantities of characters served by the API, one run per scale')
+    parser.add_argument('--max-list-size', type = int, default = 3)
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'seconds added to every API response')
+    parser.add_argument('--output', help = 'result file, by default benchmarks/results/pipeline-<timestamp>.json')
+    parser.add_argument('--compare', help = 'previous result file to compare with')
+    parser.add_argument('--threshold', type = float, default = 0.1, help = 'throughput drop reported as a regression')
+    parser.add_argument('--worker', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        result = run_scale(args.scales[0], args.max_list_size, args.latency)
+        with open(args.worker, 'w') as f:
+            json.dump(result, f)
+        return
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'max_list_size': args.max_list_size,
+        'latency': args.latency,
+        'scales': [run_scale_process(records, args.max_list_size, args.latency) for records in args.scales]
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR, f"pipeline-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok = True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent = 2)
+
+    report(results)
+    print(f'\nResults written to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(f'Throughput regressions: {regressions}')
+
+if __name__ == '__main__':
+    main()
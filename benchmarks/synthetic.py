@@ -0,0 +1,41 @@
+import random
+
+from datetime import datetime, timedelta
+
+LIST_FIELDS = ['films', 'shortFilms', 'tvShows', 'videoGames', 'parkAttractions', 'allies', 'enemies']
+
+def make_character(character_id, max_list_size = 3, rng = random):
+    """
+
+    Builds a synthetic character with the same shape as the Disney API `/character` records.
+
+    """
+
+    created_at = datetime(2021, 1, 1) + timedelta(seconds = rng.randint(0, 365 * 24 * 3600))
+    updated_at = created_at + timedelta(seconds = rng.randint(0, 365 * 24 * 3600))
+
+    character = {
+        '_id': character_id,
+        'name': f'Character {character_id}',
+        'sourceUrl': f'https://disney.fandom.com/wiki/Character_{character_id}',
+        'imageUrl': f'https://static.wikia.nocookie.net/disney/images/{character_id}.png',
+        'createdAt': created_at.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        'updatedAt': updated_at.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+        'url': f'https://api.disneyapi.dev/characters/{character_id}',
+        '__v': 0
+    }
+
+    for field in LIST_FIELDS:
+        character[field] = [f'{field} {n}' for n in range(rng.randint(0, max_list_size))]
+
+    return character
+
+def make_characters(count, max_list_size = 3, seed = 42):
+    """
+
+    Builds a reproducible list of `count` synthetic characters.
+
+    """
+
+    rng = random.Random(seed)
+    return [make_character(character_id, max_list_size, rng) for character_id in range(1, count + 1)]
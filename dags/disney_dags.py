@@ -1,4 +1,5 @@
 # from airflow.models.dag import DAG
+from airflow.datasets import Dataset
 from src.dags.base.dag import BaseDAG
 from src.modules.disney import *
 
@@ -7,7 +8,8 @@ class DisneyDAG(BaseDAG):
 
 dags = [
     DisneyDAG(module = DisneyRaw, scheduler = '*/5 * * * *'),
-    DisneyDAG(module = DisneyCurated, scheduler = '*/5 * * * *')
+    # the curated DAG only runs when the raw DAG publishes a new snapshot
+    DisneyDAG(module = DisneyCurated, scheduler = [Dataset(DisneyRaw.dataset)])
 ]
 
 for dag in dags:
@@ -8,8 +8,7 @@ done
 echo "airflow-db is ready!"
 
 ## Set env vars
-airflow variables set TMP_DIR "/tmp/"
-airflow variables set DAGS_CUSTOM_PARAMS '{}'
+# TMP_DIR and DAGS_CUSTOM_PARAMS are environment variables of the scheduler (see docker-compose.yml)
 
 ## Set connections (only required for docker)
 echo "Adding connections ..."
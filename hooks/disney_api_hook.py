@@ -1,5 +1,12 @@
-import requests
+import json, time, requests
 
+from collections import deque
+from functools import cached_property
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .response_cache import ResponseCache
 from airflow.providers.http.hooks.http import HttpHook
 from airflow.exceptions import AirflowException
 
@@ -8,33 +15,229 @@ class DisneyApiHook:
     Creates a Disney API hook to make requests
     Base URL to request: https://api.disneyapi.dev
     Access the public API doc at https://disneyapi.dev/docs/
+
+    Parameters:
+
+        - method(str): http method used by the underlying HttpHook.
+        - page_size(int): quantity of records requested per page on paginated endpoints.
+        - max_workers(int): maximum quantity of pages requested concurrently.
+        - pool_size(int): maximum quantity of keep-alive connections kept by the session.
+                          Defaults to `max_workers`, so every worker can reuse a connection.
+        - timeout(tuple): (connect, read) timeout in seconds applied to every request.
+        - max_retries(int): maximum quantity of retries on connection errors, 429 and 5xx.
+        - backoff_factor(float): exponential backoff factor between retries. A `Retry-After`
+                                 header sent by the API takes precedence over it.
+        - cache_dir(str): directory of the conditional-request response cache. When it is
+                          not provided, responses are not cached.
+        - cache_staging_dir(str): directory where new responses are staged until `commit_cache`
+                                  (see ResponseCache). When it is not provided, responses are
+                                  cached right away.
+        - cache_max_bytes(int): maximum size on disk of the response cache.
+        - metrics(RunMetrics): when provided, every request is recorded in it as `disney_api`
+                               (requests, latency and bytes received).
     """
-    
+
+    default_page_size:int = 50
+    default_max_workers:int = 8
+    default_timeout:tuple = (5, 30)
+    default_max_retries:int = 5
+    default_backoff_factor:float = 0.5
+    retry_status_codes:tuple = (429, 500, 502, 503, 504)
+    default_cache_max_bytes:int = 256 * 1024 * 1024
+
     # Deafult http method is defined because this API is GET only.
-    def __init__(self, method = 'GET'):
+    def __init__(self, method = 'GET', page_size = None, max_workers = None, pool_size = None,
+                 timeout = None, max_retries = None, backoff_factor = None,
+                 cache_dir = None, cache_max_bytes = None, cache_staging_dir = None, metrics = None):
         self.hook = HttpHook(method = method, http_conn_id = 'disney_api')
-        self.conn = self.hook.get_connection(self.hook.http_conn_id)
+        self.page_size = page_size or self.default_page_size
+        self.max_workers = max_workers or self.default_max_workers
+        self.pool_size = pool_size or self.max_workers
+        self.timeout = timeout or self.default_timeout
+        self.max_retries = self.default_max_retries if max_retries is None else max_retries
+        self.backoff_factor = self.default_backoff_factor if backoff_factor is None else backoff_factor
+        self._session = None
+        self.metrics = metrics
+
+        if cache_dir:
+            self.cache = ResponseCache(cache_dir, cache_max_bytes or self.default_cache_max_bytes, cache_staging_dir)
+        else:
+            self.cache = None
+
+    @cached_property
+    def conn(self):
+        return self.hook.get_connection(self.hook.http_conn_id)
+
+    @property
+    def session(self):
+        """
+
+        Pooled keep-alive session, created on first use from the HttpHook connection
+        (auth and extra headers included) and shared by every request of this hook.
+
+        """
+
+        if self._session is None:
+            retry = Retry(
+                total = self.max_retries,
+                backoff_factor = self.backoff_factor,
+                status_forcelist = self.retry_status_codes,
+                allowed_methods = frozenset(['GET']),
+                respect_retry_after_header = True,
+                raise_on_status = False
+            )
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = self.pool_size,
+                                  pool_block = True, max_retries = retry)
+
+            session = self.hook.get_conn()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._session = session
+
+        return self._session
 
     def _request_data(self, endpoint, param = None):
-        
-        base_url = str(self.conn.host)
+        data, _ = self._request(endpoint, param)
+        return data
+
+    def _request(self, endpoint, param = None):
+        """
+
+        Requests an endpoint and returns a tuple with the decoded body and a flag telling
+        if the body changed. When the response cache is enabled, the request is sent with
+        the cached validators and a `304 Not Modified` is answered from disk.
+
+        """
+
+        session = self.session
+        # `base_url` is resolved by HttpHook.get_conn from the connection schema, host and port
+        base_url = str(self.hook.base_url or self.conn.host)
 
         if (base_url and not base_url.endswith('/')) and (endpoint and not endpoint.startswith('/')):
             url = base_url + '/' + endpoint
         else:
             url = (base_url or '') + (endpoint or '')
-            
-        if param:
-            response = requests.get(url, params = param)
-        else:
-            response = requests.get(url)
+
+        cache_key = self.cache.key(url, param) if self.cache else None
+        headers = self.cache.validators(cache_key) if self.cache else {}
+
+        started = time.perf_counter()
+        try:
+            response = session.get(url, params = param, headers = headers, timeout = self.timeout)
+        except requests.RequestException as e:
+            raise AirflowException(f'Failed to request API: {e}')
+
+        if self.metrics:
+            self.metrics.observe_request('disney_api', time.perf_counter() - started, bytes_in = len(response.content))
+            if response.status_code == 304:
+                self.metrics.incr('disney_api.not_modified')
+
+        if response.status_code == 304:
+            # only requests sent with the validators of a cached body can be answered with a 304
+            if not headers:
+                raise AirflowException(f'Failed to request API: unexpected 304 for an unconditional request to {url}')
+
+            body = self.cache.get(cache_key)
+            if body is not None:
+                return json.loads(body), False
+
+            # the cached body was evicted after the validators were read, request it again
+            self.cache.discard(cache_key)
+            return self._request(endpoint, param)
 
         if not response.ok:
             raise AirflowException(
                 f'Failed to request API: {response.status_code} | {response.text}')
+
+        if self.cache:
+            self.cache.put(cache_key, response.content,
+                           etag = response.headers.get('ETag'),
+                           last_modified = response.headers.get('Last-Modified'))
+
+        return response.json(), True
+
+    def _request_page(self, endpoint, page):
+        return self._request(endpoint, {'page': page, 'pageSize': self.page_size})
+
+    def _iter_paginated(self, endpoint):
+        """
+
+        Reads every page of a paginated endpoint and yields, in page order, a tuple with
+        the records of the page and a flag telling if the page changed since the last request.
+
+        The first page is requested alone to read the `info` metadata. When `totalPages`
+        is available, the remaining pages are requested concurrently through a thread pool
+        bounded by `self.max_workers`. Only a window of `2 * max_workers` pages is in flight
+        at a time and pages are yielded in order, so memory does not grow with the page count.
+        If the API only reports `nextPage`, pages are followed one at a time.
+
+        """
+
+        first_page, modified = self._request_page(endpoint, 1)
+        info = first_page.get('info') or {}
+        yield self._page_records(first_page), modified
+
+        total_pages = info.get('totalPages')
+
+        if total_pages:
+            pages = iter(range(2, int(total_pages) + 1))
+            with ThreadPoolExecutor(max_workers = self.max_workers) as executor:
+                pending = deque(executor.submit(self._request_page, endpoint, n)
+                                for n in islice(pages, 2 * self.max_workers))
+                while pending:
+                    page, page_modified = pending.popleft().result()
+
+                    next_page = next(pages, None)
+                    if next_page is not None:
+                        pending.append(executor.submit(self._request_page, endpoint, next_page))
+
+                    yield self._page_records(page), page_modified
         else:
-            return response.json()
-        
-    def get_characters(self):
-        characters = self._request_data('character')
-        return characters['data']
\ No newline at end of file
+            page_number = 1
+            while info.get('nextPage'):
+                page_number += 1
+                page, page_modified = self._request_page(endpoint, page_number)
+                info = page.get('info') or {}
+                yield self._page_records(page), page_modified
+
+    @staticmethod
+    def _page_records(page):
+        # the API returns a single object instead of a list when a page has only one record
+        data = page.get('data') or []
+        return data if isinstance(data, list) else [data]
+
+    def commit_cache(self):
+        # publishes the staged responses, their validators are sent from the next request on
+        return self.cache.commit() if self.cache else 0
+
+    def iter_character_pages(self):
+        """
+
+        Yields the characters of the API page by page, as tuples with the records of the page
+        and a flag telling if the page changed since the last request.
+
+        """
+
+        return self._iter_paginated('character')
+
+    def get_characters(self, only_if_modified = False):
+        """
+
+        Returns every character of the API.
+
+        Parameters:
+
+            - only_if_modified(bool): return None when the response cache is enabled and
+                                      every page was answered with `304 Not Modified`.
+
+        """
+
+        characters, modified = [], False
+        for page, page_modified in self.iter_character_pages():
+            characters.extend(page)
+            modified = modified or page_modified
+
+        if only_if_modified and not modified:
+            return None
+
+        return characters
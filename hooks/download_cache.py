@@ -0,0 +1,122 @@
+import os, time, shutil, threading
+
+from hashlib import sha256
+from .json_index import JSONIndex
+
+class DownloadCache:
+    """
+
+    Local disk cache of downloaded S3 objects, versioned by content: every cached copy is
+    stored with the ETag of the object it was downloaded from, and it is only served while
+    the object still has that ETag. It lets `S3Hook.download_file` skip the GET of objects
+    that didn't change since they were last downloaded (or uploaded) on this machine.
+
+    Copies are named after the key and the ETag, so a copy is never served for another
+    version of its object, even when the index is written by concurrent processes.
+    The cache is bounded by `max_bytes`: the least recently used copies are evicted first.
+
+    Parameters:
+
+        - cache_dir(str): directory where the copies and the index are stored.
+        - max_bytes(int): maximum quantity of bytes kept on disk.
+
+    """
+
+    index_file_name = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index = JSONIndex(os.path.join(cache_dir, self.index_file_name))
+
+    def get(self, key, etag):
+        """
+
+        Returns the path of the cached copy of `key` when it was stored with `etag`, and marks
+        it as recently used, or None when there is no copy of this version.
+
+        """
+
+        entry = self.index.read().get(key)
+        if not entry or entry['etag'] != etag:
+            return None
+
+        copy_path = self._copy_path(key, etag)
+        if not os.path.exists(copy_path):
+            return None
+
+        with self.index.update() as index:
+            if key in index:
+                index[key]['last_access'] = time.time()
+
+        return copy_path
+
+    def put(self, key, etag, file_path):
+        """
+
+        Stores a copy of `file_path` as the content of `key` with `etag`, replacing the copy
+        of any previous version. Returns the path of the cached copy.
+
+        """
+
+        copy_path = self._copy_path(key, etag)
+        # copied to a temporary file first, so a concurrent reader never sees a partial copy
+        temp_path = f'{copy_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        shutil.copyfile(file_path, temp_path)
+        os.replace(temp_path, copy_path)
+
+        with self.index.update() as index:
+            previous = index.get(key)
+            if previous and previous['etag'] != etag:
+                self._remove_copy(key, previous['etag'])
+
+            index[key] = {
+                'etag': etag,
+                'size': os.path.getsize(copy_path),
+                'last_access': time.time()
+            }
+
+            self._evict(index, keep = key)
+
+        return copy_path
+
+    def discard(self, keys):
+        """
+
+        Removes the copies of `keys` (i.g. deleted objects) from the cache.
+
+        """
+
+        current = self.index.read()
+        keys = [key for key in keys if key in current]
+        if not keys:
+            return
+
+        with self.index.update() as index:
+            for key in keys:
+                self._remove(index, key)
+
+    def _evict(self, index, keep):
+        # the copy just stored is kept, even when it is bigger than `max_bytes` on its own
+        total_size = sum(entry['size'] for entry in index.values())
+        by_last_access = sorted((k for k in index if k != keep), key = lambda k: index[k]['last_access'])
+
+        for key in by_last_access:
+            if total_size <= self.max_bytes:
+                break
+            total_size -= index[key]['size']
+            self._remove(index, key)
+
+    def _remove(self, index, key):
+        entry = index.pop(key, None)
+        if entry:
+            self._remove_copy(key, entry['etag'])
+
+    def _remove_copy(self, key, etag):
+        try:
+            os.remove(self._copy_path(key, etag))
+        except FileNotFoundError:
+            pass
+
+    def _copy_path(self, key, etag):
+        return os.path.join(self.cache_dir, sha256(f'{key}\n{etag}'.encode()).hexdigest())
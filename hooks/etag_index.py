@@ -0,0 +1,87 @@
+import os
+
+from hashlib import md5
+from .json_index import JSONIndex
+
+def compute_etag(fileobj, multipart_threshold, multipart_chunksize):
+    """
+
+    Computes the ETag that S3 assigns to the content of a binary file-like object when it is
+    uploaded with the given TransferConfig: the MD5 of the content for single part uploads, or
+    the MD5 of the concatenated part digests followed by `-<quantity of parts>` for multipart
+    uploads. The content is read in chunks and the object is rewound to where it started.
+
+    Objects encrypted with SSE-KMS or SSE-C have ETags that are not digests of their content,
+    so they never match and are always uploaded.
+
+    """
+
+    start = fileobj.tell()
+    size = fileobj.seek(0, os.SEEK_END) - start
+    fileobj.seek(start)
+
+    try:
+        if size < multipart_threshold:
+            return _md5(fileobj, size).hexdigest()
+
+        part_digests = [
+            _md5(fileobj, min(multipart_chunksize, size - offset)).digest()
+            for offset in range(0, size, multipart_chunksize)
+        ]
+    finally:
+        fileobj.seek(start)
+
+    return f"{md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}"
+
+def _md5(fileobj, size):
+    digest = md5()
+
+    while size > 0:
+        chunk = fileobj.read(min(size, 1024 * 1024))
+        if not chunk:
+            break
+        digest.update(chunk)
+        size -= len(chunk)
+
+    return digest
+
+
+class ETagIndex:
+    """
+
+    Local JSON index of the ETags of the objects uploaded to a bucket (key -> ETag). It lets
+    `S3Hook` upload content that changed since it was last uploaded from this machine without
+    asking S3 for the object metadata first.
+
+    The index is only a hint: it can be stale (i.g. the object was replaced by another worker),
+    so an upload is never skipped before S3 confirms the ETag with a HEAD request.
+
+    Parameters:
+
+        - index_path(str): path of the JSON index file.
+
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.index = JSONIndex(index_path)
+
+    def get(self, key):
+        return self.index.read().get(key)
+
+    def set(self, key, etag):
+        if self.get(key) == etag:
+            return
+
+        with self.index.update() as index:
+            index[key] = etag
+
+    def discard(self, keys):
+        current = self.index.read()
+        keys = [key for key in keys if key in current]
+        if not keys:
+            return
+
+        with self.index.update() as index:
+            for key in keys:
+                index.pop(key, None)
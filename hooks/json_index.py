@@ -0,0 +1,60 @@
+import os, json, fcntl, threading
+
+from contextlib import contextmanager
+
+class JSONIndex:
+    """
+
+    JSON file holding a dict, shared by the threads and processes of a machine (i.g. the tasks
+    running on the same worker). It is the index of the local caches of the hooks.
+
+    Every change is a read-modify-write cycle made under an exclusive lock of `<path>.lock`, so
+    concurrent writers never drop the changes of each other, and the file is replaced atomically,
+    so readers never see a partial index and don't need the lock.
+
+    Parameters:
+
+        - path(str): path of the JSON file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock_path = f'{path}.lock'
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+
+    def read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextmanager
+    def update(self):
+        """
+
+        Locks the index and yields its current content, which is written back when the block
+        exits without an error.
+
+        """
+
+        # flock excludes the other processes, the threads of this one wait for the thread lock
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                content = self.read()
+                yield content
+                write_file(self.path, json.dumps(content).encode())
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def write_file(path, data):
+    # written to a temporary file first, so a concurrent reader never sees a partial file
+    temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
@@ -0,0 +1,196 @@
+import os, json, time
+
+from hashlib import sha256
+from .json_index import JSONIndex, write_file
+
+class ResponseCache:
+    """
+
+    Local disk cache of HTTP responses used to make conditional requests.
+
+    For every cached URL it keeps the body and the validators sent by the server
+    (`ETag` and `Last-Modified`), so the next request can be sent with `If-None-Match`
+    and `If-Modified-Since` and a `304 Not Modified` answer can be served from disk.
+    The cache is bounded by `max_bytes`: the least recently used bodies are evicted first.
+
+    With a `staging_dir`, new responses are staged there and only served (and their validators
+    only sent) after `commit`, so a run that fails before publishing what it requested doesn't
+    turn the requests of the next run into `304 Not Modified` answers.
+
+    Parameters:
+
+        - cache_dir(str): directory where the bodies and the index are stored.
+        - max_bytes(int): maximum quantity of bytes kept on disk.
+        - staging_dir(str): directory where the responses are staged until `commit`, in the
+                            same file system as `cache_dir`. When it is not provided, responses
+                            are cached right away.
+
+    """
+
+    index_file_name = 'index.json'
+
+    def __init__(self, cache_dir, max_bytes = 256 * 1024 * 1024, staging_dir = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.staging_dir = staging_dir
+        self.index = JSONIndex(os.path.join(cache_dir, self.index_file_name))
+
+        if staging_dir:
+            os.makedirs(staging_dir, exist_ok = True)
+
+    @staticmethod
+    def key(url, params = None):
+        """
+
+        Builds the cache key of a request from its url and query parameters.
+
+        """
+
+        query = '&'.join(f'{k}={v}' for k, v in sorted((params or {}).items()))
+        return sha256(f'{url}?{query}'.encode()).hexdigest()
+
+    def validators(self, key):
+        """
+
+        Returns the conditional headers for a cached key, or an empty dict when the key
+        (or its body) is not available, so that the request is sent unconditionally.
+
+        """
+
+        entry = self.index.read().get(key)
+        if not entry or not os.path.exists(self._body_path(key)):
+            return {}
+
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def get(self, key):
+        """
+
+        Returns the cached body of a key and marks it as recently used,
+        or None if it was evicted in the meantime.
+
+        """
+
+        if key not in self.index.read():
+            return None
+
+        try:
+            with open(self._body_path(key), 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+
+        with self.index.update() as index:
+            if key in index:
+                index[key]['last_access'] = time.time()
+
+        return body
+
+    def put(self, key, body, etag = None, last_modified = None):
+        """
+
+        Stores a response body with its validators, or stages it until `commit` when the
+        cache has a `staging_dir`. Responses without validators are not cached, because they
+        can never be answered with a `304`.
+
+        """
+
+        if not (etag or last_modified):
+            return
+
+        entry = {'etag': etag, 'last_modified': last_modified, 'size': len(body)}
+
+        if self.staging_dir:
+            # the entry is written after the body, so a staged entry always has its whole body
+            write_file(os.path.join(self.staging_dir, key), body)
+            write_file(os.path.join(self.staging_dir, f'{key}.json'), json.dumps(entry).encode())
+            return
+
+        # the body is replaced under the lock, so it always matches the validators of the index
+        with self.index.update() as index:
+            write_file(self._body_path(key), body)
+            index[key] = {**entry, 'last_access': time.time()}
+
+            self._evict(index)
+
+    def commit(self):
+        """
+
+        Moves the staged responses into the cache, replacing the cached versions of their keys,
+        and returns the quantity of committed responses.
+
+        """
+
+        if not self.staging_dir:
+            return 0
+
+        try:
+            entry_names = [name for name in os.listdir(self.staging_dir) if name.endswith('.json')]
+        except FileNotFoundError:
+            return 0
+
+        if not entry_names:
+            return 0
+
+        with self.index.update() as index:
+            for entry_name in entry_names:
+                entry_path = os.path.join(self.staging_dir, entry_name)
+                key = entry_name[:-len('.json')]
+
+                with open(entry_path, 'r') as f:
+                    entry = json.load(f)
+                os.replace(os.path.join(self.staging_dir, key), self._body_path(key))
+                os.remove(entry_path)
+
+                index[key] = {**entry, 'last_access': time.time()}
+
+            self._evict(index)
+
+        return len(entry_names)
+
+    def discard(self, key):
+        """
+
+        Removes a single key from the cache.
+
+        """
+
+        with self.index.update() as index:
+            self._remove(index, key)
+
+    def clear(self):
+        """
+
+        Removes every cached body, forcing the next requests to be sent unconditionally.
+
+        """
+
+        with self.index.update() as index:
+            for key in list(index):
+                self._remove(index, key)
+
+    def _evict(self, index):
+        total_size = sum(entry['size'] for entry in index.values())
+        by_last_access = sorted(index, key = lambda k: index[k]['last_access'])
+
+        for key in by_last_access:
+            if total_size <= self.max_bytes:
+                break
+            total_size -= index[key]['size']
+            self._remove(index, key)
+
+    def _remove(self, index, key):
+        index.pop(key, None)
+        try:
+            os.remove(self._body_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _body_path(self, key):
+        return os.path.join(self.cache_dir, key)
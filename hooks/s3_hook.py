@@ -1,26 +1,81 @@
 # See the link below for the official documentation of boto3 S3 resource
 # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html
 
+import io
 import os
-from pathlib import Path
+import queue
+import shutil
+import threading
+import time
+from functools import cached_property, partial
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 
 from airflow.exceptions import AirflowException
+from airflow.utils.log.logging_mixin import LoggingMixin
 from airflow.providers.amazon.aws.hooks.s3 import S3Hook as AirflowS3Hook
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
+from .etag_index import ETagIndex, compute_etag
+from .download_cache import DownloadCache
 
-class S3Hook:
+class S3Hook(LoggingMixin):
     """
 
     Creates a hook to a specific S3 bucket.
     You should specify the bucket name when initializing this object.
 
+    Parameters:
+
+        - bucket_name(str): name of the bucket.
+        - max_workers(int): maximum quantity of objects uploaded concurrently by `upload_files`.
+        - multipart_threshold(int): size in bytes from which uploads are split in multiple parts.
+        - multipart_chunksize(int): size in bytes of each part of a multipart upload.
+        - max_concurrency(int): maximum quantity of threads used to send the parts of one object.
+        - etag_index_path(str): path of a local index of the ETags of the uploaded objects. It lets
+                                uploads with `skip_unchanged` of content that changed since it was
+                                last uploaded from this machine avoid a HEAD request (see ETagIndex).
+        - download_cache_dir(str): directory of a local cache of the downloaded objects, versioned
+                                   by ETag. Downloads of objects whose ETag didn't change since
+                                   they were last downloaded or uploaded by a hook with the same
+                                   cache are served from disk, without a GET (see DownloadCache).
+        - metrics(RunMetrics): when provided, every request is recorded in it as `s3.<operation>`
+                               (requests, latency and bytes sent or received).
+
     """
 
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, max_workers = 8, multipart_threshold = 8 * 1024 * 1024,
+                 multipart_chunksize = 8 * 1024 * 1024, max_concurrency = 4, etag_index_path = None,
+                 download_cache_dir = None, metrics = None):
         self.hook = AirflowS3Hook()
-        self.s3_bucket = self.hook.get_bucket(bucket_name)
-
-    def upload_file(self, file_path, key):
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.transfer_config = TransferConfig(
+            multipart_threshold = multipart_threshold,
+            multipart_chunksize = multipart_chunksize,
+            max_concurrency = max_concurrency
+        )
+        self.etag_index = ETagIndex(etag_index_path) if etag_index_path else None
+        self.download_cache = DownloadCache(download_cache_dir) if download_cache_dir else None
+        self.metrics = metrics
+
+    @cached_property
+    def s3_bucket(self):
+        return self.hook.get_bucket(self.bucket_name)
+
+    @property
+    def client(self):
+        # boto3 clients are thread-safe, unlike the bucket resource
+        return self.s3_bucket.meta.client
+
+    @cached_property
+    def _conditions(self):
+        # headers of the conditional PUT of each thread (see `put_object_if`)
+        conditions = threading.local()
+        self.client.meta.events.register('before-call.s3.PutObject', partial(add_condition_headers, conditions))
+        return conditions
+
+    def upload_file(self, file_path, key, skip_unchanged = False):
         """
 
         It uploads a file to a s3 bucket
@@ -30,18 +85,186 @@ class S3Hook:
             - file_path(str): path where file is located
             - key(str): S3 key that will point to the file.
                         Should be in format path/to/<my_file>.<extension> 
-        
+            - skip_unchanged(optional): skips the upload when the object already holds the
+                        same content (see `is_unchanged`).
+
+        Returns False when the upload was skipped, True otherwise.
+
         """
 
         if not(os.path.exists(file_path)):
             raise AirflowException("File does not exists.")
-        
-        self.s3_bucket.upload_file(file_path, key)
+
+        etag = None
+        if skip_unchanged or self.download_cache:
+            with open(file_path, 'rb') as f:
+                etag = self.content_etag(f)
+
+        if skip_unchanged and self.is_unchanged(key, etag):
+            self._cache_upload(key, etag, file_path)
+            return False
+
+        started = time.perf_counter()
+        self.client.upload_file(file_path, self.s3_bucket.name, key, Config = self.transfer_config)
+        self._observe('upload', started, bytes_out = os.path.getsize(file_path))
+        self._remember_etag(key, etag)
+        self._cache_upload(key, etag, file_path)
+
+        return True
+
+    def upload_fileobj(self, data, key, skip_unchanged = False):
+        """
+
+        It uploads in-memory data to a s3 bucket, without writing it to a local file
+
+        Parameters:
+
+            - data(bytes | file-like | iterable): the content to upload. It can be bytes, a binary
+                        file-like object (i.g. io.BytesIO) or an iterable of bytes chunks (i.g. a
+                        generator), which is streamed without being fully loaded in memory.
+            - key(str): S3 key that will point to the file.
+                        Should be in format path/to/<my_file>.<extension>
+            - skip_unchanged(optional): skips the upload when the object already holds the
+                        same content (see `is_unchanged`). Ignored for iterables and
+                        non-seekable objects, whose content can't be hashed before it is sent.
+
+        Returns False when the upload was skipped, True otherwise.
+
+        """
+
+        if isinstance(data, (bytes, bytearray)):
+            data = io.BytesIO(data)
+        elif not hasattr(data, 'read'):
+            data = IterStream(data)
+
+        etag = None
+        if skip_unchanged and data.seekable():
+            etag = self.content_etag(data)
+            if self.is_unchanged(key, etag):
+                return False
+
+        size = 0
+        if data.seekable():
+            start = data.tell()
+            size = data.seek(0, io.SEEK_END) - start
+            data.seek(start)
+
+        started = time.perf_counter()
+        self.client.upload_fileobj(data, self.s3_bucket.name, key, Config = self.transfer_config)
+        self._observe('upload', started, bytes_out = size)
+        self._remember_etag(key, etag)
+
+        return True
+
+    def content_etag(self, fileobj):
+        """
+
+        Returns the ETag S3 will assign to the content of a seekable binary file-like object
+        when it is uploaded by this hook (it depends on the multipart settings).
+
+        """
+
+        return compute_etag(fileobj, self.transfer_config.multipart_threshold,
+                            self.transfer_config.multipart_chunksize)
+
+    def get_etag(self, key):
+        """
+
+        Returns the ETag of an object, without quotes, or None if the object does not exist.
+
+        """
+
+        started = time.perf_counter()
+        try:
+            response = self.client.head_object(Bucket = self.s3_bucket.name, Key = key)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        finally:
+            self._observe('head', started)
+
+        return response['ETag'].strip('"')
+
+    def is_unchanged(self, key, etag):
+        """
+
+        Checks whether the object `key` already has the ETag `etag`, with a HEAD request, which
+        is cheaper than a PUT. The local ETag index only saves the HEAD when it holds another ETag
+        for the key: a match in the index is always confirmed by S3, because the object may have
+        been replaced by another worker or out of band since it was indexed.
+
+        """
+
+        indexed_etag = self.etag_index.get(key) if self.etag_index else None
+        if indexed_etag is not None and indexed_etag != etag:
+            return False
+
+        remote_etag = self.get_etag(key)
+        if remote_etag != etag:
+            return False
+
+        self._remember_etag(key, etag)
+        return True
+
+    def _observe(self, operation, started, bytes_in = 0, bytes_out = 0):
+        if self.metrics:
+            self.metrics.observe_request(f's3.{operation}', time.perf_counter() - started,
+                                         bytes_in = bytes_in, bytes_out = bytes_out)
+
+    def _remember_etag(self, key, etag):
+        if self.etag_index is None:
+            return
+
+        if etag:
+            self.etag_index.set(key, etag)
+        else:
+            # content uploaded without a hash, the indexed ETag may be stale
+            self.etag_index.discard([key])
+
+    def _cache_upload(self, key, etag, file_path):
+        # the uploaded content is the object's next version: a later download on this machine
+        # (i.g. by the next layer of the pipeline) is served from the cache
+        if self.download_cache and self.download_cache.get(key, etag) is None:
+            self.download_cache.put(key, etag, file_path)
+
+    def upload_files(self, files, max_workers = None, skip_unchanged = False):
+        """
+
+        It uploads many files concurrently through a bounded thread pool
+
+        Parameters:
+
+            - files(iterable): tuples (source, key), where source is a local file path or
+                               anything accepted by `upload_fileobj`.
+            - max_workers(optional): maximum quantity of concurrent uploads, defaults to `self.max_workers`.
+            - skip_unchanged(optional): skips the files whose content is already in the bucket.
+
+        """
+
+        with self.bulk_uploader(max_workers) as uploader:
+            for source, key in files:
+                uploader.submit(source, key, skip_unchanged = skip_unchanged)
+
+    def bulk_uploader(self, max_workers = None):
+        """
+
+        Returns a BulkUploader: a context manager that uploads the submitted files in
+        background threads and waits for every upload when it exits.
+
+        """
+
+        return BulkUploader(self, max_workers or self.max_workers)
 
     def download_file(self, key, file_path):
         """
 
         It downloads a file from a s3 bucket 
+
+        With a download cache (see `download_cache_dir`), the ETag of the object is checked with
+        a HEAD request first, and the GET is skipped when the cache holds a copy of this version.
+        Otherwise, the object is downloaded, and it is only stored in the cache when its ETag is
+        still the same after the download (it was not replaced during the GET).
         
         Parameters:
 
@@ -50,65 +273,514 @@ class S3Hook:
 
         """
 
+        if self.download_cache is None:
+            self._download(key, file_path)
+            return
+
+        etag = self.get_etag(key)
+        if etag is None:
+            raise AirflowException("The object does not exists.")
+
+        cached_path = self.download_cache.get(key, etag)
+        if cached_path is not None:
+            try:
+                shutil.copyfile(cached_path, file_path)
+            except FileNotFoundError:
+                # evicted by another process in the meantime
+                cached_path = None
+
+        if cached_path is not None:
+            if self.metrics:
+                self.metrics.incr('s3.download_cache.hits')
+                self.metrics.incr('s3.download_cache.bytes', os.path.getsize(file_path))
+            return
+
+        self._download(key, file_path)
+        if self.get_etag(key) == etag:
+            self.download_cache.put(key, etag, file_path)
+
+    def _download(self, key, file_path):
+        started = time.perf_counter()
         try:
             self.s3_bucket.download_file(key, file_path)
+            self._observe('download', started, bytes_in = os.path.getsize(file_path))
 
         except ClientError as e:
-            if e.response['Error']['Code'] == "404":
+            # a HEAD answers '404', a GET of an object deleted after the HEAD answers 'NoSuchKey'
+            if e.response['Error']['Code'] in ("404", "NoSuchKey"):
                 raise AirflowException("The object does not exists.")
             else:
                 raise
 
-    def delete_file(self, objlist):
+    def read_object(self, key):
+        """
+
+        Reads a small object (i.g. a manifest) in memory with a single GET, and returns a tuple
+        with its content and its ETag, without quotes. The ETag is the one of the returned content,
+        so it can be used by `put_object_if` to replace this exact version.
+        Returns (None, None) when the object does not exist.
+
         """
 
-        Delete multiple objects from an Amazon S3 Bucket
+        started = time.perf_counter()
+        try:
+            response = self.client.get_object(Bucket = self.bucket_name, Key = key)
+            data = response['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None, None
+            raise
+
+        self._observe('get', started, bytes_in = len(data))
+
+        return data, response['ETag'].strip('"')
+
+    def put_object_if(self, data, key, etag):
+        """
+
+        Conditional PUT of a small object: it only replaces the object if it still has the ETag
+        `etag` (`If-Match`), or, when `etag` is None, only creates it if it does not exist yet
+        (`If-None-Match: *`). S3 checks the condition and writes the object atomically, so of two
+        concurrent writers of the same version, only one succeeds.
+
+        Returns the ETag of the new object, or None when the condition failed (the object was
+        replaced, created or deleted by another writer).
+
+        """
+
+        # sent as headers: the `IfMatch` and `IfNoneMatch` parameters of `put_object` are only
+        # known by botocore >= 1.35, newer than the one of the Airflow constraints
+        conditions = self._conditions
+        conditions.headers = {'If-Match': f'"{etag}"'} if etag else {'If-None-Match': '*'}
+
+        started = time.perf_counter()
+        try:
+            response = self.client.put_object(Bucket = self.bucket_name, Key = key, Body = data)
+        except ClientError as e:
+            # 409 ConditionalRequestConflict: a concurrent conditional write of the same key
+            if e.response['Error']['Code'] in ('PreconditionFailed', 'ConditionalRequestConflict', 'NoSuchKey', '412', '409'):
+                return None
+            raise
+        finally:
+            conditions.headers = None
+            self._observe('upload', started, bytes_out = len(data))
+
+        new_etag = response['ETag'].strip('"')
+        self._remember_etag(key, new_etag)
+        if self.download_cache:
+            self.download_cache.discard([key])
+
+        return new_etag
+
+    def read_range(self, key, start, end):
+        """
+
+        Reads the bytes [start, end) of an object with a ranged GET, without downloading it.
+
+        """
+
+        started = time.perf_counter()
+        try:
+            response = self.client.get_object(Bucket = self.bucket_name, Key = key, Range = f'bytes={start}-{end - 1}')
+            data = response['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise AirflowException("The object does not exists.")
+            raise
+
+        self._observe('range_get', started, bytes_in = len(data))
+
+        return data
+
+    def open(self, key, size = None):
+        """
+
+        Returns a read-only, seekable file-like object over an object (see S3RangeFile), i.g.
+        for `pq.ParquetFile(s3_hook.open(key))` to fetch only the footer and the column chunks
+        that are read. `size` (i.g. from a listing or a manifest) saves a HEAD request.
+
+        """
+
+        if size is None:
+            started = time.perf_counter()
+            try:
+                size = self.client.head_object(Bucket = self.bucket_name, Key = key)['ContentLength']
+            except ClientError as e:
+                if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                    raise AirflowException("The object does not exists.")
+                raise
+            finally:
+                self._observe('head', started)
+
+        return S3RangeFile(self, key, size)
+
+    def delete_file(self, objlist, max_workers = None, max_attempts = 3, batch_size = 1000):
+        """
+
+        Delete multiple objects from an Amazon S3 Bucket.
+        Keys are sent in batches of up to 1000 keys (the limit of a `delete_objects` request),
+        with batches deleted concurrently. Only the keys reported in the `Errors` of a response
+        are retried, with exponential backoff, up to `max_attempts` times.
 
         Parametes:
 
-            - objlist(list): list of objects to delete from the S3 bucket.
-                             Each element of the list should be the key
-                             to the file you want to delete.
-        
+            - objlist(iterable): keys of the objects to delete from the S3 bucket.
+                             Each element should be the key to the file you want to delete.
+                             Generators (i.g. keys from `iter_files`) are consumed lazily.
+            - max_workers(optional): maximum quantity of batches deleted at once, defaults to `self.max_workers`.
+            - max_attempts(optional): maximum quantity of attempts for each key.
+            - batch_size(optional): quantity of keys per request (maximum of 1000).
+
+        Returns a dict with the list of `deleted` keys and the `failed` keys, mapped to their error code.
+
         """
 
-        objects_to_delete = []
-        for obj in objlist:
-            objects_to_delete.append({'Key': obj})
+        batch_size = min(batch_size, 1000)
+        max_workers = max_workers or self.max_workers
+        summary = {'deleted': [], 'failed': {}}
+
+        keys = iter(objlist)
+        batches = iter(lambda: list(islice(keys, batch_size)), [])
+
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            # at most 2 batches per worker are in flight, so huge key iterables are never fully loaded
+            pending = set()
+            for batch in batches:
+                pending.add(executor.submit(self._delete_batch, batch, max_attempts))
+
+                if len(pending) >= 2 * max_workers:
+                    finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+                    self._merge_delete_results(summary, finished)
 
-        self.s3_bucket.delete_objects(Delete={
-            'Objects': objects_to_delete
-        })
+            self._merge_delete_results(summary, wait(pending).done)
 
-    def list_files_from_bucket(self, filter_by_ext=''):
+        if self.etag_index:
+            self.etag_index.discard(summary['deleted'])
+        if self.download_cache:
+            self.download_cache.discard(summary['deleted'])
+
+        if summary['failed']:
+            self.log.warning(f"{len(summary['failed'])} objects could not be deleted from "
+                             f"{self.s3_bucket.name}, i.g. {next(iter(summary['failed'].items()))}")
+
+        return summary
+
+    def _delete_batch(self, keys, max_attempts):
+        deleted, failed = [], {}
+
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1) * 0.5, 10))
+
+            started = time.perf_counter()
+            try:
+                response = self.client.delete_objects(Bucket = self.s3_bucket.name, Delete = {
+                    'Objects': [{'Key': key} for key in keys],
+                    'Quiet': True
+                })
+            except ClientError as e:
+                # the whole request failed (i.g. throttling), every key of the batch is retried
+                failed = {key: e.response['Error']['Code'] for key in keys}
+                continue
+
+            finally:
+                self._observe('delete', started)
+
+            # in quiet mode, S3 only reports the keys that could not be deleted
+            failed = {error['Key']: error.get('Code') for error in response.get('Errors', [])}
+            deleted.extend(key for key in keys if key not in failed)
+
+            keys = [key for key in keys if key in failed]
+            if not keys:
+                break
+
+        return deleted, failed
+
+    @staticmethod
+    def _merge_delete_results(summary, futures):
+        for future in futures:
+            deleted, failed = future.result()
+            summary['deleted'].extend(deleted)
+            summary['failed'].update(failed)
+
+    def list_files_from_bucket(self, filter_by_ext='', prefix=''):
         """
 
-        Read all files from `self.s3_bucket`
+        Read all files from `self.s3_bucket` and return them in a list.
+        For big buckets, prefer `iter_files`, which yields the files lazily.
 
         Parameters:
 
             - filter_by_ext(optional): return only files with provided extension. Eg: '.csv' '.txt'
+            - prefix(optional): return only files whose key starts with the prefix. Eg: 'path/to/'
             
         """
 
-        s3_files = self.s3_bucket.objects.all()
-        parsed_files = []
+        return list(self.iter_files(prefix = prefix, filter_by_ext = filter_by_ext))
+
+    def iter_files(self, prefix='', filter_by_ext='', start_after=None, delimiter=None, page_size=1000):
+        """
+
+        Lazily yields the files of `self.s3_bucket`, one page of `list_objects_v2` at a time.
+        Prefix, start after and delimiter are applied by S3, so only matching keys are listed.
+
+        Parameters:
+
+            - prefix(optional): list only keys starting with the prefix. Eg: 'path/to/'
+            - filter_by_ext(optional): yield only files with provided extension. Eg: '.csv' '.txt'
+            - start_after(optional): list only keys after this key, in lexicographic order.
+            - delimiter(optional): with '/', list only the files directly under `prefix`.
+            - page_size(optional): quantity of keys requested per page (maximum of 1000).
+
+        """
+
+        params = {'Bucket': self.s3_bucket.name, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        if delimiter:
+            params['Delimiter'] = delimiter
+
+        paginator = self.client.get_paginator('list_objects_v2')
+        filter_by_ext = filter_by_ext.lower()
+
+        started = time.perf_counter()
+        for page in paginator.paginate(**params, PaginationConfig = {'PageSize': page_size}):
+            self._observe('list', started)
+
+            for s3_file in page.get('Contents', []):
+                key = s3_file['Key']
+                file_name = key.rsplit('/', 1)[-1]
+
+                if filter_by_ext and not os.path.splitext(file_name)[1].lower() == filter_by_ext:
+                    continue
+
+                yield {
+                    'file_name': file_name,
+                    'file_path': key,
+                    'last_modified': s3_file['LastModified'],
+                    'size': s3_file['Size']
+                }
+
+            started = time.perf_counter()
+
+    def iter_prefixes(self, prefix='', delimiter='/'):
+        """
+
+        Lazily yields the "sub-directories" (common prefixes) directly under `prefix`.
+        Eg: the partitions of a dataset, such as 'path/to/date=2024-01-01/'
+
+        """
+
+        paginator = self.client.get_paginator('list_objects_v2')
+
+        for page in paginator.paginate(Bucket = self.s3_bucket.name, Prefix = prefix, Delimiter = delimiter):
+            for common_prefix in page.get('CommonPrefixes', []):
+                yield common_prefix['Prefix']
+
+    def iter_files_from_prefixes(self, prefixes, filter_by_ext='', max_workers=None, page_size=1000):
+        """
+
+        Lists several prefixes in parallel, through a bounded thread pool, and lazily yields
+        their files as they are listed. Files of different prefixes are interleaved.
 
-        for s3_file in s3_files:
+        Parameters:
 
-            file_info = Path(s3_file.key)
+            - prefixes(list): prefixes to list. Eg: the partitions returned by `iter_prefixes`
+            - filter_by_ext(optional): yield only files with provided extension. Eg: '.csv' '.txt'
+            - max_workers(optional): maximum quantity of prefixes listed at once.
+            - page_size(optional): quantity of keys requested per page (maximum of 1000).
 
-            file_ext = file_info.suffix
-            file_name = file_info.stem
+        """
 
-            if filter_by_ext:
-                if not file_ext.lower() == filter_by_ext.lower():
+        prefixes = list(prefixes)
+        files = queue.Queue(maxsize = page_size)
+        stop = threading.Event()
+        done = object()
+
+        def put(item):
+            # gives up when the consumer stopped reading, so the worker threads never hang
+            while not stop.is_set():
+                try:
+                    files.put(item, timeout = 0.1)
+                    return True
+                except queue.Full:
                     continue
+            return False
+
+        def list_prefix(prefix):
+            try:
+                for file in self.iter_files(prefix = prefix, filter_by_ext = filter_by_ext, page_size = page_size):
+                    if not put(file):
+                        return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers = max_workers or self.max_workers) as executor:
+            for prefix in prefixes:
+                executor.submit(list_prefix, prefix)
+
+            try:
+                pending = len(prefixes)
+                while pending:
+                    item = files.get()
+
+                    if item is done:
+                        pending -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                stop.set()
+
+
+class BulkUploader:
+    """
+
+    Uploads files to S3 through a bounded thread pool. `submit` blocks while `2 * max_workers`
+    uploads are in flight, so in-memory sources never pile up. Leaving the context waits for
+    every upload and raises an AirflowException if any of them failed.
+
+    """
+
+    def __init__(self, s3_hook, max_workers):
+        self.s3_hook = s3_hook
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+        self.slots = threading.BoundedSemaphore(2 * max_workers)
+        self.futures = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.executor.shutdown(wait = True)
+
+        errors = [future.exception() for future in self.futures if future.exception()]
+        if errors and exc_type is None:
+            raise AirflowException(f"{len(errors)} of {len(self.futures)} uploads failed: {errors[0]}")
+
+    def submit(self, source, key, skip_unchanged = False):
+        self.slots.acquire()
+
+        if isinstance(source, (str, os.PathLike)):
+            future = self.executor.submit(self.s3_hook.upload_file, source, key, skip_unchanged)
+        else:
+            future = self.executor.submit(self.s3_hook.upload_fileobj, source, key, skip_unchanged)
+
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+
+        return future
+
+
+class IterStream(io.RawIOBase):
+    """
+
+    Read-only binary file-like object over an iterable of bytes chunks.
+
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.leftover = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.leftover:
+            try:
+                self.leftover = next(self.chunks)
+            except StopIteration:
+                return 0
+
+        size = min(len(buffer), len(self.leftover))
+        buffer[:size] = self.leftover[:size]
+        self.leftover = self.leftover[size:]
+
+        return size
+
+
+class S3RangeFile(io.RawIOBase):
+    """
+
+    Read-only, seekable binary file-like object over a S3 object: every read is a ranged GET
+    of the requested bytes, so readers that seek (i.g. Parquet, which reads the footer and
+    then only the needed column chunks) never download the whole object. The bytes of the
+    last GET are kept, so reads inside of them (i.g. the column chunks of a small file whose
+    footer read fetched it whole) don't send another request.
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket of the object.
+        - key(str): key of the object.
+        - size(int): size of the object in bytes.
+
+    """
+
+    def __init__(self, s3_hook, key, size):
+        self.s3_hook = s3_hook
+        self.key = key
+        self.size = size
+        self.position = 0
+        # (start, bytes) of the last GET
+        self.block = (0, b'')
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f'Invalid whence {whence}')
+
+        if position < 0:
+            raise ValueError('Negative seek position')
+
+        self.position = position
+        return position
+
+    def read(self, size = -1):
+        # a single ranged GET, also for `read()` until the end of the object
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+
+        data = self._fetch(self.position, end)
+        self.position += len(data)
+
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+
+    def _fetch(self, start, end):
+        block_start, block = self.block
+        if block_start <= start and end <= block_start + len(block):
+            return block[start - block_start:end - block_start]
+
+        data = self.s3_hook.read_range(self.key, start, end)
+        self.block = (start, data)
+
+        return data
 
-            parsed_files.append({
-                'file_name': f'{file_name}{file_ext}',
-                'file_path': s3_file.key,
-                'last_modified': s3_file.last_modified
-            })
 
-        return parsed_files
+def add_condition_headers(conditions, params, **kwargs):
+    # `before-call` handler: adds the headers of the conditional PUT of the current thread, if any
+    params['headers'].update(getattr(conditions, 'headers', None) or {})
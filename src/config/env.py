@@ -1,7 +1,51 @@
 from airflow.models.variable import Variable
 
-# stage area dir
-TMP_DIR = Variable.get('TMP_DIR')
+# The DAG files are parsed in a new process on every parse loop, so the Variables read at parse
+# time can't be cached in memory. To keep the parsing off the metadata database:
+#   - set them as `AIRFLOW_VAR_<KEY>` environment variables (i.g. `AIRFLOW_VAR_TMP_DIR`), which
+#     Airflow reads before querying the database (see docker-compose.yml);
+#   - enable the Airflow secrets cache (`AIRFLOW__SECRETS__USE_CACHE=True`), shared by the
+#     parsing processes, for the ones that are stored in the database.
+# Variables often hold secrets, they are never written to disk by this module.
 
-# DAGS CUSTOM PARAMS
-DAGS_CUSTOM_PARAMS = Variable.get('DAGS_CUSTOM_PARAMS', deserialize_json=True)
+_missing = object()
+
+def get_variable(key, default = _missing, deserialize_json = False):
+    """
+
+    Returns an Airflow Variable, read from the environment (`AIRFLOW_VAR_<KEY>`), the secrets
+    backends or the metadata database, in that order.
+
+    Parameters:
+
+        - key(str): name of the Variable.
+        - default(optional): value returned when the Variable does not exist. Without a default,
+                             a missing Variable raises a KeyError.
+        - deserialize_json(bool): parses the Variable as JSON.
+
+    """
+
+    value = Variable.get(key, default_var = None, deserialize_json = deserialize_json)
+    if value is None:
+        if default is _missing:
+            raise KeyError(f'Variable {key} does not exist')
+        return default
+
+    return value
+
+def get_tmp_dir():
+    # stage area dir
+    return get_variable('TMP_DIR')
+
+def get_dags_custom_params():
+    # DAGS CUSTOM PARAMS
+    return get_variable('DAGS_CUSTOM_PARAMS', default = {}, deserialize_json = True)
+
+def __getattr__(name):
+    # `TMP_DIR` and `DAGS_CUSTOM_PARAMS` used to be read on import, they are now resolved on access
+    if name == 'TMP_DIR':
+        return get_tmp_dir()
+    if name == 'DAGS_CUSTOM_PARAMS':
+        return get_dags_custom_params()
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
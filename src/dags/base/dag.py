@@ -1,4 +1,8 @@
+from typing import Union
+
 from airflow.models import DAG
+from airflow.datasets import Dataset
+from airflow.models.baseoperator import chain
 
 from airflow.operators.dummy import DummyOperator
 from airflow.operators.python import PythonOperator
@@ -7,7 +11,7 @@ from src.modules.base.module import BaseModule
 
 from datetime import datetime, timedelta
 from src.modules.slack import task_fail_slack_alert
-from src.config.env import DAGS_CUSTOM_PARAMS
+from src.config.env import get_dags_custom_params
 
 
 class BaseDAG(DAG):
@@ -24,12 +28,16 @@ class BaseDAG(DAG):
             - module (BaseModule): a class that inherits from BaseModule. This is the class that implements the
                       actual code that runs inside of the databases and transformations.
 
-            - scheduler (str): a cron schedule code following Airflow's model:
+            - scheduler (str | list): a cron schedule code following Airflow's model:
                          'minute hour day-of-month month day-of-week'
+                         or a list of Airflow Datasets (or their URIs), so the DAG runs when every
+                         one of them was updated, i.g. `[Dataset(DisneyRaw.dataset)]`.
 
             - limit (int): maximum quantity of rows that can be extracted from the database.
+                           Honored by modules running chunked (see the `chunked` flag).
 
-            - chunk_size (int): maxium quantity of rows that can be loaded to the data lake with each run
+            - chunk_size (int): maxium quantity of rows that can be loaded to the data lake with each run.
+                                In chunked mode, it is the quantity of rows processed by each mapped task.
 
         Kwargs:
 
@@ -46,17 +54,23 @@ class BaseDAG(DAG):
 
     default_tags:list = []
 
-    def __init__(self, module:BaseModule, scheduler:str = '@once',
+    def __init__(self, module:BaseModule, scheduler:Union[str, list] = '@once',
                  limit:int = 10_000, chunk_size:int = 20_000, **kwargs):
 
         self.module = module()
         self.dag_name = kwargs.get("dag_name") if kwargs.get("dag_name") else self.module.dag_name
         self.timeout = timedelta(hours= kwargs.get("timout_hours")) if kwargs.get("timout_hours") else timedelta(hours=1)
 
-        self.scheduler, self.limit, self.chunk_size, aditional_tags, flags = self._get_variables(scheduler, limit, chunk_size)
+        self.scheduler, self.limit, self.chunk_size, aditional_tags, self.flags, transform_workers, engine, \
+            self.max_active_runs = self._get_variables(scheduler, limit, chunk_size)
         self.tags = self.default_tags + aditional_tags
+        self.module.limit, self.module.chunk_size = self.limit, self.chunk_size
+        if transform_workers:
+            self.module.transform_workers = int(transform_workers)
+        if engine:
+            self.module.engine = engine
 
-        alert_function, timeout = self._parse_flags(flags)
+        alert_function, timeout = self._parse_flags(self.flags)
         
         default_args = {
             'owner': 'airflow',
@@ -67,7 +81,7 @@ class BaseDAG(DAG):
         }
 
         super().__init__(dag_id = self.dag_name, default_args = default_args, 
-                         max_active_runs = 1, schedule_interval = self.scheduler, 
+                         max_active_runs = self.max_active_runs, schedule = self.scheduler, 
                          catchup = False, tags = self.tags, 
                          dagrun_timeout = timeout)
 
@@ -79,6 +93,28 @@ class BaseDAG(DAG):
 
         start > extract > load > delete_temp_files > end
 
+        When the module defines a `compaction_prefix`, a compaction task runs right after the load
+        (start > extract > load > compact > delete_temp_files > end), unless the DAG has the
+        `no-compaction` flag.
+
+        With the `chunked` flag, modules that implement the chunk steps (see `BaseModule.plan_chunks`)
+        are split in chunks of up to `chunk_size` rows, over at most `limit` rows, and each chunk runs in
+        its own mapped task (Airflow dynamic task mapping), in parallel on the available workers:
+
+        start > plan_chunks > process_chunk (one per chunk) > finalize_chunks [> compact] > clean_stage_area > end
+
+        Temporary files are written to a stage dir of the run (see `BaseModule.run_dir`), removed by
+        the last task (`delete_temp_files` or `clean_stage_area`), so runs of the same DAG never share
+        their files (see the `max_active_runs` custom param).
+
+        When the module defines a `dataset`, it is the outlet of the task that publishes the data
+        (`load` or `finalize_chunks`): every successful run emits a Dataset event, which triggers the
+        DAGs scheduled on it. Skipped tasks don't emit events.
+
+        Every task callable is instrumented (see `BaseModule.instrument`): its wall time, peak memory,
+        records, bytes and requests are emitted through Airflow's metrics (StatsD/OpenTelemetry) and
+        the summary of the task is pushed to XCom with the key `metrics`.
+
         It should be noted that, to use this BaseDAG with the dafault build sequence, the base module
         must use the default names: `extract`, `load` and `delete_temp_file`. Otherwise, the method
         must be overwritten.
@@ -91,29 +127,76 @@ class BaseDAG(DAG):
                 task_id = 'start_task'
             )
 
-            extract_task = PythonOperator(
-                task_id = 'extract_task',
-                python_callable = self.module.extract
-            )
-            
-            load_task = PythonOperator(
-                task_id='load_task',
-                python_callable=self.module.load
-            )
-
-            delete_temp_file = PythonOperator(
-                task_id='delete_temp_file_task',
-                python_callable=self.module.delete_temp_file,
-            )
-
             end_task = DummyOperator(
                 task_id = 'end_task'
             )
 
-            start_task >> extract_task >> load_task >> delete_temp_file >> end_task
+            # tasks that load the data, and tasks that clean up after the load
+            if self.module.chunked:
+                load_tasks, cleanup_tasks = self._build_chunked_tasks()
+            else:
+                load_tasks, cleanup_tasks = self._build_tasks()
+
+            if self.module.compaction_prefix and 'no-compaction' not in self.flags:
+                compact_task = PythonOperator(
+                    task_id='compact_task',
+                    python_callable=self.module.instrument('compact', self.module.compact)
+                )
+
+                load_tasks.append(compact_task)
+
+            chain(start_task, *load_tasks, *cleanup_tasks, end_task)
 
         return self
 
+    def _build_tasks(self):
+        extract_task = PythonOperator(
+            task_id = 'extract_task',
+            python_callable = self.module.instrument('extract', self.module.extract)
+        )
+        
+        load_task = PythonOperator(
+            task_id='load_task',
+            python_callable=self.module.instrument('load', self.module.load),
+            outlets=self._outlets()
+        )
+
+        delete_temp_file = PythonOperator(
+            task_id='delete_temp_file_task',
+            python_callable=self.module.instrument('delete_temp_file', self.module.delete_temp_file),
+        )
+
+        return [extract_task, load_task], [delete_temp_file]
+
+    def _build_chunked_tasks(self):
+        plan_chunks_task = PythonOperator(
+            task_id = 'plan_chunks_task',
+            python_callable = self.module.instrument('plan_chunks', self.module.plan_chunks)
+        )
+
+        # one mapped task instance per chunk, with the chunk as keyword arguments
+        process_chunk_task = PythonOperator.partial(
+            task_id = 'process_chunk_task',
+            python_callable = self.module.instrument('process_chunk', self.module.process_chunk)
+        ).expand(op_kwargs = plan_chunks_task.output)
+
+        finalize_chunks_task = PythonOperator(
+            task_id = 'finalize_chunks_task',
+            python_callable = self.module.instrument('finalize_chunks', self.module.finalize_chunks),
+            op_kwargs = {'results': process_chunk_task.output},
+            outlets = self._outlets()
+        )
+
+        clean_stage_area_task = PythonOperator(
+            task_id = 'clean_stage_area_task',
+            python_callable = self.module.instrument('clean_stage_area', self.module.clean_stage_area)
+        )
+
+        return [plan_chunks_task, process_chunk_task, finalize_chunks_task], [clean_stage_area_task]
+
+    def _outlets(self):
+        return [Dataset(self.module.dataset)] if self.module.dataset else []
+
     def _get_variables(self, default_scheduler, default_limit, default_chunk_size):
         """
 
@@ -123,24 +206,47 @@ class BaseDAG(DAG):
 
         The possible parameters are:
 
-        - scheduler (str): the DAG's cron schedule.
+        - scheduler (str | list): the DAG's cron schedule, or a list of Dataset URIs.
         - limit (int): size of the batches to be extracted from the database.
         - chunksize (int): size of the batches to be inserted to the datalake.
         - tags (list): list of tags for the DAG.
         - flags (list): list of modifying flags, all possibilities are presented on the 
                         `_parse_flags` method.
+        - transform_workers (int): quantity of processes that transform the data of a single task
+                                   (see `BaseModule.write_dataset`). By default, it runs in the task process.
+        - engine (str): engine of the module's transform, 'pandas' or 'arrow' (see `BaseModule.engine`).
+        - max_active_runs (int): maximum quantity of runs of the DAG at once, 1 by default. Every run
+                                 stages its files in its own dir (see `BaseModule.run_dir`), but only
+                                 modules whose runs can overlap accept more than 1: it must stay 1 for
+                                 incremental and `write_mode = 'merge'` modules
+                                 (see `BaseModule.supports_concurrent_runs`).
         
         """
 
-        dag_custom_params_env = DAGS_CUSTOM_PARAMS.get(self.dag_name, {})
+        dag_custom_params_env = get_dags_custom_params().get(self.dag_name, {})
 
         scheduler = dag_custom_params_env.get('scheduler', default_scheduler)
+        if isinstance(scheduler, list):
+            scheduler = [dataset if isinstance(dataset, Dataset) else Dataset(dataset) for dataset in scheduler]
         limit = dag_custom_params_env.get('limit', default_limit)
         chunk_size = dag_custom_params_env.get('chunk_size', default_chunk_size)
         tags = dag_custom_params_env.get('tags', [])
         flags = dag_custom_params_env.get('flags', [])
+        transform_workers = dag_custom_params_env.get('transform_workers')
+        engine = dag_custom_params_env.get('engine')
+        max_active_runs = int(dag_custom_params_env.get('max_active_runs', 1))
+
+        if engine not in (None, 'pandas', 'arrow'):
+            raise ValueError(f"Unknown engine {engine} for {self.dag_name}, should be 'pandas' or 'arrow'.")
+
+        if max_active_runs < 1:
+            raise ValueError(f"max_active_runs of {self.dag_name} should be at least 1, got {max_active_runs}.")
 
-        return scheduler, limit, chunk_size, tags, flags
+        if max_active_runs > 1 and not self.module.supports_concurrent_runs():
+            raise ValueError(f"Runs of {type(self.module).__name__} can't overlap, max_active_runs of "
+                             f"{self.dag_name} should be 1, got {max_active_runs}.")
+
+        return scheduler, limit, chunk_size, tags, flags, transform_workers, engine, max_active_runs
     
     def _parse_flags(self, flags_lst):
         """
@@ -157,8 +263,26 @@ class BaseDAG(DAG):
 
         - alert-success: generates an alert if the DAG has successfully ran. *NOT YET IMPLEMENTED*
 
+        - no-compaction: make it so that the compaction task is not built, even if the module defines
+                         a `compaction_prefix`.
+
+        - full-refresh:  make it so that incremental modules ignore their watermark and reprocess
+                         the whole dataset. A single run can also be forced to a full refresh by
+                         triggering it with the configuration `{"full_refresh": true}`.
+
+        - chunked:       make it so that the module runs in chunks of `chunk_size` rows, over at most
+                         `limit` rows, processed by parallel mapped tasks (see `build`).
+
         """
 
+        if 'chunked' in flags_lst:
+            if not self.module.supports_chunks():
+                raise ValueError(f"{type(self.module).__name__} does not implement the chunk steps.")
+            self.module.chunked = True
+
+        if 'full-refresh' in flags_lst:
+            self.module.full_refresh = True
+
         if 'bypass-alert' in flags_lst:
             function = self._bypass_alert
         else:
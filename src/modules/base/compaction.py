@@ -0,0 +1,239 @@
+import os
+import time
+import uuid
+import shutil
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from posixpath import dirname
+from airflow.exceptions import AirflowException
+from airflow.utils.log.logging_mixin import LoggingMixin
+from src.modules.base.manifest import DatasetManifest, file_entry, is_hidden
+from src.modules.base.merge import KeyIndex, backoff_delay, manifest_changed
+
+class ParquetCompactor(LoggingMixin):
+    """
+
+    Rewrites the small Parquet objects of a dataset stored in S3 into fewer, bigger files.
+
+    The compaction:
+
+        1. lists the Parquet objects under `prefix`;
+        2. groups the objects smaller than `small_file_size` by partition (their directory)
+           and packs each group into bins of up to `target_file_size` bytes;
+        3. rewrites every bin with more than one object into a single file and uploads it;
+        4. points the keys of the compacted objects to the new files in the key index, when the
+           dataset is merged by primary key (see ParquetMerger);
+        5. publishes the new list of files in the dataset manifest, with a conditional PUT (see
+           DatasetManifest.save). When another writer (i.g. a merge) published a manifest since
+           step 1, steps 4 and 5 run again on the new manifest, unless some of the compacted objects
+           were replaced in the meantime: then the compaction is discarded;
+        6. batch-deletes the original objects.
+
+    Readers that rely on the manifest never see duplicated or missing rows: the originals
+    are only deleted after the manifest that replaces them was published.
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket of the dataset.
+        - prefix(str): S3 prefix of the dataset, ending with '/'.
+        - work_dir(str): local directory used to download and write the files.
+        - target_file_size(int): maximum size in bytes of the compacted files.
+        - small_file_size(int): objects smaller than this size are compacted.
+        - row_group_size(int): maximum quantity of rows of each Parquet row group.
+        - compression(str): Parquet compression codec of the compacted files.
+        - max_attempts(int): maximum quantity of attempts to publish when other writers publish
+                             the manifest at the same time.
+        - retry_delay(float): base delay in seconds before publishing again, doubled after every
+                              attempt and jittered (see `backoff_delay`).
+
+    """
+
+    def __init__(self, s3_hook, prefix, work_dir, target_file_size = 128 * 1024 * 1024,
+                 small_file_size = 32 * 1024 * 1024, row_group_size = 100_000, compression = 'snappy',
+                 max_attempts = 8, retry_delay = 0.5):
+        self.s3_hook = s3_hook
+        self.prefix = prefix
+        self.work_dir = work_dir
+        self.target_file_size = target_file_size
+        self.small_file_size = small_file_size
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def run(self):
+        """
+
+        Runs the compaction and returns a summary with the quantity of objects compacted,
+        written and deleted.
+
+        """
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        compacted, written, moved = [], [], {}
+
+        try:
+            manifest, files = self._live_files()
+            try:
+                for bin_files in self._plan(files):
+                    entry = self._compact(bin_files)
+                    written.append(entry)
+                    compacted.extend(file['file_path'] for file in bin_files)
+                    moved.update((file['file_path'], entry['key']) for file in bin_files)
+            except AirflowException:
+                # a source object was deleted by a writer that published a newer manifest
+                if not manifest_changed(self.s3_hook, manifest):
+                    raise
+                summary = self._discard(written, manifest)
+            else:
+                summary = self._publish_with_retries(compacted, written, moved)
+
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+        self.log.info(f'Compaction of {self.prefix} finished: {summary}')
+
+        return summary
+
+    def _publish_with_retries(self, compacted, written, moved):
+        for attempt in range(1, self.max_attempts + 1):
+            summary = self._publish(compacted, written, moved)
+            if summary:
+                return summary
+
+            self.log.warning(f'The manifest of {self.prefix} changed during the compaction, '
+                             f'publishing again (attempt {attempt} of {self.max_attempts})')
+            if attempt < self.max_attempts:
+                time.sleep(backoff_delay(attempt, self.retry_delay))
+
+        self.s3_hook.delete_file([entry['key'] for entry in written])
+        raise AirflowException(f'Could not compact {self.prefix}: the manifest kept changing.')
+
+    def _live_files(self):
+        """
+
+        Returns the current manifest and the listed Parquet objects of the dataset.
+
+        """
+
+        files = [file for file in self.s3_hook.list_files_from_bucket(filter_by_ext='.parquet', prefix=self.prefix)
+                 if not is_hidden(file['file_path'], self.prefix)]
+        manifest = DatasetManifest.load(self.s3_hook, self.prefix)
+
+        # the files of a dataset merged by primary key are only the ones of its manifest: others
+        # were uploaded by a merge that was not published (yet), and must not be compacted
+        if manifest.key_index:
+            files = [file for file in files if file['file_path'] in manifest.files]
+
+        return manifest, files
+
+    def _publish(self, compacted, written, moved):
+        """
+
+        Replaces the compacted objects by the written ones in the current manifest, and publishes
+        it with a conditional PUT (see DatasetManifest.save). Returns None when another writer
+        published a manifest in the meantime, so the caller tries again on the new one.
+
+        """
+
+        manifest, files = self._live_files()
+        written_keys = {entry['key'] for entry in written}
+        files = [file for file in files if file['file_path'] not in written_keys]
+        listed_keys = {file['file_path'] for file in files}
+
+        # another writer (i.g. a merge) replaced or deleted some of the compacted objects after they
+        # were read: publishing the compacted files would bring their old rows back
+        if not set(compacted) <= listed_keys:
+            return self._discard(written, manifest)
+
+        # objects written after the last manifest are registered before compacting
+        manifest_keys = set(manifest.files)
+        manifest.remove([key for key in manifest.files if key not in listed_keys])
+        manifest.add([file_entry(file['file_path'], file['size'], self.prefix)
+                      for file in files if file['file_path'] not in manifest.files])
+
+        manifest.remove(compacted)
+        manifest.add(written)
+
+        previous_index = manifest.key_index
+        if moved and previous_index:
+            index = KeyIndex.load_published(self.s3_hook, manifest, os.path.join(self.work_dir, 'key_index.parquet'))
+            if index is None:
+                return None
+            index.move(moved)
+            manifest.key_index = index.save(self.s3_hook, self.prefix, manifest.version + 1,
+                                            os.path.join(self.work_dir, 'key_index.parquet'))
+
+        # the manifest is only published when the list of files changed
+        if (compacted or listed_keys != manifest_keys) and not manifest.save():
+            if manifest.key_index != previous_index:
+                self.s3_hook.delete_file([manifest.key_index])
+            return None
+
+        delete_failed = {}
+        if compacted:
+            obsolete = compacted + ([previous_index] if previous_index != manifest.key_index else [])
+            delete_failed = self.s3_hook.delete_file(obsolete)['failed']
+
+        return {'compacted': len(compacted), 'written': len(written), 'files': len(manifest.files),
+                'delete_failed': len(delete_failed), 'discarded': False}
+
+    def _discard(self, written, manifest):
+        self.log.warning(f'Objects of {self.prefix} were replaced during the compaction, it is discarded')
+        if written:
+            self.s3_hook.delete_file([entry['key'] for entry in written])
+
+        return {'compacted': 0, 'written': 0, 'files': len(manifest.files), 'delete_failed': 0, 'discarded': True}
+
+    def _plan(self, files):
+        """
+
+        Groups the small files by partition and packs them into bins of up to
+        `target_file_size` bytes. Only bins with more than one file are returned.
+
+        """
+
+        partitions = {}
+        for file in files:
+            if file['size'] < self.small_file_size:
+                partitions.setdefault(dirname(file['file_path']), []).append(file)
+
+        bins = []
+        for partition_files in partitions.values():
+            current, current_size = [], 0
+
+            for file in sorted(partition_files, key=lambda file: file['file_path']):
+                if current and current_size + file['size'] > self.target_file_size:
+                    bins.append(current)
+                    current, current_size = [], 0
+
+                current.append(file)
+                current_size += file['size']
+
+            bins.append(current)
+
+        return [bin_files for bin_files in bins if len(bin_files) > 1]
+
+    def _compact(self, bin_files):
+        tables = []
+        for n, file in enumerate(bin_files):
+            local_path = os.path.join(self.work_dir, f'source-{n}.parquet')
+            self.s3_hook.download_file(file['file_path'], local_path)
+            tables.append(pq.read_table(local_path))
+            os.remove(local_path)
+
+        # files written by different runs may infer different types for all-null columns
+        table = pa.concat_tables(tables, promote_options='permissive')
+
+        key = f"{dirname(bin_files[0]['file_path'])}/compacted-{uuid.uuid4().hex[:12]}.parquet"
+        local_path = os.path.join(self.work_dir, 'compacted.parquet')
+        pq.write_table(table, local_path, row_group_size=self.row_group_size, compression=self.compression)
+
+        entry = file_entry(key, os.path.getsize(local_path), self.prefix, metadata = pq.read_metadata(local_path))
+        self.s3_hook.upload_file(local_path, key)
+        os.remove(local_path)
+
+        self.log.info(f'{len(bin_files)} files compacted into {key} ({table.num_rows} rows)')
+
+        return entry
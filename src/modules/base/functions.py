@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hashlib import sha256
+from functools import lru_cache, wraps
+
+DEFAULT_CACHE_SIZE = 65_536
+
+def memoize(fn, maxsize = DEFAULT_CACHE_SIZE):
+    """
+
+    Wraps a single-value function with a bounded LRU cache keyed on the input value and its
+    type, so values that compare equal but have different types (i.g. 1, 1.0 and True) get their
+    own result. Unhashable values (i.g. lists) bypass the cache.
+
+    """
+
+    cached_fn = lru_cache(maxsize=maxsize, typed=True)(fn)
+
+    @wraps(fn)
+    def wrapper(value):
+        try:
+            hash(value)
+        except TypeError:
+            return fn(value)
+
+        return cached_fn(value)
+
+    wrapper.cache_info = cached_fn.cache_info
+    return wrapper
+
+def map_unique(fn):
+    """
+
+    Turns a single-value function into a batch function (Series -> Series) that calls `fn`
+    once per distinct value of the Series and broadcasts the results back to every row.
+    Values of an object Series are distinct by value and type, like with `memoize`. Null values
+    are kept as None.
+
+    The batch function also has an `arrow` attribute, the same function for the Arrow engine
+    (Array -> Array): the array is dictionary-encoded, `fn` is called once per dictionary value
+    and the results are taken back by the dictionary indices, without building Python objects
+    for every row.
+
+    """
+
+    @wraps(fn)
+    def batch_fn(series: pd.Series) -> pd.Series:
+        if series.dtype == object:
+            # factorized by (type, value): equal values of different types (i.g. 1 and True) are
+            # not merged. Null values are left as is, so they still receive the code -1
+            keys = series.map(lambda value: (type(value), value), na_action='ignore').to_numpy()
+            codes, uniques = pd.factorize(keys)
+            values = [value for _, value in uniques]
+        else:
+            codes, values = pd.factorize(series)
+
+        # the last position receives the code -1, used by pandas for null values
+        results = np.array([fn(value) for value in values] + [None], dtype=object)
+        return pd.Series(results[codes], index=series.index, name=series.name)
+
+    def arrow_fn(array):
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+
+        encoded = pc.dictionary_encode(array)
+        results = pa.array([fn(value) for value in encoded.dictionary.to_pylist()])
+
+        # null indices (null values) are taken as nulls
+        return pc.take(results, encoded.indices)
+
+    batch_fn.arrow = arrow_fn
+    return batch_fn
+
+@map_unique
+def sha256_hash(value):
+    """
+
+    Batch function that replaces every value by its sha256 hex digest, hashing each
+    distinct value only once.
+
+    """
+
+    return sha256(str(value).encode()).hexdigest()
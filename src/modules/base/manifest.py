@@ -0,0 +1,198 @@
+import json
+
+from datetime import date, datetime, timezone
+
+class DatasetManifest:
+    """
+
+    Manifest of the live Parquet files of a dataset stored in S3, kept in a single JSON
+    object (`<prefix>_manifest.json`). Since a S3 PUT replaces an object atomically,
+    readers always see either the previous or the new list of files, never a mix of both.
+
+    Writers publish with a compare-and-swap: `save` is a conditional PUT on the ETag of the
+    manifest read by `load`, so when two writers (i.g. mapped chunks, a merge and a compaction)
+    start from the same version, only the first one publishes, and the other one must load
+    the new manifest and apply its changes again.
+
+    Each file entry is a dict with, at least, the `key` and the `size` of the object,
+    plus optional metadata (i.g. `rows`, `partition` and the min/max `stats` of the file and
+    of its row groups, see `file_entry`), used by DatasetReader to skip files.
+
+    Datasets merged by primary key (see ParquetMerger) also reference their key index
+    object in `key_index`, so the files and the index are replaced together.
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket of the dataset.
+        - prefix(str): S3 prefix of the dataset, ending with '/'.
+
+    """
+
+    manifest_name = '_manifest.json'
+
+    def __init__(self, s3_hook, prefix):
+        self.s3_hook = s3_hook
+        self.prefix = prefix
+        self.key = f'{prefix}{self.manifest_name}'
+
+        self.version = 0
+        self.files = {}
+        self.key_index = None
+        # ETag of the manifest object this one was loaded from, None when it did not exist
+        self.etag = None
+
+    @classmethod
+    def load(cls, s3_hook, prefix):
+        """
+
+        Reads the current manifest of a dataset, or returns an empty one if it does not exist yet.
+
+        """
+
+        manifest = cls(s3_hook, prefix)
+
+        data, manifest.etag = s3_hook.read_object(manifest.key)
+        if data is None:
+            return manifest
+
+        content = json.loads(data)
+
+        manifest.version = content.get('version', 0)
+        manifest.files = {entry['key']: entry for entry in content.get('files', [])}
+        manifest.key_index = content.get('key_index')
+
+        return manifest
+
+    def add(self, entries):
+        for entry in entries:
+            self.files[entry['key']] = entry
+
+    def remove(self, keys):
+        for key in keys:
+            self.files.pop(key, None)
+
+    def save(self) -> bool:
+        """
+
+        Publishes the manifest with a new version, replacing the previous one in a single PUT,
+        only if the manifest in S3 is still the one this manifest was loaded from.
+
+        Returns False, without publishing, when another writer published a manifest in the
+        meantime: the caller must `load` the new one and apply its changes again.
+
+        """
+
+        content = {
+            'version': self.version + 1,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'files': sorted(self.files.values(), key=lambda entry: entry['key'])
+        }
+        if self.key_index:
+            content['key_index'] = self.key_index
+
+        etag = self.s3_hook.put_object_if(json.dumps(content, default=str).encode(), self.key, self.etag)
+        if etag is None:
+            return False
+
+        self.version, self.etag = self.version + 1, etag
+
+        return True
+
+
+def file_entry(key, size, prefix, rows = None, metadata = None):
+    """
+
+    Manifest entry of a Parquet object of the dataset under `prefix`. With the `metadata`
+    of the file (pq.FileMetaData), the entry has its quantity of rows and its statistics.
+
+    """
+
+    entry = {'key': key, 'size': size, 'rows': rows, 'partition': partition_values(key, prefix)}
+
+    if metadata is not None:
+        entry['rows'] = metadata.num_rows
+        entry['stats'] = parquet_stats(metadata)
+
+    return entry
+
+def parquet_stats(metadata):
+    """
+
+    Min/max statistics of the top-level columns of a Parquet file, from its footer:
+
+        {'columns': {column: [min, max]}, 'row_groups': [{'rows': n, 'columns': {column: [min, max]}}]}
+
+    Columns without statistics (i.g. lists) are left out. Values are JSON serializable
+    (see `stat_value`).
+
+    """
+
+    row_groups = []
+    for n in range(metadata.num_row_groups):
+        row_group = metadata.row_group(n)
+        columns = {}
+
+        for c in range(row_group.num_columns):
+            column = row_group.column(c)
+            statistics = column.statistics
+
+            # nested columns have paths like 'films.list.element'
+            if '.' in column.path_in_schema or statistics is None or not statistics.has_min_max:
+                continue
+
+            columns[column.path_in_schema] = [stat_value(statistics.min), stat_value(statistics.max)]
+
+        row_groups.append({'rows': row_group.num_rows, 'columns': columns})
+
+    columns = {}
+    for row_group in row_groups:
+        for name, (low, high) in row_group['columns'].items():
+            if name in columns:
+                low, high = min(low, columns[name][0]), max(high, columns[name][1])
+            columns[name] = [low, high]
+
+    # a column is only pruned by the file statistics when every row group has them
+    columns = {name: values for name, values in columns.items()
+               if all(name in row_group['columns'] for row_group in row_groups)}
+
+    return {'columns': columns, 'row_groups': row_groups}
+
+def stat_value(value):
+    """
+
+    JSON serializable version of a statistic or of a filter value, keeping the order of the
+    values: dates and datetimes are ISO-8601 strings, bytes are decoded.
+
+    """
+
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='microseconds')
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    if isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+
+    return value
+
+def is_hidden(key, prefix):
+    """
+
+    Checks whether a key is hidden from the dataset under `prefix`: like Hive and Athena,
+    directories and files starting with '_' or '.' (i.g. the key index) are not data files.
+
+    """
+
+    return any(part.startswith(('_', '.')) for part in key[len(prefix):].split('/'))
+
+def partition_values(key, prefix):
+    """
+
+    Parses the Hive-style partition values of a key, i.g.
+    'prefix/updated_date=2024-01-01/part-0.parquet' -> {'updated_date': '2024-01-01'}
+
+    """
+
+    relative_dirs = key[len(prefix):].split('/')[:-1]
+    return dict(part.split('=', 1) for part in relative_dirs if '=' in part)
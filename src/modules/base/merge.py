@@ -0,0 +1,335 @@
+import os
+import time
+import uuid
+import random
+import shutil
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from posixpath import dirname
+from airflow.exceptions import AirflowException
+from airflow.utils.log.logging_mixin import LoggingMixin
+from src.modules.base.manifest import DatasetManifest, file_entry, is_hidden
+
+class KeyIndex:
+    """
+
+    Index of the primary keys of a dataset: a table with one row per (key, file) pair, telling
+    which Parquet objects hold the rows of each key. It is stored next to the data, as a Parquet
+    object under `<prefix>_key_index/`, and referenced by the dataset manifest.
+
+    Parameters:
+
+        - table(pa.Table): table with the columns `key` and `file`.
+
+    """
+
+    index_dir = '_key_index/'
+
+    def __init__(self, table = None):
+        self.table = table if table is not None else pa.table({'key': pa.nulls(0), 'file': pa.array([], pa.string())})
+
+    @classmethod
+    def load(cls, s3_hook, key, local_path):
+        s3_hook.download_file(key, local_path)
+        try:
+            return cls(pq.read_table(local_path))
+        finally:
+            os.remove(local_path)
+
+    @classmethod
+    def load_published(cls, s3_hook, manifest, local_path):
+        """
+
+        Loads the key index of `manifest`, or returns None when it was already deleted because
+        another writer published a newer manifest (and its own index) in the meantime.
+
+        """
+
+        try:
+            return cls.load(s3_hook, manifest.key_index, local_path)
+        except AirflowException:
+            if not manifest_changed(s3_hook, manifest):
+                raise
+            return None
+
+    @classmethod
+    def build(cls, s3_hook, files, column, work_dir):
+        """
+
+        Builds the index of existing objects (i.g. written before the dataset was merged by
+        primary key), reading only the key column of each one.
+
+        """
+
+        index = cls()
+        for n, key in enumerate(files):
+            local_path = os.path.join(work_dir, f'index-source-{n}.parquet')
+            s3_hook.download_file(key, local_path)
+            index.add(pq.read_table(local_path, columns=[column]).column(column), key)
+            os.remove(local_path)
+
+        return index
+
+    def files_with(self, keys) -> set:
+        """
+
+        Returns the objects holding rows of any of `keys`.
+
+        """
+
+        if not len(keys) or not self.table.num_rows:
+            return set()
+
+        column = self.table.column('key')
+        mask = pc.is_in(column, value_set=pc.cast(keys, column.type))
+        return set(pc.unique(self.table.column('file').filter(mask)).to_pylist())
+
+    def keys(self):
+        return pc.unique(self.table.column('key'))
+
+    def add(self, keys, file):
+        keys = pc.unique(keys)
+        entries = pa.table({'key': keys, 'file': pa.array([file] * len(keys), pa.string())})
+        self.table = pa.concat_tables([self.table, entries], promote_options='permissive')
+
+    def remove_files(self, files):
+        if files:
+            self.table = self.table.filter(pc.invert(pc.is_in(self.table.column('file'), value_set=pa.array(list(files)))))
+
+    def move(self, moved):
+        """
+
+        Points the keys of the objects in `moved` (a dict old key -> new key) to their new object.
+
+        """
+
+        files = [moved.get(file, file) for file in self.table.column('file').to_pylist()]
+        self.table = self.table.set_column(1, 'file', pa.array(files, pa.string()))
+
+    def save(self, s3_hook, prefix, version, local_path):
+        """
+
+        Uploads the index to a new object and returns its key. The previous object is kept,
+        so readers of the previous manifest can still use it.
+
+        """
+
+        key = f'{prefix}{self.index_dir}{version:06d}-{uuid.uuid4().hex[:12]}.parquet'
+        pq.write_table(self.table, local_path)
+        try:
+            s3_hook.upload_file(local_path, key)
+        finally:
+            os.remove(local_path)
+
+        return key
+
+
+class ParquetMerger(LoggingMixin):
+    """
+
+    Merges new rows into a Parquet dataset stored in S3 by primary key, rewriting only the
+    objects that hold replaced or deleted keys, instead of the whole dataset.
+
+    The merge:
+
+        1. uploads the new files, which are not in the manifest, so readers don't see them yet;
+        2. finds the objects holding any replaced key in the key index (see KeyIndex);
+        3. rewrites each of them without the rows of the replaced keys, to a new object;
+        4. uploads the updated key index to a new object;
+        5. publishes the manifest with the new list of files and the new key index, in a single
+           conditional PUT (see DatasetManifest.save), so it only succeeds when no other writer
+           published a manifest since step 2. Otherwise, the rewritten objects and the new key
+           index are discarded and the merge starts again from step 2, on the new manifest;
+        6. batch-deletes the replaced objects and the previous key index.
+
+    The first merge of a dataset without a key index builds it from the existing objects.
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket of the dataset.
+        - prefix(str): S3 prefix of the dataset, ending with '/'.
+        - work_dir(str): local directory used to download and write the files.
+        - key(str): primary key column.
+        - row_group_size(int): maximum quantity of rows of each Parquet row group.
+        - compression(str): Parquet compression codec of the rewritten files.
+        - max_attempts(int): maximum quantity of attempts when other runs publish the manifest
+                             at the same time (i.g. mapped chunks).
+        - retry_delay(float): base delay in seconds before merging again. It doubles after every
+                              attempt, and the actual delay is drawn at random below it (see
+                              `backoff_delay`), so the writers that lost the same race retry apart.
+
+    """
+
+    def __init__(self, s3_hook, prefix, work_dir, key, row_group_size = 100_000, compression = 'snappy',
+                 max_attempts = 8, retry_delay = 0.5):
+        self.s3_hook = s3_hook
+        self.prefix = prefix
+        self.work_dir = work_dir
+        self.key = key
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def run(self, files, keys, snapshot_keys = None):
+        """
+
+        Merges the new files into the dataset and returns a summary of the merge.
+
+        Parameters:
+
+            - files(list): tuples (local file path, path relative to the dataset) of the new files.
+            - keys(pa.Array): keys whose current rows are replaced by the rows of the new files,
+                              or deleted when the new files don't hold them.
+            - snapshot_keys(pa.Array): every key of the source, when the new rows come from a full
+                                       snapshot. Keys of the dataset missing from it are deleted.
+
+        """
+
+        os.makedirs(self.work_dir, exist_ok=True)
+        # manifest entries and keys of the new objects
+        uploaded, uploaded_keys = {}, {}
+
+        try:
+            with self.s3_hook.bulk_uploader() as uploader:
+                for file_path, relative_path in files:
+                    object_key = f'{self.prefix}{relative_path}'
+                    uploaded[object_key] = file_entry(object_key, os.path.getsize(file_path), self.prefix,
+                                                      metadata = pq.read_metadata(file_path))
+                    uploaded_keys[object_key] = pq.read_table(file_path, columns=[self.key]).column(self.key)
+                    uploader.submit(file_path, object_key)
+
+            for attempt in range(1, self.max_attempts + 1):
+                summary = self._publish(uploaded, uploaded_keys, keys, snapshot_keys)
+                if summary:
+                    break
+
+                self.log.warning(f'The manifest of {self.prefix} changed during the merge, '
+                                 f'merging again (attempt {attempt} of {self.max_attempts})')
+                if attempt < self.max_attempts:
+                    time.sleep(backoff_delay(attempt, self.retry_delay))
+            else:
+                self.s3_hook.delete_file(list(uploaded))
+                raise AirflowException(f'Could not merge into {self.prefix}: the manifest kept changing.')
+
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+        self.log.info(f'Merge into {self.prefix} finished: {summary}')
+
+        return summary
+
+    def _publish(self, uploaded, uploaded_keys, keys, snapshot_keys):
+        index_path = os.path.join(self.work_dir, 'key_index.parquet')
+
+        manifest = DatasetManifest.load(self.s3_hook, self.prefix)
+        version, previous_index = manifest.version, manifest.key_index
+
+        if previous_index:
+            index = KeyIndex.load_published(self.s3_hook, manifest, index_path)
+            if index is None:
+                return None
+        else:
+            index = self._bootstrap(manifest, uploaded)
+
+        replaced = as_array(keys)
+        deleted = 0
+        if snapshot_keys is not None and index.table.num_rows:
+            current = index.keys()
+            missing = current.filter(pc.invert(pc.is_in(current, value_set=pc.cast(as_array(snapshot_keys), current.type))))
+            deleted = len(missing)
+            replaced = pa.concat_arrays([pc.cast(replaced, current.type), missing]) if deleted else replaced
+
+        affected = index.files_with(replaced)
+        rewritten = []
+        try:
+            for object_key in sorted(affected):
+                entry = self._rewrite(object_key, replaced, index)
+                if entry:
+                    rewritten.append(entry)
+        except AirflowException:
+            # the object was deleted by a writer that published a newer manifest
+            if not manifest_changed(self.s3_hook, manifest):
+                raise
+            self.s3_hook.delete_file([entry['key'] for entry in rewritten])
+            return None
+
+        index.remove_files(affected)
+        for object_key, object_keys in uploaded_keys.items():
+            index.add(object_keys, object_key)
+
+        manifest.remove(affected)
+        manifest.add(rewritten)
+        manifest.add(uploaded.values())
+        manifest.key_index = index.save(self.s3_hook, self.prefix, version + 1, index_path)
+
+        # compare-and-swap: the manifest is only replaced if it is still the one the merge read
+        if not manifest.save():
+            self.s3_hook.delete_file([entry['key'] for entry in rewritten] + [manifest.key_index])
+            return None
+
+        obsolete = sorted(affected) + ([previous_index] if previous_index else [])
+        delete_failed = self.s3_hook.delete_file(obsolete)['failed'] if obsolete else {}
+
+        return {'written': len(uploaded), 'rewritten': len(rewritten), 'replaced_files': len(affected),
+                'deleted_keys': deleted, 'files': len(manifest.files), 'delete_failed': len(delete_failed)}
+
+    def _bootstrap(self, manifest, uploaded):
+        # objects of the dataset before its first merge: the ones of the manifest, or every
+        # listed object when there is no manifest yet
+        existing = set(manifest.files)
+        if not existing:
+            listed = [file for file in self.s3_hook.list_files_from_bucket(filter_by_ext='.parquet', prefix=self.prefix)
+                      if not is_hidden(file['file_path'], self.prefix) and file['file_path'] not in uploaded]
+            manifest.add(file_entry(file['file_path'], file['size'], self.prefix) for file in listed)
+            existing = set(manifest.files)
+
+        self.log.info(f'Building the key index of {self.prefix} from {len(existing)} files')
+
+        return KeyIndex.build(self.s3_hook, sorted(existing), self.key, self.work_dir)
+
+    def _rewrite(self, object_key, replaced, index):
+        """
+
+        Rewrites an object without the rows of the replaced keys. Returns the manifest entry of
+        the new object, or None when every row was replaced.
+
+        """
+
+        local_path = os.path.join(self.work_dir, 'rewrite-source.parquet')
+        self.s3_hook.download_file(object_key, local_path)
+        table = pq.read_table(local_path)
+        os.remove(local_path)
+
+        column = table.column(self.key)
+        table = table.filter(pc.invert(pc.is_in(column, value_set=pc.cast(replaced, column.type))))
+        if not table.num_rows:
+            return None
+
+        new_key = f'{dirname(object_key)}/merged-{uuid.uuid4().hex[:12]}.parquet'
+        local_path = os.path.join(self.work_dir, 'rewritten.parquet')
+        pq.write_table(table, local_path, row_group_size=self.row_group_size, compression=self.compression)
+        entry = file_entry(new_key, os.path.getsize(local_path), self.prefix, metadata = pq.read_metadata(local_path))
+        self.s3_hook.upload_file(local_path, new_key)
+        os.remove(local_path)
+
+        index.add(table.column(self.key), new_key)
+
+        return entry
+
+
+def manifest_changed(s3_hook, manifest):
+    # objects of a manifest are only deleted after a newer manifest was published
+    return s3_hook.get_etag(manifest.key) != manifest.etag
+
+def backoff_delay(attempt, base_delay, max_delay = 30):
+    # exponential backoff with full jitter: a random delay below `base_delay * 2^(attempt - 1)`
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+def as_array(values):
+    if isinstance(values, pa.ChunkedArray):
+        return values.combine_chunks()
+
+    return values if isinstance(values, pa.Array) else pa.array(list(values))
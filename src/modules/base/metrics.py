@@ -0,0 +1,188 @@
+import time
+import random
+import resource
+import threading
+
+from datetime import timedelta
+from contextlib import contextmanager
+from airflow.stats import Stats
+
+class RunMetrics:
+    """
+
+    Collects the metrics of a task run: wall time and peak memory growth of each stage (extract,
+    transform, load...), counters (records, bytes in/out) and request latencies of the hooks.
+
+    Every value is also emitted through `airflow.stats.Stats`, which sends it to the StatsD or
+    OpenTelemetry sink configured in the `[metrics]` section of Airflow, or discards it when
+    metrics are disabled (the default). `summary` returns the values collected by this object,
+    i.g. to push them to XCom. It is thread-safe, so hooks can share it with their thread pools.
+
+    Parameters:
+
+        - prefix(str): prefix of the emitted metric names, i.g. 'dags.<dag_name>'.
+        - max_samples(int): maximum quantity of latencies kept per metric to compute the
+                            percentiles of the summary (a uniform reservoir sample).
+
+    """
+
+    def __init__(self, prefix, max_samples = 10_000):
+        self.prefix = prefix
+        self.max_samples = max_samples
+        self.stages = {}
+        self.counters = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+        # seconds of the nested stages of every stage open in the current thread
+        self._open_stages = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        """
+
+        Measures the wall time of a block of code, and how much it raised the peak memory (RSS)
+        of the process:
+
+            with metrics.stage('extract'):
+                ...
+
+        The peak RSS is a high-water mark of the whole life of the process, so a stage that stays
+        under the peak of the previous ones has no growth. The peak of the process at the end of
+        the stage is recorded as `process_peak_rss_bytes`.
+
+        Stages can be nested (i.g. `transform` runs inside the `load` task): `seconds` is the
+        wall time of the whole block, nested stages included, so the times of nested stages
+        overlap, and `self_seconds` excludes the stages nested in the same thread. The memory
+        growth of a stage includes the growth of its nested stages.
+
+        """
+
+        open_stages = getattr(self._open_stages, 'seconds', None)
+        if open_stages is None:
+            open_stages = self._open_stages.seconds = []
+        open_stages.append(0.0)
+
+        started, peak_rss_before = time.perf_counter(), peak_rss_bytes()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - started
+            self_elapsed = elapsed - open_stages.pop()
+            if open_stages:
+                open_stages[-1] += elapsed
+
+            peak_rss = peak_rss_bytes()
+            peak_rss_growth = peak_rss - peak_rss_before
+
+            with self._lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'self_seconds': 0.0,
+                                                      'peak_rss_growth_bytes': 0, 'process_peak_rss_bytes': 0})
+                stage['seconds'] += elapsed
+                stage['self_seconds'] += self_elapsed
+                stage['peak_rss_growth_bytes'] += peak_rss_growth
+                stage['process_peak_rss_bytes'] = max(stage['process_peak_rss_bytes'], peak_rss)
+
+            Stats.timing(f'{self.prefix}.{name}.duration', timedelta(seconds = elapsed))
+            Stats.timing(f'{self.prefix}.{name}.self_duration', timedelta(seconds = self_elapsed))
+            Stats.gauge(f'{self.prefix}.{name}.peak_rss_growth_bytes', peak_rss_growth)
+            Stats.gauge(f'{self.prefix}.{name}.process_peak_rss_bytes', peak_rss)
+
+    def incr(self, name, count = 1):
+        """
+
+        Adds `count` to a counter, i.g. `metrics.incr('transform.records', len(df))`.
+
+        """
+
+        if not count:
+            return
+
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+        Stats.incr(f'{self.prefix}.{name}', count)
+
+    def timing(self, name, seconds):
+        """
+
+        Records a latency, i.g. of a request.
+
+        """
+
+        with self._lock:
+            latency = self.latencies.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0, 'samples': []})
+            latency['count'] += 1
+            latency['total'] += seconds
+            latency['max'] = max(latency['max'], seconds)
+
+            samples = latency['samples']
+            if len(samples) < self.max_samples:
+                samples.append(seconds)
+            else:
+                position = random.randrange(latency['count'])
+                if position < self.max_samples:
+                    samples[position] = seconds
+
+        Stats.timing(f'{self.prefix}.{name}', timedelta(seconds = seconds))
+
+    def observe_request(self, source, seconds, bytes_in = 0, bytes_out = 0):
+        """
+
+        Records a request sent by a hook: `<source>.requests`, `<source>.latency`,
+        `<source>.bytes_in` and `<source>.bytes_out`.
+
+        """
+
+        self.incr(f'{source}.requests')
+        self.timing(f'{source}.latency', seconds)
+        self.incr(f'{source}.bytes_in', bytes_in)
+        self.incr(f'{source}.bytes_out', bytes_out)
+
+    def summary(self):
+        """
+
+        Returns a JSON serializable dict with the stages, counters and latency
+        percentiles (in seconds) collected so far.
+
+        """
+
+        with self._lock:
+            latencies = {}
+            for name, latency in self.latencies.items():
+                samples = sorted(latency['samples'])
+                latencies[name] = {
+                    'count': latency['count'],
+                    'mean': latency['total'] / latency['count'],
+                    'p50': percentile(samples, 50),
+                    'p95': percentile(samples, 95),
+                    'p99': percentile(samples, 99),
+                    'max': latency['max']
+                }
+
+            return {
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'latencies': latencies
+            }
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+
+    position = min(len(sorted_values) - 1, int(round(q / 100 * (len(sorted_values) - 1))))
+    return sorted_values[position]
+
+def peak_rss_bytes():
+    """
+
+    Peak resident memory of the current process and of its finished child processes
+    (i.g. the transform workers), in bytes.
+
+    """
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+    # Linux reports kilobytes
+    return peak * 1024
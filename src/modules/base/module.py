@@ -1,7 +1,27 @@
+import io
+import os
+import uuid
+import shutil
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from os import remove
-from src.config.env import TMP_DIR
+from functools import cached_property, partial, wraps
+from itertools import chain, islice
+from src.modules.base.ndjson import batched
+from src.modules.base.parallel import ParallelTransformer
+from src.modules.base.metrics import RunMetrics
+from src.config.env import get_tmp_dir
+from src.modules.base.plan import TransformPlan
+from src.modules.base.writer import ParquetDatasetWriter
+from src.modules.base.compaction import ParquetCompactor
+from src.modules.base.merge import ParquetMerger
+from src.modules.base.reader import DatasetReader
+from src.modules.base.staging import StageArea
+from src.modules.base.watermark import LocalWatermarkStore, S3WatermarkStore
+from airflow.exceptions import AirflowException
+from airflow.operators.python import get_current_context
 from airflow.utils.log.logging_mixin import LoggingMixin
 
 class BaseModule(LoggingMixin):
@@ -9,10 +29,190 @@ class BaseModule(LoggingMixin):
     dag_name:str = None
     fields:dict = None
     temp_file_extn:str = '.csv'
+    # quantity of records held in memory at once by streaming modules
+    batch_size:int = 1_000
+
+    # incremental mode: source field holding the last update of each record
+    incremental_field:str = None
+    # S3 key (inside the module's `s3_hook` bucket) of the watermark state. When it is not
+    # defined, the watermark is kept in a local state file under TMP_DIR.
+    watermark_key:str = None
+    # set by the `full-refresh` flag, ignores the watermark and reprocesses everything
+    full_refresh:bool = False
+
+    # layout of the Parquet dataset written by `dataset_writer` (see ParquetDatasetWriter)
+    partition_by:str = None
+    partition_name:str = None
+    partition_format:str = '%Y-%m-%d'
+    max_rows_per_file:int = 500_000
+    row_group_size:int = 100_000
+    parquet_compression:str = 'snappy'
+    parquet_dictionary:bool = True
+
+    # output column identifying each record, i.g. 'id'. Bridge tables (`list: bridge` fields)
+    # link their items to the records by this column.
+    primary_key:str = None
+    # 'append' writes new files next to the existing ones, 'merge' replaces the rows of the
+    # existing keys (see `merge_dataset`)
+    write_mode:str = 'append'
+
+    # engine of `write_dataset`: 'pandas' (DataFrames) or 'arrow' (pyarrow Tables and compute
+    # kernels, without object-dtype copies), set by the `engine` custom param
+    engine:str = 'pandas'
+
+    # worker processes of `write_dataset` (see ParallelTransformer), set by the `transform_workers`
+    # custom param, and quantity of records sent to a worker at once
+    transform_workers:int = 1
+    transform_group_size:int = 50_000
+
+    # S3 prefix of a Parquet dataset whose small files are compacted after each load
+    # (see ParquetCompactor). The compaction task is only built when it is defined.
+    compaction_prefix:str = None
+    compaction_target_file_size:int = 128 * 1024 * 1024
+    compaction_small_file_size:int = 32 * 1024 * 1024
+
+    # chunked execution (see `plan_chunks`): set by BaseDAG from its `limit`, `chunk_size` and
+    # `chunked` flag. Only modules that implement the chunk steps can run chunked.
+    chunked:bool = False
+    limit:int = None
+    chunk_size:int = None
+
+    # URI of the Airflow Dataset published by the module's load, i.g. 's3://raw/path/to/file.jsonl.gz'.
+    # BaseDAG sets it as the outlet of the load, so DAGs scheduled on it run after each new version.
+    dataset:str = None
+
+    # budget of the run dirs of the stage area (see StageArea): dirs of idle runs are removed after
+    # `stage_retention_hours`, or earlier when they use more than `stage_max_bytes` or the disk has
+    # less than `stage_min_free_bytes` free
+    stage_max_bytes:int = 20 * 1024 ** 3
+    stage_min_free_bytes:int = 2 * 1024 ** 3
+    stage_retention_hours:int = 24
+
+    # compiled `fields` recipes, by module class
+    _plans:dict = {}
+
+    # stage area dir, TMP_DIR by default
+    _dir_path:str = None
+
+    @cached_property
+    def metrics(self) -> RunMetrics:
+        """
+
+        Metrics of the current task run (see RunMetrics), shared with the hooks of the module.
+
+        """
+
+        return RunMetrics(f'dags.{self.dag_name}')
+
+    @cached_property
+    def _logged_missing_columns(self) -> set:
+        return set()
+
+    def instrument(self, stage, fn):
+        """
+
+        Wraps a task callable, i.g. `module.instrument('extract', module.extract)`, so its wall
+        time and peak memory are measured as `stage`. When the task finishes, successfully or not,
+        the metrics summary of the run is logged and pushed to XCom with the key `metrics`.
+
+        """
+
+        @wraps(fn)
+        def instrumented(*args, **kwargs):
+            try:
+                with self.metrics.stage(stage):
+                    return fn(*args, **kwargs)
+            finally:
+                self.push_metrics()
+
+        return instrumented
+
+    def push_metrics(self):
+        summary = self.metrics.summary()
+        self.log.info(f'Run metrics: {summary}')
+
+        try:
+            task_instance = get_current_context()['ti']
+        except AirflowException:
+            # not running inside of a task
+            return
+
+        task_instance.xcom_push(key = 'metrics', value = summary)
+
+    @property
+    def dir_path(self) -> str:
+        # modules are built when the DAG files are parsed: the stage area, the hooks of the
+        # modules and their connections are only resolved on first use, inside of the tasks
+        if self._dir_path is None:
+            self._dir_path = get_tmp_dir()
+        return self._dir_path
+
+    @dir_path.setter
+    def dir_path(self, value):
+        self._dir_path = value
+
+    @property
+    def stage_area(self) -> StageArea:
+        return StageArea(self.dir_path, self.dag_name, max_bytes = self.stage_max_bytes,
+                         min_free_bytes = self.stage_min_free_bytes, retention_hours = self.stage_retention_hours)
+
+    @property
+    def run_id(self) -> str:
+        try:
+            return get_current_context()['run_id']
+        except AirflowException:
+            # not running inside of a task (i.g. benchmarks): every call shares the same run
+            return 'local'
+
+    @property
+    def run_dir(self) -> str:
+        """
+
+        Stage dir of the current DAG run (see StageArea), where the temporary files of its tasks
+        are written, so concurrent runs of the DAG never share them. State kept across runs
+        (watermark, caches of the hooks) stays in `dir_path`.
+
+        """
+
+        return self.stage_area.run_dir(self.run_id)
+
+    @property
+    def temp_file_path(self) -> str:
+        return f"{self.run_dir}{self.dag_name}{self.temp_file_extn}"
+
+    @property
+    def watermark_file_path(self) -> str:
+        return f"{self.dir_path}{self.dag_name}_watermark.json"
+
+    @classmethod
+    def get_plan(cls) -> TransformPlan:
+        """
+
+        Returns the `fields` recipe of the module class compiled into a TransformPlan.
+        The recipe is validated and compiled only once per class.
+
+        """
+
+        plan = cls._plans.get(cls)
 
-    def __init__(self):
-        self.dir_path = TMP_DIR
-        self.temp_file_path = f"{self.dir_path}{self.dag_name}{self.temp_file_extn}"
+        if plan is None:
+            plan = cls._plans[cls] = TransformPlan.compile(cls.fields)
+
+        return plan
+
+    @property
+    def plan(self) -> TransformPlan:
+        return self.get_plan()
+
+    @property
+    def columns(self) -> list:
+        """
+
+        Output columns of `transform`, in the order of the `fields` recipe.
+
+        """
+
+        return list(self.plan.columns)
 
     def extract(self):
         raise NotImplementedError("Extract method not defined.")
@@ -20,6 +220,112 @@ class BaseModule(LoggingMixin):
     def load(self):
         raise NotImplementedError("Load method not defined.")
 
+    def plan_chunks(self) -> list:
+        """
+
+        First step of the chunked execution: prepares the data and splits it in chunks of up to
+        `chunk_size` records, over at most `limit` records. Returns a list with the keyword arguments
+        of `process_chunk` for each chunk, which BaseDAG maps to one task per chunk, so chunks run
+        in parallel on different workers. Every value must be JSON serializable (it goes to XCom).
+
+        """
+
+        raise NotImplementedError("Plan chunks method not defined.")
+
+    def process_chunk(self, **chunk) -> dict:
+        """
+
+        Extracts, transforms and loads a single chunk returned by `plan_chunks`. Returns a
+        JSON serializable summary of the chunk, passed to `finalize_chunks`.
+
+        """
+
+        raise NotImplementedError("Process chunk method not defined.")
+
+    def finalize_chunks(self, results):
+        """
+
+        Last step of the chunked execution, runs once after every chunk was processed
+        with the list of summaries returned by `process_chunk`.
+
+        """
+
+        raise NotImplementedError("Finalize chunks method not defined.")
+
+    def supports_chunks(self) -> bool:
+        return type(self).plan_chunks is not BaseModule.plan_chunks
+
+    def supports_concurrent_runs(self) -> bool:
+        """
+
+        Checks whether runs of the module can overlap (see the `max_active_runs` custom param of
+        BaseDAG). Incremental runs read and save the same watermark, so overlapping runs would load
+        the same records twice, and merges publish the rows of a key in whatever order the runs
+        finish, so an older run could replace the rows of a newer one.
+
+        """
+
+        return not self.incremental_field and self.write_mode != 'merge'
+
+    def plan_record_chunks(self, records, watermark = None) -> list:
+        """
+
+        Splits the records updated after `watermark` into chunks of up to `chunk_size` records,
+        over at most `limit` records. Each chunk is a dict with the `start` and `stop` positions of
+        its first and after its last record in `records`, and the `watermark` and `upper` bounds
+        of its incremental window (see `chunk_records`).
+
+        When more than `limit` records were updated, the oldest ones are selected and `upper`
+        is set to the greatest selected update, so the newer records are kept for the next runs
+        and the watermark never moves past a record that was not loaded.
+
+        """
+
+        field = self.incremental_field
+        selected = [(position, (record.get(field) or '') if field else None)
+                    for position, record in enumerate(records)
+                    if self.in_window(record, watermark)]
+
+        upper = None
+        if self.limit and len(selected) > self.limit:
+            if field:
+                upper = sorted(value for _, value in selected)[self.limit - 1]
+                selected = [item for item in selected if item[1] <= upper]
+            else:
+                selected = selected[:self.limit]
+
+        chunk_size = self.chunk_size or len(selected) or 1
+
+        return [
+            {'start': group[0][0], 'stop': group[-1][0] + 1, 'watermark': watermark, 'upper': upper}
+            for group in (selected[i:i + chunk_size] for i in range(0, len(selected), chunk_size))
+        ]
+
+    def chunk_records(self, records, start, stop, watermark = None, upper = None):
+        """
+
+        Lazily yields the records of a chunk planned by `plan_record_chunks`.
+
+        """
+
+        return (record for record in islice(records, start, stop)
+                if self.in_window(record, watermark, upper))
+
+    def in_window(self, record, watermark = None, upper = None):
+        """
+
+        Checks whether the `incremental_field` of a record is after `watermark`
+        and, when `upper` is defined, not after `upper`.
+
+        """
+
+        if not self.incremental_field:
+            return True
+
+        value = record.get(self.incremental_field) or ''
+
+        return (watermark is None or value > watermark) and (upper is None or value <= upper)
+
     def transform(self, df: pd.DataFrame) -> pd.DataFrame:
         """"
 
@@ -44,8 +350,15 @@ class BaseModule(LoggingMixin):
             - rename: new name for the column, using the rename method.
                       Doc: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.rename.html#pandas.DataFrame.rename
 
-            - fn: function to be applied to all values of the column, using the apply method.
-                  Doc: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.apply.html#pandas.DataFrame.apply
+            - fn: function to be applied to all values of the column, using the map method.
+                  Doc: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.Series.map.html
+
+            - cache: memoizes `fn` with a LRU cache keyed on the input value. Use True for the default
+                     size or an int with the maximum quantity of cached values.
+
+            - batch_fn: function applied once to the whole column, receiving a Series and returning a Series
+                        (or array) of the same length. Built-in batch functions live in `src.modules.base.functions`,
+                        i.g. `sha256_hash`, which hashes each distinct value only once.
 
             - type: type to cast the values from the column to, following the astype method.
                     Doc: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.astype.html#pandas.DataFrame.astype
@@ -58,81 +371,503 @@ class BaseModule(LoggingMixin):
 
             - fillna: method to use to fill null values, using the fillna method.
                       Doc: https://pandas.pydata.org/pandas-docs/stable/reference/api/pandas.DataFrame.fillna.html#pandas.DataFrame.fillna
+
+            - list: how a column of lists is written, the other options being applied to each item:
+                    - native: kept as a Parquet list column, one row per record. It is what happens
+                              to lists without this option.
+                    - explode: exploded by `normalize_records`, one row per item. Each exploded column
+                               multiplies the rows of the record by the size of its list.
+                    - bridge: moved to a bridge table with one row per (`primary_key`, item), written
+                              next to the dataset (see `bridge_dir`).
         
         
         After transforming all columns, returns the new DataFrame with all the desired columns. If one of the keys of the fields dictionary
         wasn't extracted (i.g. when the documents you've extracted in a NoSQL engine don't contain that key), this methods creates it as a
         empty column.
+
+        The recipe is validated and compiled once per module class into an immutable TransformPlan (see `get_plan`), which
+        transforms column by column and builds the renamed and ordered output in a single pass.
                       
         """
         
-        if df.empty():
-            self.log.info("DataFrame is empty. Nothing to transform - Skipping.")
+        if df.empty:
+            self.log.debug("DataFrame is empty. Nothing to transform - Skipping.")
             return df
 
-        new_df = df.copy()
+        with self.metrics.stage('transform'):
+            new_df, columns_not_avaiable = self.plan.apply(df)
+
+        self.metrics.incr('transform.rows', len(df))
+
+        if columns_not_avaiable:
+            # this was added to work with NoSQL, where columns may not appear in the documents.
+            # Transform runs once per batch, so each set of missing columns is only logged once
+            self.metrics.incr('transform.missing_columns_batches')
+            missing = tuple(columns_not_avaiable)
+            if missing not in self._logged_missing_columns:
+                self._logged_missing_columns.add(missing)
+                self.log.info(f'Columns not available in df, created with `None`: {columns_not_avaiable}')
+
+        return new_df
+
+    @classmethod
+    def writer_options(cls) -> dict:
+        """
+
+        Keyword arguments of ParquetDatasetWriter for the module's dataset layout.
+
+        """
+
+        return {
+            'partition_by': cls.partition_by,
+            'partition_name': cls.partition_name,
+            'partition_format': cls.partition_format,
+            'max_rows_per_file': cls.max_rows_per_file,
+            'row_group_size': cls.row_group_size,
+            'compression': cls.parquet_compression,
+            'use_dictionary': cls.parquet_dictionary
+        }
+
+    @staticmethod
+    def bridge_dir(base_dir, column) -> str:
+        """
+
+        Directory of the bridge table of a `list: bridge` column, next to the dataset:
+        i.g. `<tmp>/characters_films/` for the column `films` of `<tmp>/characters/`.
+
+        """
+
+        return f"{base_dir.rstrip('/')}_{column}/"
+
+    @classmethod
+    def split_bridges(cls, data):
+        """
+
+        Splits a transformed DataFrame (or pyarrow Table) in the dataset and its bridge tables
+        (see `TransformPlan.split_bridges`).
+
+        """
+
+        plan = cls.get_plan()
+        if plan.bridges and not cls.primary_key:
+            raise ValueError(f'Bridge fields {list(plan.bridges)} of {cls.__name__} require a primary_key.')
+
+        if isinstance(data, pa.Table):
+            return plan.split_bridges_arrow(data, cls.primary_key, cls.partition_by)
+
+        return plan.split_bridges(data, cls.primary_key, cls.partition_by)
+
+    @classmethod
+    def dataset_writers(cls, base_dir, sink = None, token = None) -> dict:
+        """
+
+        Returns the ParquetDatasetWriters of the dataset (key None) and of each bridge table
+        (key: column). Files of the bridge tables are passed to `sink` with the keyword
+        argument `bridge=<column>`.
+
+        """
+
+        plan = cls.get_plan()
+        types = plan.arrow_types()
+        writers = {None: ParquetDatasetWriter(base_dir, sink = sink, token = token, types = types, **cls.writer_options())}
+
+        for column in plan.bridges:
+            writers[column] = ParquetDatasetWriter(
+                cls.bridge_dir(base_dir, column),
+                sink = partial(sink, bridge = column) if sink else None,
+                token = token,
+                # bridge tables hold the items of the lists
+                types = {**types, column: types[column].value_type},
+                **cls.writer_options()
+            )
+
+        return writers
+
+    def dataset_writer(self, base_dir, sink = None) -> ParquetDatasetWriter:
+        """
+
+        Returns a ParquetDatasetWriter to `base_dir` (or to `sink`, see ParquetDatasetWriter)
+        configured by the module's dataset layout.
+
+        """
+
+        return ParquetDatasetWriter(base_dir, sink = sink, types = self.plan.arrow_types(), **self.writer_options())
+
+    @classmethod
+    def normalize_records(cls, records) -> pd.DataFrame:
+        """
+
+        Builds the DataFrame of a batch of extracted records, before `transform`, exploding
+        the `list: explode` fields. It must be a class method, so worker processes can call it
+        from the class.
+
+        """
+
+        return cls.get_plan().explode(pd.DataFrame.from_records(records))
+
+    @classmethod
+    def normalize_records_arrow(cls, records) -> pa.Table:
+        """
+
+        Same as `normalize_records`, for the `arrow` engine: builds a pyarrow Table straight
+        from the records of a batch, before `transform_table`.
+
+        """
+
+        # columns are collected from every record (`pa.Table.from_pylist` only reads the keys of the
+        # first one), and only the source columns of the recipe are built
+        plan = cls.get_plan()
+        sources = {step.source for step in plan.steps}
+        columns = [column for column in dict.fromkeys(key for record in records for key in record) if column in sources]
 
-        for col in self.fields:
-            col_val = self.fields[col]
-            self.log.info(f'Transforming field {col}: {col_val}')
+        return plan.explode_arrow(pa.Table.from_pydict({column: [record.get(column) for record in records]
+                                                        for column in columns}))
+
+    def transform_table(self, table: pa.Table) -> pa.Table:
+        """
+
+        Same as `transform`, for the `arrow` engine: applies the `fields` recipe to a pyarrow
+        Table with Arrow compute kernels (see `ColumnStep.apply_arrow`), without pandas.
+
+        """
+
+        if not table.num_rows:
+            return table
+
+        with self.metrics.stage('transform'):
+            new_table, columns_not_avaiable = self.plan.apply_arrow(table)
+
+        self.metrics.incr('transform.rows', table.num_rows)
+
+        if columns_not_avaiable:
+            self.metrics.incr('transform.missing_columns_batches')
+            missing = tuple(columns_not_avaiable)
+            if missing not in self._logged_missing_columns:
+                self._logged_missing_columns.add(missing)
+                self.log.info(f'Columns not available in table, created with `None`: {columns_not_avaiable}')
+
+        return new_table
+
+    def write_dataset(self, records, base_dir, sink = None, watermark = None):
+        """
+
+        Normalizes, transforms and writes an iterable of records as a Parquet dataset, in batches
+        of `batch_size` records, and returns a tuple with the quantity of records and the list of
+        written files (see ParquetDatasetWriter), bridge tables included. The greatest
+        `incremental_field` value between `watermark` and the records is kept in `self.new_watermark`.
+
+        With more than one `transform_workers`, batches are transformed and written by a pool
+        of worker processes (see ParallelTransformer). Their files are passed to `sink`, if
+        provided, in the order of the records. Batches go through `normalize_records` and
+        `transform`, or `normalize_records_arrow` and `transform_table` with the `arrow` engine.
+
+        """
 
-            if isinstance(col_val, str):
-                col_dest_name = col_val
+        self.new_watermark = watermark
+        counter = {'records': 0}
 
-            elif isinstance(col_val, dict):
-                col_dest_name = col_val.get('rename', col)
-                col_fn = col_val.get('fn', None)
-                col_cast_type = col_val.get('type', None)
-                col_replace = col_val.get('replace', None)
-                col_date_format = col_val.get('date_format', None)
-                col_fillna = col_val.get('fillna', None)
+        def tracked(batches):
+            for batch in batches:
+                self.new_watermark = self.high_watermark(batch, self.new_watermark)
+                counter['records'] += len(batch)
+                yield batch
 
+        if self.transform_workers and self.transform_workers > 1:
+            files = self._write_dataset_parallel(tracked, records, base_dir, sink)
+            self.metrics.incr('write.records', counter['records'])
+            self.metrics.incr('write.files', len(files))
+            return counter['records'], files
+
+        writers = self.dataset_writers(base_dir, sink = sink)
+
+        for batch in tracked(batched(records, self.batch_size)):
+            if self.engine == 'arrow':
+                # one pyarrow Table for the whole batch, never converted to pandas
+                data = self.transform_table(self.normalize_records_arrow(batch))
             else:
-                raise TypeError(f'Not able to parse fields for {col_val}, should be dict or str.')
+                # one normalized DataFrame for the whole batch, transformed column-wise
+                data = self.transform(self.normalize_records(batch))
 
-            try:
-                # replace must be the first step
-                if col_replace:
-                    new_df[col] = new_df[col].replace(col_replace)
-
-                if col_fn:
-                    new_df[col] = new_df[col].apply(col_fn)
-
-                if col_cast_type:
-                    new_df[col] = new_df[col].astype(col_cast_type)
-                
-                if col_date_format:
-                    new_df[col] = pd.to_datetime(new_df[col], format=col_date_format)
-                
-                if col_fillna:
-                    new_df[col] = new_df[col].fillna(col_fillna)
-
-                # rename must be the last step
-                if col_dest_name:
-                    new_df = new_df.rename(columns={col: col_dest_name})
-
-            except KeyError:
-                # this exception was added to work with NoSQL, where columns may not appear in the documents
-                self.log.info(f'Non-optional column {col} is not available in df creating with `None`.')
-                new_df[col_dest_name] = None
-
-        # fill not available columns in df
-        columns_not_avaiable = list(set(self.columns) - set(new_df.columns))
-        self.log.info(f'Columns not available in df {columns_not_avaiable}')
-        new_df[columns_not_avaiable] = None
-
-        return new_df[self.columns]
+            if not len(data):
+                continue
+
+            data, bridges = self.split_bridges(data)
+            writers[None].write(data)
+            for column, bridge in bridges.items():
+                writers[column].write(bridge)
+
+        files = []
+        for column, writer in writers.items():
+            files.extend(writer.close())
+            self.metrics.incr('write.bytes', writer.bytes_written)
+            if column:
+                self.metrics.incr(f'write.bridges.{column}.rows', writer.rows_written)
+
+        self.metrics.incr('write.records', counter['records'])
+        self.metrics.incr('write.files', len(files))
+
+        return counter['records'], files
+
+    def _write_dataset_parallel(self, tracked, records, base_dir, sink):
+        transformer = ParallelTransformer(type(self), self.transform_workers, self.transform_group_size, self.engine)
+        token = uuid.uuid4().hex[:12]
+        # with a sink, workers write to a scratch dir and each file is passed to the sink from memory
+        work_dir = f"{base_dir.rstrip('/')}_{token}/" if sink else base_dir
+        files = []
+
+        try:
+            for group_files in transformer.run(tracked(transformer.groups(records)), work_dir, token):
+                # files of the dataset (key None) and of each bridge table
+                for column, column_files in group_files.items():
+                    for file_path, relative_path in column_files:
+                        self.metrics.incr('write.bytes', os.path.getsize(file_path))
+
+                        if not sink:
+                            files.append((file_path, relative_path))
+                            continue
+
+                        with open(file_path, 'rb') as f:
+                            buffer = io.BytesIO(f.read())
+                        remove(file_path)
+
+                        if column:
+                            sink(relative_path, buffer, bridge = column)
+                        else:
+                            sink(relative_path, buffer)
+                        files.append((None, relative_path))
+        finally:
+            if sink:
+                shutil.rmtree(work_dir, ignore_errors = True)
+                for column in self.plan.bridges:
+                    shutil.rmtree(self.bridge_dir(work_dir, column), ignore_errors = True)
+
+        return files
+
+    def merge_dataset(self, records, base_dir, prefix, watermark = None, snapshot_keys = None):
+        """
+
+        Writes the records like `write_dataset`, to local files under `base_dir`, and merges
+        them by `primary_key` into the dataset under `prefix` of the module's `s3_hook` bucket
+        (see ParquetMerger): rows of keys already in the dataset are replaced, and only the
+        objects holding them are rewritten. Bridge tables are merged into their own datasets,
+        next to it (see `bridge_dir`), each one with its own manifest.
+
+        Records with an already seen key are dropped, keeping the first one. When `snapshot_keys`
+        (the source values of the key of every record of the source) is provided, keys of the
+        dataset missing from it are deleted.
+
+        Returns a tuple with the quantity of records and the summary of the merges by dataset.
+
+        """
+
+        if not self.primary_key:
+            raise ValueError(f'{type(self).__name__} requires a primary_key to merge.')
+
+        count, files = self.write_dataset(self.unique_records(records), base_dir, watermark = watermark)
+
+        # local files of the dataset (key None) and of each bridge table
+        datasets = {column: [] for column in self.plan.bridges}
+        datasets[None] = []
+        for file_path, relative_path in files:
+            column = next((column for column in self.plan.bridges
+                           if file_path.startswith(self.bridge_dir(base_dir, column))), None)
+            datasets[column].append((file_path, relative_path))
+
+        keys = [pq.read_table(file_path, columns = [self.primary_key]).column(self.primary_key)
+                for file_path, _ in datasets[None]]
+        keys = pa.chunked_array(keys).combine_chunks() if keys else pa.array([])
+        if snapshot_keys is not None:
+            snapshot_keys = self.key_values(snapshot_keys)
+
+        summaries = {}
+        try:
+            for column, column_files in datasets.items():
+                merger = ParquetMerger(
+                    self.s3_hook,
+                    self.bridge_dir(prefix, column) if column else prefix,
+                    f"{base_dir.rstrip('/')}_merge/",
+                    self.primary_key,
+                    row_group_size = self.row_group_size,
+                    compression = self.parquet_compression
+                )
+                summaries[column or 'dataset'] = merger.run(column_files, keys, snapshot_keys = snapshot_keys)
+        finally:
+            for column in datasets:
+                shutil.rmtree(self.bridge_dir(base_dir, column) if column else base_dir, ignore_errors = True)
+
+        self.metrics.incr('merge.rewritten_files', sum(summary['rewritten'] for summary in summaries.values()))
+        self.metrics.incr('merge.deleted_keys', summaries['dataset']['deleted_keys'])
+
+        return count, summaries
+
+    def unique_records(self, records):
+        """
+
+        Lazily drops the records whose `primary_key` source field was already seen.
+
+        """
+
+        source = self.plan.source_of(self.primary_key)
+        seen = set()
+
+        for record in records:
+            key = record.get(source)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield record
+
+    def key_values(self, values) -> pa.Array:
+        """
+
+        Converts source values of the `primary_key` field to the values of the output column,
+        applying the steps of its `fields` recipe.
+
+        """
+
+        step = self.plan.steps[self.plan.columns.index(self.primary_key)]
+        return step.apply_values_arrow(pa.array(list(values)))
+
+    def compact(self):
+        """
+
+        Compacts the small Parquet files under `compaction_prefix` in the module's `s3_hook` bucket.
+
+        """
+
+        compactor = ParquetCompactor(
+            self.s3_hook,
+            self.compaction_prefix,
+            f"{self.run_dir}{self.dag_name}_compaction/",
+            target_file_size = self.compaction_target_file_size,
+            small_file_size = self.compaction_small_file_size,
+            row_group_size = self.row_group_size,
+            compression = self.parquet_compression
+        )
+
+        return compactor.run()
+
+    def dataset_reader(self, prefix) -> DatasetReader:
+        """
+
+        Returns a DatasetReader of the Parquet dataset under `prefix` in the module's `s3_hook`
+        bucket, i.g. `module.dataset_reader(prefix).read(columns = [...], filters = [...])`.
+
+        """
+
+        return DatasetReader(self.s3_hook, prefix)
+
+    @property
+    def watermark_store(self):
+        if self.watermark_key:
+            # the state object is downloaded to the run dir, concurrent runs never read each other's copy
+            return S3WatermarkStore(self.s3_hook, self.watermark_key, f"{self.run_dir}{self.dag_name}_watermark.json")
+
+        return LocalWatermarkStore(self.watermark_file_path)
+
+    def is_incremental(self):
+        """
+
+        A module runs incrementally when it defines `incremental_field`, unless a full refresh
+        was requested with the `full-refresh` flag or with `{"full_refresh": true}` on the
+        DAG run configuration.
+
+        """
+
+        if not self.incremental_field or self.full_refresh:
+            return False
+
+        try:
+            dag_run = get_current_context().get('dag_run')
+        except AirflowException:
+            # not running inside of a task
+            dag_run = None
+
+        if dag_run and (dag_run.conf or {}).get('full_refresh'):
+            return False
+
+        return True
+
+    def get_watermark(self):
+        """
+
+        Returns the high-water mark of the last successful run, or None on a full run.
+
+        """
+
+        if not self.is_incremental():
+            return None
+
+        watermark = self.watermark_store.get()
+        self.log.info(f'Incremental run from watermark {watermark}')
+
+        return watermark
+
+    def filter_incremental(self, records, watermark):
+        """
+
+        Lazily keeps only the records updated after `watermark`. Values of `incremental_field`
+        are compared as ISO-8601 strings, which sort in chronological order.
+
+        """
+
+        if watermark is None:
+            return iter(records)
+
+        return (record for record in records if self.in_window(record, watermark))
+
+    def high_watermark(self, records, watermark = None):
+        """
+
+        Returns the greatest `incremental_field` value between `records` and `watermark`.
+
+        """
+
+        values = chain((record.get(self.incremental_field) for record in records), [watermark])
+
+        return max((value for value in values if value), default = None)
+
+    def save_watermark(self, watermark):
+        """
+
+        Persists the high-water mark of the loaded records. It must only be called after
+        the records were successfully loaded.
+
+        """
+
+        if not self.incremental_field or not watermark:
+            return
+
+        self.watermark_store.set(watermark)
+        self.log.info(f'Watermark saved: {watermark}')
 
     def delete_temp_file(self):
         """
 
-        Deletes the temporary file (when it uses the default name, self.temp_file_path).
+        Deletes the temporary file (when it uses the default name, self.temp_file_path), then the
+        stage dir of the run (see `clean_stage_area`).
 
         """
     
+        temp_file_path = self.temp_file_path
         try:
-            remove(self.temp_file_path)
+            remove(temp_file_path)
         except FileNotFoundError:
-            raise FileNotFoundError(f"Couldn't find temporary file in {self.temp_file_path}.")
+            raise FileNotFoundError(f"Couldn't find temporary file in {temp_file_path}.")
+        finally:
+            self.clean_stage_area()
             
-        self.log.info(f'Temporary file removed in path: {self.temp_file_path}')
+        self.log.info(f'Temporary file removed in path: {temp_file_path}')
+
+    def clean_stage_area(self):
+        """
+
+        Removes the stage dir of the current run, then the dirs of idle runs, within the
+        budget of the stage area (see StageArea.cleanup).
+
+        """
+
+        self.stage_area.remove(self.run_id)
+        summary = self.stage_area.cleanup()
+        self.metrics.incr('stage.removed_runs', summary['removed'])
+        self.metrics.incr('stage.freed_bytes', summary['freed_bytes'])
@@ -0,0 +1,60 @@
+import io, gzip, json
+
+from itertools import islice
+
+def open_records_file(file_path, mode = 'r'):
+    """
+
+    Opens a newline-delimited JSON file in text mode. Files ending with `.gz` are
+    transparently gzip-compressed, with a fixed modification time in the gzip header,
+    so the same records always produce the same bytes (and the same S3 ETag).
+
+    """
+
+    if file_path.endswith('.gz'):
+        return io.TextIOWrapper(gzip.GzipFile(file_path, f'{mode}b', mtime = 0), encoding = 'utf-8')
+
+    return open(file_path, mode, encoding = 'utf-8')
+
+def write_records(file_path, records):
+    """
+
+    Writes an iterable of records to `file_path`, one JSON document per line,
+    and returns the quantity of records written. Records are consumed one at a time.
+
+    """
+
+    count = 0
+    with open_records_file(file_path, 'w') as f:
+        for record in records:
+            f.write(json.dumps(record))
+            f.write('\n')
+            count += 1
+
+    return count
+
+def read_records(file_path):
+    """
+
+    Yields the records of a newline-delimited JSON file one at a time.
+
+    """
+
+    with open_records_file(file_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def batched(records, batch_size):
+    """
+
+    Groups an iterable of records into lists of at most `batch_size` records.
+
+    """
+
+    records = iter(records)
+    while True:
+        batch = list(islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
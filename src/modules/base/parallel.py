@@ -0,0 +1,117 @@
+import multiprocessing
+
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from src.modules.base.ndjson import batched
+
+# module class of the worker process, set once by `_init_worker`
+_module_cls = None
+
+def _init_worker(module_cls):
+    global _module_cls
+    _module_cls = module_cls
+    # the `fields` recipe is compiled once per worker process
+    module_cls.get_plan()
+
+def _transform_group(base_dir, token, records, engine):
+    """
+
+    Runs in a worker process: transforms a group of records in batches and writes them
+    straight to Parquet files under `base_dir` (and its bridge tables). Only the lists of
+    written files, by dataset, go back to the parent process, never the DataFrames.
+
+    """
+
+    plan = _module_cls.get_plan()
+    writers = _module_cls.dataset_writers(base_dir, token = token)
+
+    for batch in batched(records, _module_cls.batch_size):
+        if engine == 'arrow':
+            data = _module_cls.normalize_records_arrow(batch)
+            data = plan.apply_arrow(data)[0] if data.num_rows else data
+        else:
+            data = _module_cls.normalize_records(batch)
+            data = plan.apply(data)[0] if not data.empty else data
+
+        if not len(data):
+            continue
+
+        data, bridges = _module_cls.split_bridges(data)
+        writers[None].write(data)
+        for column, bridge in bridges.items():
+            writers[column].write(bridge)
+
+    return {column: writer.close() for column, writer in writers.items()}
+
+
+class ParallelTransformer:
+    """
+
+    Transforms records with the compiled `fields` recipe of a module class in a pool of
+    worker processes, so CPU-bound recipes (i.g. `fn` lambdas) use every core.
+
+    Records are split in groups of `group_size` records, in order, and every group is written
+    by one worker to its own files, named after the run token and the group position:
+
+        <base_dir>/<partition_name>=<value>/part-<token>-<group>-<sequence>.parquet
+
+    The same input always produces the same files with the same rows, whatever the quantity
+    of workers or the order in which the groups finish. At most `2 * workers` groups are in
+    flight at once, so memory stays bounded with big inputs.
+
+    Workers are started with the `spawn` context: they import the module class by reference
+    and compile its plan again, instead of inheriting the state (and the open connections)
+    of the Airflow task process.
+
+    Parameters:
+
+        - module_cls(type): BaseModule subclass whose `fields`, `normalize_records` (or
+                            `normalize_records_arrow`) and dataset layout are used.
+        - workers(int): quantity of worker processes.
+        - group_size(int): quantity of records transformed by each task of the pool.
+        - engine(str): 'pandas' or 'arrow' (see `BaseModule.engine`).
+
+    """
+
+    def __init__(self, module_cls, workers, group_size, engine = 'pandas'):
+        self.module_cls = module_cls
+        self.workers = workers
+        self.group_size = group_size
+        self.engine = engine
+
+    def run(self, groups, base_dir, token):
+        """
+
+        Transforms an iterable of record groups (see `groups`) and yields, in input order, the
+        files written for each group: a dict with the list of (local file path, path relative to
+        the dataset) of the dataset (key None) and of each bridge table (key: column).
+
+        """
+
+        context = multiprocessing.get_context('spawn')
+
+        with ProcessPoolExecutor(max_workers = self.workers, mp_context = context,
+                                 initializer = _init_worker, initargs = (self.module_cls,)) as executor:
+            def submit(position, group):
+                return executor.submit(_transform_group, base_dir, f'{token}-{position:05d}', group, self.engine)
+
+            groups = enumerate(groups)
+            pending = deque(submit(position, group) for position, group in islice(groups, 2 * self.workers))
+
+            while pending:
+                files = pending.popleft().result()
+
+                for position, group in islice(groups, 1):
+                    pending.append(submit(position, group))
+
+                yield files
+
+    def groups(self, records):
+        """
+
+        Splits an iterable of records in lists of `group_size` records.
+
+        """
+
+        return batched(records, self.group_size)
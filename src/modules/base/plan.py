@@ -0,0 +1,459 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+from src.modules.base.functions import memoize, DEFAULT_CACHE_SIZE
+
+@dataclass(frozen=True)
+class ColumnStep:
+    """
+
+    Transformation of a single source column, compiled from one entry of `BaseModule.fields`.
+    Steps are applied in the order: replace > fn > batch_fn > type > date_format > fillna.
+
+    Columns with a `list` mode hold lists: `native` and `bridge` columns are kept as lists and
+    the steps are applied to each item, `explode` columns are exploded by `normalize_records`
+    before the steps, which then see one item per row.
+
+    """
+
+    source: str
+    target: str
+    replace: Any = None
+    fn: Optional[Callable] = None
+    batch_fn: Optional[Callable] = None
+    type: Any = None
+    date_format: Optional[str] = None
+    fillna: Any = None
+    list: Optional[str] = None
+
+    @property
+    def has_value_steps(self) -> bool:
+        return any(option is not None for option in
+                   (self.replace, self.fn, self.batch_fn, self.type, self.date_format, self.fillna))
+
+    @property
+    def keeps_lists(self) -> bool:
+        return self.list in ('native', 'bridge')
+
+    @property
+    def arrow_type(self):
+        """
+
+        Arrow type of the output column when the recipe defines it (by `type`, `date_format` or
+        a kept `list` mode), or None. Items of lists are strings unless their steps define a type.
+        Strings are large strings, like the columns of the pandas engine.
+
+        """
+
+        value_type = None
+        if self.date_format:
+            value_type = pa.timestamp('us')
+        elif self.type:
+            value_type = arrow_type_of(self.type)
+
+        if self.keeps_lists:
+            return pa.list_(value_type or pa.string())
+
+        return pa.large_string() if value_type == pa.string() else value_type
+
+    def apply(self, series: pd.Series) -> pd.Series:
+        if self.keeps_lists:
+            if not self.has_value_steps:
+                return series
+
+            # the items of every list are transformed at once, through Arrow, and the column keeps
+            # its Arrow list type, so files of batches with only empty lists have the same schema
+            array = pa.array(series, from_pandas=True)
+            return pd.Series(pd.arrays.ArrowExtensionArray(self.apply_arrow(array)), index=series.index)
+
+        return self.apply_values(series)
+
+    def apply_values(self, series: pd.Series) -> pd.Series:
+        if self.replace:
+            series = series.replace(self.replace)
+
+        if self.fn:
+            series = series.map(self.fn)
+
+        if self.batch_fn:
+            result = self.batch_fn(series)
+            series = result if isinstance(result, pd.Series) else pd.Series(result, index=series.index)
+
+        if self.type:
+            series = series.astype(self.type)
+
+        if self.date_format:
+            series = pd.to_datetime(series, format=self.date_format)
+
+        if self.fillna:
+            series = series.fillna(self.fillna)
+
+        return series
+
+    def apply_arrow(self, array):
+        """
+
+        Same as `apply`, for the Arrow engine: every option runs as an Arrow compute kernel.
+        Options without an Arrow version (`fn`, a `batch_fn` without an `arrow` attribute, a
+        non-dict `replace` or a type or date format Arrow can't parse) make the column go through
+        `apply_values` in pandas, and back to Arrow.
+
+        """
+
+        if self.keeps_lists:
+            return self.apply_items_arrow(array) if self.has_value_steps else array
+
+        return self.apply_values_arrow(array)
+
+    def apply_items_arrow(self, array):
+        """
+
+        Applies the steps to the items of a list column and rebuilds the lists, keeping the
+        null lists.
+
+        """
+
+        if isinstance(array, pa.ChunkedArray):
+            array = array.combine_chunks()
+
+        if not pa.types.is_list(array.type) and not pa.types.is_large_list(array.type):
+            # every list of the batch is null, typed by the `type` option when defined
+            if self.type:
+                return pa.nulls(len(array), type=pa.list_(pa.type_for_alias(str(self.type))))
+            return array
+
+        lengths = pc.fill_null(pc.list_value_length(array), 0).to_numpy(zero_copy_only=False)
+        offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]), type=pa.int32())
+        items = self.apply_values_arrow(pc.list_flatten(array))
+
+        if isinstance(items, pa.ChunkedArray):
+            items = items.combine_chunks()
+
+        return pa.ListArray.from_arrays(offsets, items, mask=array.is_null())
+
+    def apply_values_arrow(self, array):
+        if not self.supports_arrow():
+            series = array.to_pandas() if len(array) else pd.Series([], dtype=object)
+            return pa.array(self.apply_values(series), from_pandas=True)
+
+        if self.replace:
+            keys = pa.array(list(self.replace.keys()))
+            values = pa.array(list(self.replace.values()), type=array.type)
+            positions = pc.index_in(array, value_set=keys)
+            array = pc.if_else(pc.is_null(positions), array, pc.take(values, positions))
+
+        if self.batch_fn:
+            array = self.batch_fn.arrow(array)
+
+        if self.type:
+            array = pc.cast(array, pa.type_for_alias(str(self.type)))
+
+        if self.date_format:
+            array = arrow_strptime(array, self.date_format)
+
+        if self.fillna:
+            array = pc.fill_null(array, self.fillna)
+
+        return array
+
+    def supports_arrow(self) -> bool:
+        if self.fn:
+            return False
+
+        if self.batch_fn and not hasattr(self.batch_fn, 'arrow'):
+            return False
+
+        if self.replace and not isinstance(self.replace, dict):
+            return False
+
+        if self.type:
+            try:
+                pa.type_for_alias(str(self.type))
+            except ValueError:
+                return False
+
+        if self.date_format and '%f' in self.date_format and not self.date_format.startswith(ISO_FORMAT):
+            return False
+
+        return True
+
+
+# prefix of the ISO-8601 date formats parsed by an Arrow cast
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def arrow_type_of(dtype):
+    # Arrow type of a `type` option: an Arrow alias (i.g. 'int64'), or a pandas dtype (i.g. 'Int64')
+    try:
+        return pa.type_for_alias(str(dtype))
+    except ValueError:
+        pass
+
+    try:
+        return pa.array(pd.Series([], dtype=dtype), from_pandas=True).type
+    except (TypeError, ValueError, pa.ArrowException):
+        return None
+
+def arrow_strptime(array, date_format):
+    """
+
+    Parses strings to naive timestamps, like `pd.to_datetime(series, format=date_format)`.
+    Arrow's strptime has no `%f` (fractions of seconds), so ISO-8601 formats with fractions
+    (i.g. '%Y-%m-%dT%H:%M:%S.%fZ') are parsed by a cast, as UTC, and the zone is dropped.
+    Timestamps are in microseconds, the unit of the pandas engine, so both engines write
+    Parquet files with the same schema.
+
+    """
+
+    if '%f' not in date_format:
+        return pc.strptime(array, format=date_format, unit='us')
+
+    if date_format.endswith('Z'):
+        return pc.cast(pc.cast(array, pa.timestamp('us', 'UTC')), pa.timestamp('us'))
+
+    return pc.cast(array, pa.timestamp('us'))
+
+
+@dataclass(frozen=True)
+class TransformPlan:
+    """
+
+    Immutable, validated version of a `fields` recipe (see `BaseModule.transform` for the
+    recipe options). It is compiled once per module class and applied to every DataFrame.
+
+    Attributes:
+
+        - steps (tuple): one ColumnStep per source column, in the order of the recipe.
+        - columns (tuple): output column names, in the order of the recipe.
+        - exploded (tuple): source columns exploded before the steps (`list: explode`).
+        - bridges (tuple): output columns written as bridge tables (`list: bridge`).
+
+    """
+
+    steps: Tuple[ColumnStep, ...]
+    columns: Tuple[str, ...]
+    exploded: Tuple[str, ...] = ()
+    bridges: Tuple[str, ...] = ()
+
+    options = ('rename', 'fn', 'batch_fn', 'cache', 'type', 'replace', 'date_format', 'fillna', 'list')
+    list_modes = ('native', 'explode', 'bridge')
+
+    @classmethod
+    def compile(cls, fields: dict) -> 'TransformPlan':
+        """
+
+        Validates a `fields` recipe and compiles it into a TransformPlan.
+
+        """
+
+        if not fields:
+            raise ValueError('The fields recipe is empty.')
+
+        steps = []
+
+        for col, col_val in fields.items():
+
+            if isinstance(col_val, str):
+                steps.append(ColumnStep(source=col, target=col_val))
+
+            elif isinstance(col_val, dict):
+                unknown_options = set(col_val) - set(cls.options)
+                if unknown_options:
+                    raise ValueError(f'Unknown options {sorted(unknown_options)} for field {col}, '
+                                     f'should be any of {list(cls.options)}.')
+
+                for option in ('fn', 'batch_fn'):
+                    if col_val.get(option) is not None and not callable(col_val[option]):
+                        raise TypeError(f'The {option} option of field {col} should be callable.')
+
+                fn = col_val.get('fn')
+                cache = col_val.get('cache')
+
+                if cache and not fn:
+                    raise ValueError(f'The cache option of field {col} requires a fn.')
+
+                if col_val.get('list') is not None and col_val['list'] not in cls.list_modes:
+                    raise ValueError(f"Unknown list mode {col_val['list']} for field {col}, "
+                                     f'should be any of {list(cls.list_modes)}.')
+
+                if cache:
+                    # `cache: True` uses the default size, an int sets the maximum quantity of cached values
+                    fn = memoize(fn, DEFAULT_CACHE_SIZE if cache is True else int(cache))
+
+                steps.append(ColumnStep(
+                    source=col,
+                    target=col_val.get('rename') or col,
+                    replace=col_val.get('replace'),
+                    fn=fn,
+                    batch_fn=col_val.get('batch_fn'),
+                    type=col_val.get('type'),
+                    date_format=col_val.get('date_format'),
+                    fillna=col_val.get('fillna'),
+                    list=col_val.get('list')
+                ))
+
+            else:
+                raise TypeError(f'Not able to parse fields for {col_val}, should be dict or str.')
+
+        columns = tuple(step.target for step in steps)
+
+        duplicated = {col for col in columns if columns.count(col) > 1}
+        if duplicated:
+            raise ValueError(f'Output columns {sorted(duplicated)} are defined more than once.')
+
+        return cls(
+            steps=tuple(steps),
+            columns=columns,
+            exploded=tuple(step.source for step in steps if step.list == 'explode'),
+            bridges=tuple(step.target for step in steps if step.list == 'bridge')
+        )
+
+    def apply(self, df: pd.DataFrame) -> Tuple[pd.DataFrame, list]:
+        """
+
+        Applies every step column by column and builds the output DataFrame once, already
+        renamed and ordered, without copying the input frame. Returns a tuple with the new
+        DataFrame and the list of source columns that were not available in `df`, which are
+        created as empty columns (i.g. documents from NoSQL engines that don't contain a key).
+
+        """
+
+        new_columns = {}
+        missing = []
+
+        for step in self.steps:
+            if step.source in df.columns:
+                new_columns[step.target] = step.apply(df[step.source])
+            else:
+                missing.append(step.source)
+                new_columns[step.target] = None
+
+        return pd.DataFrame(new_columns, index=df.index, columns=list(self.columns)), missing
+
+    def apply_arrow(self, table: pa.Table) -> Tuple[pa.Table, list]:
+        """
+
+        Same as `apply`, for the Arrow engine: returns a new pyarrow Table, already renamed and
+        ordered, and the list of missing source columns, created as null columns of the type
+        defined by the recipe (see `ColumnStep.arrow_type`).
+
+        """
+
+        arrays = []
+        missing = []
+
+        for step in self.steps:
+            if step.source in table.column_names:
+                arrays.append(step.apply_arrow(table.column(step.source)))
+            else:
+                missing.append(step.source)
+                arrays.append(pa.nulls(table.num_rows, type=step.arrow_type or pa.null()))
+
+        return pa.Table.from_arrays(arrays, names=list(self.columns)), missing
+
+    def arrow_types(self) -> dict:
+        """
+
+        Returns the Arrow types of the output columns whose type the recipe defines, by column.
+
+        """
+
+        return {step.target: step.arrow_type for step in self.steps if step.arrow_type is not None}
+
+    def source_of(self, target: str) -> str:
+        """
+
+        Returns the source column of an output column.
+
+        """
+
+        return self.steps[self.columns.index(target)].source
+
+    def explode(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+
+        Explodes the `list: explode` columns of a normalized DataFrame, one row per item.
+        Every exploded column multiplies the rows by the size of its lists.
+
+        """
+
+        for source in self.exploded:
+            if source in df.columns:
+                df = df.explode(source)
+
+        return df.reset_index(drop=True) if self.exploded else df
+
+    def explode_arrow(self, table: pa.Table) -> pa.Table:
+        """
+
+        Same as `explode`, for the Arrow engine: each row is repeated once per item of its list,
+        and empty or null lists keep a single row with a null item, like pandas' explode.
+
+        """
+
+        for source in self.exploded:
+            if source not in table.column_names:
+                continue
+
+            column = table.column(source).combine_chunks()
+            if not pa.types.is_list(column.type):
+                continue
+
+            lengths = pc.fill_null(pc.list_value_length(column), 0)
+            empty = pa.array([[None]] * len(column), type=column.type)
+            column = pc.if_else(pc.greater(lengths, 0), column, empty)
+
+            rows = pc.list_parent_indices(column)
+            table = table.take(rows).set_column(table.column_names.index(source), source, pc.list_flatten(column))
+
+        return table
+
+    def split_bridges(self, df: pd.DataFrame, key: str, partition_by: str = None) -> Tuple[pd.DataFrame, dict]:
+        """
+
+        Moves the `list: bridge` columns of a transformed DataFrame to bridge tables, with one
+        row per (key, item): i.g. `character_id -> film`. The partition column, if any, is kept
+        in the bridge tables, so they are partitioned like the main dataset. Returns a tuple with
+        the DataFrame without the bridge columns and a dict of bridge DataFrames by column.
+
+        """
+
+        if not self.bridges:
+            return df, {}
+
+        bridges = {}
+        for target in self.bridges:
+            columns = [column for column in (key, partition_by) if column and column != target] + [target]
+            bridge = df[columns].explode(target)
+            bridges[target] = bridge[bridge[target].notna()].reset_index(drop=True)
+
+        return df.drop(columns=list(self.bridges)), bridges
+
+    def split_bridges_arrow(self, table: pa.Table, key: str, partition_by: str = None) -> Tuple[pa.Table, dict]:
+        """
+
+        Same as `split_bridges`, for the Arrow engine.
+
+        """
+
+        if not self.bridges:
+            return table, {}
+
+        bridges = {}
+        for target in self.bridges:
+            columns = [column for column in (key, partition_by) if column and column != target]
+            lists = table.column(target).combine_chunks()
+
+            if pa.types.is_list(lists.type):
+                rows, items = pc.list_parent_indices(lists), pc.list_flatten(lists)
+            else:
+                # every list of the batch is null
+                rows, items = pa.array([], type=pa.int64()), pa.array([], type=lists.type)
+
+            bridge = table.select(columns).take(rows).append_column(target, items)
+            bridges[target] = bridge.filter(pc.is_valid(bridge.column(target)))
+
+        return table.drop_columns(list(self.bridges)), bridges
@@ -0,0 +1,209 @@
+import operator
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+from src.modules.base.manifest import DatasetManifest, file_entry, is_hidden, parquet_stats, stat_value
+from src.modules.base.writer import NULL_PARTITION
+
+# comparison of a filter, by operator
+OPERATORS = {
+    '=': operator.eq, '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge
+}
+
+class DatasetReader(LoggingMixin):
+    """
+
+    Reads a Parquet dataset stored in S3 (i.g. the curated layer), fetching only what a query
+    needs instead of downloading whole objects:
+
+        1. the files come from the dataset manifest (see DatasetManifest), or from a listing
+           of `prefix` when there is no manifest yet;
+        2. files whose partition values or min/max statistics can't match the filters are
+           skipped, without any request;
+        3. the footer of each remaining file is read with a ranged GET (see S3RangeFile), and
+           only the row groups whose statistics may match are read, with only the columns
+           of the projection and of the filters;
+        4. the rows are filtered exactly, and returned as a pyarrow Table (`read`) or as a
+           stream of RecordBatches (`iter_batches`).
+
+    Filters are a list of (column, operator, value) conditions that must all be true, like
+    pyarrow's: operators are '=', '==', '!=', '<', '<=', '>', '>=', 'in' and 'not in'.
+    Partition columns (i.g. 'updated_month') can be filtered and selected like the others,
+    their values are strings.
+
+        reader = DatasetReader(S3Hook('curated'), 'disney-api/characters/')
+        table = reader.read(columns = ['id', 'name'], filters = [('updated_month', '>=', '2024-01')])
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket of the dataset.
+        - prefix(str): S3 prefix of the dataset, ending with '/'.
+
+    """
+
+    operators = tuple(OPERATORS) + ('in', 'not in')
+
+    def __init__(self, s3_hook, prefix):
+        self.s3_hook = s3_hook
+        self.prefix = prefix
+
+    def files(self) -> list:
+        """
+
+        Returns the manifest entries of the live files of the dataset.
+
+        """
+
+        manifest = DatasetManifest.load(self.s3_hook, self.prefix)
+        if manifest.files:
+            return [manifest.files[key] for key in sorted(manifest.files)]
+
+        return [file_entry(file['file_path'], file['size'], self.prefix)
+                for file in self.s3_hook.list_files_from_bucket(filter_by_ext='.parquet', prefix=self.prefix)
+                if not is_hidden(file['file_path'], self.prefix)]
+
+    def read(self, columns = None, filters = None) -> pa.Table:
+        """
+
+        Returns the rows matching `filters`, with the `columns` projection (every column by
+        default), as a single pyarrow Table.
+
+        """
+
+        batches = list(self.iter_batches(columns=columns, filters=filters))
+        if not batches:
+            return pa.table({})
+
+        tables = [pa.Table.from_batches([batch]) for batch in batches]
+        return pa.concat_tables(tables, promote_options='permissive')
+
+    def iter_batches(self, columns = None, filters = None, batch_size = 65_536):
+        """
+
+        Lazily yields the rows matching `filters` as pyarrow RecordBatches of up to
+        `batch_size` rows, one file and one row group at a time.
+
+        """
+
+        filters = self._validate(filters or [])
+        files = self.files()
+        selected = [entry for entry in files if self._file_may_match(entry, filters)]
+
+        self.log.info(f'{len(selected)} of {len(files)} files of {self.prefix} may match {filters}')
+
+        for entry in selected:
+            yield from self._read_file(entry, columns, filters, batch_size)
+
+    def _validate(self, filters):
+        for condition in filters:
+            if len(condition) != 3 or condition[1] not in self.operators:
+                raise ValueError(f'Invalid filter {condition}, should be (column, operator, value) '
+                                 f'with an operator in {list(self.operators)}.')
+
+        return [tuple(condition) for condition in filters]
+
+    def _file_may_match(self, entry, filters):
+        partition = entry.get('partition') or {}
+        stats = (entry.get('stats') or {}).get('columns', {})
+
+        for column, op, value in filters:
+            if column in partition:
+                if not self._matches(partition_value(partition[column]), op, value):
+                    return False
+            elif column in stats and not self._may_match(stats[column], op, value):
+                return False
+
+        return True
+
+    def _read_file(self, entry, columns, filters, batch_size):
+        partition = entry.get('partition') or {}
+        parquet_file = pq.ParquetFile(self.s3_hook.open(entry['key'], entry.get('size')))
+
+        # row groups whose statistics may match, from the manifest or from the footer
+        stats = entry.get('stats') or parquet_stats(parquet_file.metadata)
+        row_groups = [n for n, row_group in enumerate(stats['row_groups'])
+                      if all(column in partition or column not in row_group['columns']
+                             or self._may_match(row_group['columns'][column], op, value)
+                             for column, op, value in filters)]
+
+        if not row_groups:
+            return
+
+        file_columns = parquet_file.schema_arrow.names
+        wanted = list(columns) if columns is not None else file_columns + list(partition)
+        read_columns = [column for column in file_columns
+                        if column in wanted or any(column == condition[0] for condition in filters)]
+
+        for batch in parquet_file.iter_batches(batch_size=batch_size, row_groups=row_groups, columns=read_columns):
+            table = pa.Table.from_batches([batch])
+
+            for name, value in partition.items():
+                if name in wanted or any(name == condition[0] for condition in filters):
+                    table = table.append_column(name, pa.array([partition_value(value)] * table.num_rows, pa.string()))
+
+            if filters:
+                table = table.filter(self._expression(filters))
+
+            if table.num_rows:
+                yield from table.select([column for column in wanted if column in table.column_names]).to_batches()
+
+    @staticmethod
+    def _expression(filters):
+        expression = None
+        for column, op, value in filters:
+            field = pc.field(column)
+            if op == 'in':
+                condition = field.isin(list(value))
+            elif op == 'not in':
+                condition = ~field.isin(list(value))
+            else:
+                condition = OPERATORS[op](field, value)
+
+            expression = condition if expression is None else expression & condition
+
+        return expression
+
+    @staticmethod
+    def _matches(actual, op, value):
+        # exact check of a partition value
+        if actual is None:
+            return False
+
+        try:
+            if op == 'in':
+                return actual in {str(stat_value(item)) for item in value}
+            if op == 'not in':
+                return actual not in {str(stat_value(item)) for item in value}
+            return OPERATORS[op](actual, str(stat_value(value)))
+        except TypeError:
+            return True
+
+    @staticmethod
+    def _may_match(bounds, op, value):
+        # check of a condition against the [min, max] statistics of a file or a row group
+        low, high = bounds
+
+        try:
+            if op == 'in':
+                return any(low <= stat_value(item) <= high for item in value)
+            if op == 'not in':
+                return not (low == high and low in {stat_value(item) for item in value})
+
+            value = stat_value(value)
+            if op in ('=', '=='):
+                return low <= value <= high
+            if op == '!=':
+                return not (low == high == value)
+            if op in ('<', '<='):
+                return OPERATORS[op](low, value)
+            return OPERATORS[op](high, value)
+        except TypeError:
+            # statistics and value that can't be compared never skip a file
+            return True
+
+
+def partition_value(value):
+    return None if value == NULL_PARTITION else value
@@ -0,0 +1,155 @@
+import os
+import re
+import time
+import shutil
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+class StageArea(LoggingMixin):
+    """
+
+    Local stage area of a DAG, with one dir per DAG run, so runs of the same DAG (i.g. backfills
+    or catch-up runs) never share their temporary files:
+
+        <root>runs/<dag_name>/<run_id>/
+
+    Dirs of finished runs are removed with `remove`, and the dirs left by failed runs are swept
+    by `cleanup`, every time a new run dir is created:
+
+        - dirs not modified for more than `retention_hours` are removed;
+        - while the run dirs of the DAG use more than `max_bytes`, or the disk has less than
+          `min_free_bytes` free, the least recently modified dirs are removed first. Dirs modified
+          in the last `min_idle_minutes` are never removed, they may belong to running runs.
+
+    Parameters:
+
+        - root(str): stage area dir (TMP_DIR), ending with '/'.
+        - dag_name(str): name of the DAG.
+        - max_bytes(int): maximum quantity of bytes used by the run dirs of the DAG.
+        - min_free_bytes(int): minimum quantity of bytes kept free on the disk of the stage area.
+        - retention_hours(float): hours after which the dir of an idle run is removed.
+        - min_idle_minutes(float): minutes without changes before a dir can be removed to free space.
+
+    """
+
+    runs_dir = 'runs'
+
+    def __init__(self, root, dag_name, max_bytes = 20 * 1024 ** 3, min_free_bytes = 2 * 1024 ** 3,
+                 retention_hours = 24, min_idle_minutes = 60):
+        self.root = root
+        self.dag_name = dag_name
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.retention_hours = retention_hours
+        self.min_idle_minutes = min_idle_minutes
+
+    @property
+    def base_dir(self) -> str:
+        return f"{self.root}{self.runs_dir}/{self.dag_name}/"
+
+    def path(self, run_id) -> str:
+        return f"{self.base_dir}{run_dir_name(run_id)}/"
+
+    def run_dir(self, run_id) -> str:
+        """
+
+        Returns the dir of the run `run_id`, creating it (after a `cleanup`) on first use.
+
+        """
+
+        path = self.path(run_id)
+        if not os.path.isdir(path):
+            self.cleanup()
+            os.makedirs(path, exist_ok=True)
+
+        return path
+
+    def remove(self, run_id):
+        shutil.rmtree(self.path(run_id), ignore_errors=True)
+
+    def runs(self) -> list:
+        """
+
+        Returns the run dirs of the DAG, with their size and their last modification time
+        (the latest of their files).
+
+        """
+
+        try:
+            names = os.listdir(self.base_dir)
+        except FileNotFoundError:
+            return []
+
+        runs = []
+        for name in names:
+            path = f"{self.base_dir}{name}/"
+            if not os.path.isdir(path):
+                continue
+
+            try:
+                size, modified = dir_usage(path)
+            except FileNotFoundError:
+                # removed in the meantime, i.g. by the cleanup of another run
+                continue
+            runs.append({'path': path, 'size': size, 'modified': modified})
+
+        return runs
+
+    def cleanup(self) -> dict:
+        """
+
+        Removes the dirs of idle runs (see the class docstring), the least recently modified
+        first, and returns the quantity of removed dirs and freed bytes.
+
+        """
+
+        now = time.time()
+        runs = sorted(self.runs(), key=lambda run: run['modified'])
+        used = sum(run['size'] for run in runs)
+        summary = {'removed': 0, 'freed_bytes': 0}
+
+        for run in runs:
+            idle = now - run['modified']
+            stale = idle > self.retention_hours * 3600
+            over_budget = used > self.max_bytes or self._free_bytes() < self.min_free_bytes
+
+            if not stale and not (over_budget and idle > self.min_idle_minutes * 60):
+                continue
+
+            shutil.rmtree(run['path'], ignore_errors=True)
+            used -= run['size']
+            summary['removed'] += 1
+            summary['freed_bytes'] += run['size']
+
+        if summary['removed']:
+            self.log.info(f"{summary['removed']} run dirs removed from {self.base_dir}, "
+                          f"{summary['freed_bytes']} bytes freed")
+
+        if used > self.max_bytes or self._free_bytes() < self.min_free_bytes:
+            self.log.warning(f"The stage area of {self.dag_name} is over its budget ({used} bytes used, "
+                             f"{self._free_bytes()} bytes free on disk), but every run dir is in use")
+
+        return summary
+
+    def _free_bytes(self):
+        return shutil.disk_usage(self.root).free
+
+
+def run_dir_name(run_id):
+    # run ids hold characters that are not safe in paths, i.g. 'scheduled__2024-01-01T00:00:00+00:00'
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', run_id)
+
+def dir_usage(path):
+    size, modified = 0, os.path.getmtime(path)
+
+    for dir_path, _, file_names in os.walk(path):
+        modified = max(modified, os.path.getmtime(dir_path))
+        for file_name in file_names:
+            try:
+                stat = os.stat(os.path.join(dir_path, file_name))
+            except FileNotFoundError:
+                continue
+            size += stat.st_size
+            modified = max(modified, stat.st_mtime)
+
+    return size, modified
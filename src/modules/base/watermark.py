@@ -0,0 +1,67 @@
+import os, json
+
+from airflow.exceptions import AirflowException
+
+class LocalWatermarkStore:
+    """
+
+    Persists the high-water mark of an incremental module in a local JSON state file.
+
+    Parameters:
+
+        - file_path(str): path of the state file.
+
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def get(self):
+        try:
+            with open(self.file_path, 'r') as f:
+                return json.load(f).get('watermark')
+        except FileNotFoundError:
+            return None
+
+    def set(self, value):
+        os.makedirs(os.path.dirname(self.file_path) or '.', exist_ok = True)
+
+        # written to a temporary file first, so a failed write never loses the previous mark
+        temp_path = f'{self.file_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'watermark': value}, f)
+        os.replace(temp_path, self.file_path)
+
+
+class S3WatermarkStore:
+    """
+
+    Persists the high-water mark of an incremental module in a JSON object in S3,
+    so every worker reads the same state.
+
+    Parameters:
+
+        - s3_hook(S3Hook): hook to the bucket where the state object is stored.
+        - key(str): S3 key of the state object.
+        - temp_file_path(str): local path used to download and upload the state object.
+
+    """
+
+    def __init__(self, s3_hook, key, temp_file_path):
+        self.s3_hook = s3_hook
+        self.key = key
+        self.local_store = LocalWatermarkStore(temp_file_path)
+
+    def get(self):
+        try:
+            self.s3_hook.download_file(self.key, self.local_store.file_path)
+        except AirflowException:
+            # the state object does not exist yet: first incremental run
+            return None
+
+        return self.local_store.get()
+
+    def set(self, value):
+        self.local_store.set(value)
+        # runs that didn't move the watermark don't rewrite the state object
+        self.s3_hook.upload_file(self.local_store.file_path, self.key, skip_unchanged = True)
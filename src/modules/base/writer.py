@@ -0,0 +1,220 @@
+import io
+import os
+import uuid
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from airflow.utils.log.logging_mixin import LoggingMixin
+
+# partition value used by Hive/Athena for null keys
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+class ParquetDatasetWriter(LoggingMixin):
+    """
+
+    Buffers DataFrames (or pyarrow Tables) and writes them as a Hive-style partitioned Parquet dataset:
+
+        <base_dir>/<partition_name>=<value>/<file_prefix>-<run token>-<sequence>.parquet
+
+    Rows are buffered per partition and written to a new file when the partition reaches
+    `max_rows_per_file` rows. When the whole buffer reaches `max_buffered_rows`, the biggest
+    partition is written early, so memory stays bounded with many partitions.
+
+    pyarrow Tables (see the `arrow` engine of BaseModule) are partitioned and written
+    without being converted to pandas.
+
+    Parameters:
+
+        - base_dir(str): local directory of the dataset.
+        - partition_by(str): column used to partition the rows. Without it, every row is
+                             written to the root of the dataset.
+        - partition_name(str): name of the partition directory, defaults to `partition_by`.
+        - partition_format(str): strftime format applied to datetime partition columns,
+                                 i.g. '%Y-%m-%d' to partition by day.
+        - max_rows_per_file(int): target quantity of rows of each file.
+        - row_group_size(int): maximum quantity of rows of each Parquet row group.
+        - max_buffered_rows(int): maximum quantity of rows buffered over all partitions.
+        - compression(str): Parquet compression codec ('snappy', 'zstd', 'gzip', 'none').
+        - use_dictionary(bool): enables Parquet dictionary encoding.
+        - file_prefix(str): prefix of the file names.
+        - token(str): run token in the file names, a random one by default.
+        - sink(callable): when provided, files are written to memory and passed to
+                          `sink(relative_path, buffer)` instead of being written to `base_dir`,
+                          i.g. to upload them without a local file.
+        - types(dict): Arrow types of the columns, by name (see `TransformPlan.arrow_types`).
+                       Columns are cast to them before they are written, and other string
+                       columns are written as large strings, so every file of the dataset has
+                       the same schema, whatever the engine and the batch (i.g. a batch where
+                       a column is missing, and is null typed).
+
+    """
+
+    def __init__(self, base_dir, partition_by = None, partition_name = None, partition_format = '%Y-%m-%d',
+                 max_rows_per_file = 500_000, row_group_size = 100_000, max_buffered_rows = 1_000_000,
+                 compression = 'snappy', use_dictionary = True, file_prefix = 'part', sink = None, token = None,
+                 types = None):
+        self.base_dir = base_dir
+        self.partition_by = partition_by
+        self.partition_name = partition_name or partition_by
+        self.partition_format = partition_format
+        self.max_rows_per_file = max_rows_per_file
+        self.row_group_size = row_group_size
+        self.max_buffered_rows = max_buffered_rows
+        self.compression = compression
+        self.use_dictionary = use_dictionary
+        self.file_prefix = file_prefix
+        self.sink = sink
+        self.types = types or {}
+
+        # files of different runs never overwrite each other
+        self.token = token or uuid.uuid4().hex[:12]
+        self.sequence = 0
+
+        self.buffers = {}
+        self.buffer_rows = {}
+        self.buffered_rows = 0
+        self.written_files = []
+        self.rows_written = 0
+        self.bytes_written = 0
+
+    def write(self, df):
+        """
+
+        Buffers the rows of `df` (a DataFrame or a pyarrow Table) in their partitions,
+        flushing full partitions to disk.
+
+        """
+
+        if not len(df):
+            return
+
+        if not self.partition_by:
+            self._buffer(None, df)
+            return
+
+        if isinstance(df, pa.Table):
+            for value, partition_table in self._split_table(df):
+                self._buffer(value, partition_table)
+            return
+
+        for value, partition_df in df.groupby(self._partition_values(df[self.partition_by]), sort=False):
+            self._buffer(value, partition_df)
+
+    def close(self):
+        """
+
+        Writes every buffered partition and returns the list of written files, as tuples
+        (local file path, path relative to `base_dir`). The local file path is None when
+        the files are passed to a `sink`.
+
+        """
+
+        for partition in list(self.buffers):
+            self._flush(partition)
+
+        if self.written_files:
+            self.log.info(f'{self.rows_written} rows written to {len(self.written_files)} files '
+                          f'({self.bytes_written} bytes)')
+
+        return self.written_files
+
+    def _partition_values(self, series):
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.dt.strftime(self.partition_format)
+        else:
+            values = series.astype('string')
+
+        return values.fillna(NULL_PARTITION)
+
+    def _split_table(self, table):
+        # rows are stably sorted by partition, so each partition is a contiguous slice
+        column = table.column(self.partition_by)
+        if pa.types.is_timestamp(column.type) or pa.types.is_date(column.type):
+            values = pc.strftime(column, format=self.partition_format)
+        else:
+            values = pc.cast(column, pa.string())
+
+        encoded = pc.dictionary_encode(pc.fill_null(values, NULL_PARTITION)).combine_chunks()
+        codes = encoded.indices.to_numpy(zero_copy_only=False)
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes, minlength=len(encoded.dictionary))
+
+        table = table.take(pa.array(order))
+        start = 0
+        for value, count in zip(encoded.dictionary.to_pylist(), counts):
+            if count:
+                yield value, table.slice(start, count)
+                start += count
+
+    def _buffer(self, partition, df):
+        self.buffers.setdefault(partition, []).append(df)
+        self.buffer_rows[partition] = self.buffer_rows.get(partition, 0) + len(df)
+        self.buffered_rows += len(df)
+
+        if self.buffer_rows[partition] >= self.max_rows_per_file:
+            self._flush(partition)
+
+        while self.buffered_rows >= self.max_buffered_rows and self.buffers:
+            self._flush(max(self.buffer_rows, key=self.buffer_rows.get))
+
+    def _flush(self, partition):
+        frames = self.buffers.pop(partition, [])
+        self.buffered_rows -= self.buffer_rows.pop(partition, 0)
+        if not frames:
+            return
+
+        if isinstance(frames[0], pa.Table):
+            df = pa.concat_tables(frames, promote_options='permissive')
+        else:
+            df = pd.concat(frames, ignore_index=True)
+
+        for start in range(0, len(df), self.max_rows_per_file):
+            self._write_file(partition, df[start:start + self.max_rows_per_file])
+
+    def _write_file(self, partition, df):
+        relative_dir = f'{self.partition_name}={partition}' if partition is not None else ''
+        file_name = f'{self.file_prefix}-{self.token}-{self.sequence:05d}.parquet'
+        relative_path = f'{relative_dir}/{file_name}' if relative_dir else file_name
+        self.sequence += 1
+
+        table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+        table = conform_table(table, self.types)
+
+        if self.sink:
+            file_path = None
+            buffer = io.BytesIO()
+            self._write_table(table, buffer)
+            size = buffer.tell()
+            buffer.seek(0)
+            self.sink(relative_path, buffer)
+        else:
+            file_path = os.path.join(self.base_dir, relative_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            self._write_table(table, file_path)
+            size = os.path.getsize(file_path)
+
+        self.written_files.append((file_path, relative_path))
+        self.rows_written += len(df)
+        self.bytes_written += size
+        # a summary is logged by `close`, files are only logged on debug
+        self.log.debug(f'{len(df)} rows written to {relative_path}')
+
+    def _write_table(self, table, where):
+        pq.write_table(table, where, row_group_size=self.row_group_size,
+                       compression=self.compression, use_dictionary=self.use_dictionary)
+
+
+def conform_table(table, types):
+    # casts the columns to their types, i.g. null columns, and `string` columns to `large_string`
+    for position, field in enumerate(table.schema):
+        target = types.get(field.name)
+        if target is None and field.type == pa.string():
+            target = pa.large_string()
+
+        if target is not None and field.type != target:
+            table = table.set_column(position, field.name, table.column(position).cast(target))
+
+    return table
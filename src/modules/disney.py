@@ -1,115 +1,247 @@
-import json
-import pandas as pd
-
-from hashlib import sha256
-from src.config.env import TMP_DIR
+from os import remove
+from functools import cached_property
 from src.modules.base.module import BaseModule
+from src.modules.base.functions import sha256_hash
+from src.modules.base.ndjson import write_records, read_records
 from hooks import DisneyApiHook, S3Hook
-from airflow.exceptions import AirflowException
+from airflow.exceptions import AirflowException, AirflowSkipException
+
+# raw characters are stored as gzip-compressed newline-delimited JSON
+CHARACTERS_RAW_KEY = 'disney-api/characters/characters.jsonl.gz'
+# curated characters are stored as a partitioned Parquet dataset
+CHARACTERS_CURATED_PREFIX = 'disney-api/characters/'
+# bridge tables of the `list: bridge` fields are stored next to it, i.g. 'disney-api/characters_films/'
+CHARACTERS_BRIDGE_PREFIX = 'disney-api/characters_{}/'
 
 
 class DisneyRaw(BaseModule):
 
-    temp_file_extn = '.json'
+    temp_file_extn = '.jsonl.gz'
     bucket = 'raw'
     dag_name = f"disney_api_{bucket}_dag"
-
-    def __init__(self):
-        self.disney_hook = DisneyApiHook()
-        self.s3_hook = S3Hook(self.bucket)
+    # every new version of the raw snapshot triggers the curated DAG
+    dataset = f's3://{bucket}/{CHARACTERS_RAW_KEY}'
+
+    @cached_property
+    def disney_hook(self):
+        # responses are staged in the run dir, and only committed to the cache by `load`
+        return DisneyApiHook(cache_dir = f"{self.dir_path}disney_api_cache/",
+                             cache_staging_dir = f"{self.run_dir}disney_api_cache/", metrics = self.metrics)
+
+    @cached_property
+    def s3_hook(self):
+        # the uploaded snapshot is kept in the download cache of DisneyCurated
+        return S3Hook(self.bucket, etag_index_path = f"{self.dir_path}s3_etags/{self.bucket}.json",
+                      download_cache_dir = f"{self.dir_path}s3_cache/{self.bucket}/", metrics = self.metrics)
     
     def extract(self):
-        characters = self.disney_hook.get_characters
-        with open(self.temp_file_path, 'w') as f:
-            f.write(json.dumps(characters))
+        status = {'modified': False}
+
+        def characters():
+            # characters are streamed page by page straight to the temp file
+            for page, page_modified in self.disney_hook.iter_character_pages():
+                status['modified'] = status['modified'] or page_modified
+                yield from page
 
-        self.log.info(f"Data successfully extracted to '{self.temp_file_path}'")
+        count = write_records(self.temp_file_path, characters())
+        self.metrics.incr('extract.records', count)
+
+        # every page was answered with `304 Not Modified`: skipping the downstream tasks.
+        # Otherwise the whole snapshot is loaded even without updated characters (i.g. when
+        # characters were deleted), `load` skips it when its content didn't change.
+        if not status['modified']:
+            remove(self.temp_file_path)
+            raise AirflowSkipException("Disney API data has not changed since the last run.")
+
+        self.log.info(f"{count} characters successfully extracted to '{self.temp_file_path}'")
     
     def load(self):
         try:
-            self.s3_hook.upload_file(
+            # the snapshot is not uploaded again when its bytes didn't change
+            uploaded = self.s3_hook.upload_file(
                 self.temp_file_path,
-                'disney-api/characters/characters.json'
+                CHARACTERS_RAW_KEY,
+                skip_unchanged = True
             )
         except Exception as e:
             raise AirflowException(f"Could not upload file to amazon S3: {e}")
 
+        # only now the snapshot is published: until the responses of the run are committed, the
+        # next runs request the API with the validators of the last published snapshot
+        self.disney_hook.commit_cache()
+
+        # skipped tasks don't publish their Dataset, so the curated DAG is not triggered
+        # for a snapshot it already processed
+        if not uploaded:
+            remove(self.temp_file_path)
+            raise AirflowSkipException(f"'{CHARACTERS_RAW_KEY}' is unchanged, upload skipped")
+
 
 class DisneyCurated(BaseModule):
     
-    temp_file_extn = '.json'
+    temp_file_extn = '.jsonl.gz'
     bucket = 'curated'
-    files_to_send = []
     dag_name = f"disney_api_{bucket}_dag"
-
+    incremental_field = 'updatedAt'
+    watermark_key = f'disney-api/_state/{dag_name}.json'
+    dataset = f's3://{bucket}/{CHARACTERS_CURATED_PREFIX}'
+
+    # curated characters are written as Parquet files partitioned by update month: characters are
+    # updated a few at a time over many days, daily partitions would hold about one row each
+    partition_by = 'updated_at'
+    partition_name = 'updated_month'
+    partition_format = '%Y-%m'
+    compaction_prefix = CHARACTERS_CURATED_PREFIX
+    # updated characters replace their previous rows (see BaseModule.merge_dataset)
+    primary_key = 'id'
+    write_mode = 'merge'
+
+    # list fields are kept as Parquet list<string> columns: one row per character, instead
+    # of the product of the sizes of every list when all of them are exploded
     fields = {
       "_id": {"rename":"id", "type":"int64"},
-      "films": "films",
-      "shortFilms": "short_films",
-      "tvShows": "tv_shows",
-      "videoGames": "video_games",
-      "parkAttractions": "park_attractions",
-      "allies": "allies",
-      "enemies": "enemies",
-      "sourceUrl": "source_url",
-      "name": {"rename":"name", "fn":lambda x: sha256(x.encode()).hexdigest()}, # Encrypt the column 'name'
-      "imageUrl": "image_url",
-      "createdAt": {"rename":"created_at", "date_format":"%Y-%m-%dT%H:%M:%S"},
-      "updatedAt": {"rename":"updated_at", "date_format":"%Y-%m-%dT%H:%M:%S"},
-      "url": "url",
-      "__v": "version"
+      "films": {"rename":"films", "list":"native", "type":"string"},
+      "shortFilms": {"rename":"short_films", "list":"native", "type":"string"},
+      "tvShows": {"rename":"tv_shows", "list":"native", "type":"string"},
+      "videoGames": {"rename":"video_games", "list":"native", "type":"string"},
+      "parkAttractions": {"rename":"park_attractions", "list":"native", "type":"string"},
+      "allies": {"rename":"allies", "list":"native", "type":"string"},
+      "enemies": {"rename":"enemies", "list":"native", "type":"string"},
+      "sourceUrl": {"rename":"source_url", "type":"string"},
+      "name": {"rename":"name", "batch_fn":sha256_hash}, # Encrypt the column 'name'
+      "imageUrl": {"rename":"image_url", "type":"string"},
+      "createdAt": {"rename":"created_at", "date_format":"%Y-%m-%dT%H:%M:%S.%fZ"},
+      "updatedAt": {"rename":"updated_at", "date_format":"%Y-%m-%dT%H:%M:%S.%fZ"},
+      "url": {"rename":"url", "type":"string"},
+      "__v": {"rename":"version", "type":"Int64"}
     }
 
-    def __init__(self):
-        self.disney_hook = DisneyApiHook()
-        self.s3_hook = S3Hook(self.bucket)
+    @cached_property
+    def s3_hook(self):
+        return S3Hook(self.bucket, etag_index_path = f"{self.dir_path}s3_etags/{self.bucket}.json",
+                      metrics = self.metrics)
+
+    @cached_property
+    def raw_s3_hook(self):
+        # the raw snapshot is read from the bucket where DisneyRaw loads it, through the same
+        # download cache, so a snapshot uploaded or downloaded on this machine is not downloaded again
+        return S3Hook(DisneyRaw.bucket, download_cache_dir = f"{self.dir_path}s3_cache/{DisneyRaw.bucket}/",
+                      metrics = self.metrics)
 
     def extract(self):
-        self.s3_hook.download_file(
-            'disney-api/characters/characters.json',
+        self.raw_s3_hook.download_file(
+            CHARACTERS_RAW_KEY,
             self.temp_file_path
         )
     
-    def _transform(self):
-        # Opening file from temporary dir
-        with open(self.temp_file_path, 'r', encoding='utf-8') as f:
-            temp_json = json.load(f)
+    def _transform(self, sink = None):
+        # Streaming records from the temporary file, only characters updated after the
+        # last loaded watermark are transformed
+        watermark = self.get_watermark()
+        characters = self.filter_incremental(read_records(self.temp_file_path), watermark)
 
-        for character in temp_json:
-            # Creating normalized DataFrame from JSON
-            df = self._normalize_json_data(character)
-            # Apply transformation by fields attribute
-            self.transform(df)
+        # (local file path, path relative to the dataset) of every written file
+        count, files = self._write_characters(characters, watermark, sink = sink)
+        self.log.info(f'{count} characters transformed into {len(files)} files')
 
-            # Parquet file named by "_id"
-            filename = f"{character['_id']}.parquet"
-            # Path to store temporary parquet before sending
-            filepath = f"{TMP_DIR}{self.dag_name}/{filename}"
-            self.files_to_send.append((filepath, filename))
+        return files
 
-            df.to_parquet(filepath)
+    def _upload_sink(self, uploader):
+        # Files of the dataset and of its bridge tables are uploaded to their own prefixes
+        def sink(relative_path, buffer, bridge = None):
+            prefix = CHARACTERS_BRIDGE_PREFIX.format(bridge) if bridge else CHARACTERS_CURATED_PREFIX
+            uploader.submit(buffer, prefix + relative_path)
 
-    def _normalize_json_data(data):
-        # Convert dictionary to DataFrame
-        df = pd.DataFrame.from_dict(data, orient='index').T
+        return sink
 
-        # Normalize DataFrame
-        for key,value in data.items():
-            if isinstance(value, list):
-                df = df.explode(str(key))
+    def _write_characters(self, characters, watermark, sink = None):
+        # Partitioned dataset written to the temporary dir, or passed to `sink` from memory
+        return self.write_dataset(characters, f"{self.run_dir}{self.dag_name}", sink = sink, watermark = watermark)
 
-        # Reset index
-        df_normalized = df.reset_index(drop=True, inplace=True)
+    def _merge_characters(self, characters, watermark, base_dir, snapshot_path = None):
+        # The raw file is a full snapshot of the API, so the characters missing from it were
+        # deleted from the source and are deleted from the curated dataset too
+        snapshot_keys = None
+        if snapshot_path:
+            source = self.plan.source_of(self.primary_key)
+            snapshot_keys = (record.get(source) for record in read_records(snapshot_path))
 
-        return df_normalized
+        count, summaries = self.merge_dataset(characters, base_dir, CHARACTERS_CURATED_PREFIX,
+                                              watermark = watermark, snapshot_keys = snapshot_keys)
+        self.log.info(f'{count} characters merged: {summaries}')
+
+        return count, summaries
 
     def load(self):
-        # Applying transformations and data partition
-        self._transform()
-        # Send parquet files to curated bucket in s3 with organized dir path
-        for file in self.files_to_send:
-            self.s3_hook.upload_file(
-                file[0], # Origin file path from tuple
-                'disney-api/characters/' + file[1] # Parquet file name from tuple plus prefix
-            )
+        if self.write_mode == 'merge':
+            watermark = self.get_watermark()
+            characters = self.filter_incremental(read_records(self.temp_file_path), watermark)
+            self._merge_characters(characters, watermark, f"{self.run_dir}{self.dag_name}",
+                                   snapshot_path = self.temp_file_path)
+            self.save_watermark(self.new_watermark)
+            return
+
+        # Applying transformations and data partition. Every Parquet file is uploaded from memory
+        # to the curated bucket, concurrently, as soon as it is written
+        with self.s3_hook.bulk_uploader() as uploader:
+            self._transform(sink = self._upload_sink(uploader))
+
+        self.save_watermark(self.new_watermark)
+
+    def plan_chunks(self):
+        # The raw snapshot is downloaded once to find the chunks, the workers download it again
+        self.extract()
+        try:
+            with open(self.temp_file_path, 'rb') as f:
+                etag = self.raw_s3_hook.content_etag(f)
+            chunks = self.plan_record_chunks(read_records(self.temp_file_path), self.get_watermark())
+
+            # deleted characters are merged once, before the chunks, which only replace characters
+            if self.write_mode == 'merge':
+                self._merge_characters([], None, f"{self.run_dir}{self.dag_name}_deletes",
+                                       snapshot_path = self.temp_file_path)
+        finally:
+            remove(self.temp_file_path)
+
+        if not chunks:
+            raise AirflowSkipException("No characters updated after the last loaded watermark.")
+
+        self.log.info(f"{len(chunks)} chunks of up to {self.chunk_size} characters planned")
+
+        # the etag pins the snapshot, so every chunk reads the same version of the raw file
+        return [{**chunk, 'etag': etag} for chunk in chunks]
+
+    def process_chunk(self, start, stop, watermark, upper, etag):
+        temp_file_path = f"{self.run_dir}{self.dag_name}_{start}-{stop}{self.temp_file_extn}"
+        self.raw_s3_hook.download_file(CHARACTERS_RAW_KEY, temp_file_path)
+
+        try:
+            with open(temp_file_path, 'rb') as f:
+                if self.raw_s3_hook.content_etag(f) != etag:
+                    raise AirflowException("The raw snapshot changed after the chunks were planned.")
+
+            characters = self.chunk_records(read_records(temp_file_path), start, stop, watermark, upper)
+
+            if self.write_mode == 'merge':
+                count, summaries = self._merge_characters(characters, watermark,
+                                                          f"{self.run_dir}{self.dag_name}_{start}-{stop}")
+                files = summaries['dataset']['written']
+            else:
+                with self.s3_hook.bulk_uploader() as uploader:
+                    count, files = self._write_characters(characters, watermark, sink = self._upload_sink(uploader))
+                files = len(files)
+        finally:
+            remove(temp_file_path)
+
+        self.log.info(f'Chunk [{start}, {stop}): {count} characters transformed into {files} files')
+
+        return {'characters': count, 'files': files, 'watermark': self.new_watermark}
+
+    def finalize_chunks(self, results):
+        results = list(results)
+
+        # the watermark only moves once every chunk was loaded
+        self.save_watermark(max((result['watermark'] for result in results if result['watermark']), default = None))
 
+        self.log.info(f"{sum(result['characters'] for result in results)} characters loaded "
+                      f"in {len(results)} chunks, {sum(result['files'] for result in results)} files written")
@@ -0,0 +1,30 @@
+import os, tempfile
+
+# offline Airflow settings, Variables and connections, set before anything imports Airflow
+os.environ.setdefault('AIRFLOW_HOME', tempfile.mkdtemp(prefix = 'airflow-home-'))
+os.environ.setdefault('AIRFLOW__CORE__LOAD_EXAMPLES', 'False')
+os.environ.setdefault('AIRFLOW_VAR_TMP_DIR', tempfile.mkdtemp(prefix = 'stage-') + os.sep)
+os.environ.setdefault('AIRFLOW_VAR_DAGS_CUSTOM_PARAMS', '{}')
+os.environ.setdefault('AIRFLOW_CONN_AWS_DEFAULT', 'aws://test:test@/?region_name=us-east-1')
+os.environ.setdefault('AIRFLOW_CONN_DISNEY_API', 'http://api.disneyapi.dev')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import pytest
+
+from moto import mock_aws
+
+BUCKET = 'test-bucket'
+
+@pytest.fixture
+def s3():
+    # S3 is replaced in-process by moto, also for the threads started by the tests
+    with mock_aws():
+        client = boto3.client('s3')
+        client.create_bucket(Bucket = BUCKET)
+        yield client
+
+@pytest.fixture
+def s3_hook(s3):
+    from hooks import S3Hook
+    return S3Hook(BUCKET)
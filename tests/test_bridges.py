@@ -0,0 +1,55 @@
+import io
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.modules.base.ndjson import write_records
+from src.modules.disney import CHARACTERS_BRIDGE_PREFIX, CHARACTERS_CURATED_PREFIX, DisneyCurated
+
+class BridgedCharacters(DisneyCurated):
+    # films are moved to a bridge table, the other lists stay native
+    fields = {**DisneyCurated.fields, 'films': {'rename': 'films', 'list': 'bridge', 'type': 'string'}}
+
+def character(character_id, films, allies):
+    return {'_id': character_id, 'name': f'character-{character_id}', 'updatedAt': '2024-01-01T00:00:00.000Z',
+            'films': films, 'allies': allies}
+
+RECORDS = [
+    character(1, ['Fantasia', 'Fun and Fancy Free'], ['Minnie']),
+    character(2, [], []),
+    character(3, ['Fantasia'], None)
+]
+
+def read_prefix(s3, prefix):
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket = DisneyCurated.bucket, Prefix = prefix).get('Contents', [])
+            if obj['Key'].endswith('.parquet') and '/_' not in obj['Key'][len(prefix) - 1:]]
+    tables = [pq.read_table(io.BytesIO(s3.get_object(Bucket = DisneyCurated.bucket, Key = key)['Body'].read()))
+              for key in keys]
+    return keys, pa.concat_tables(tables).sort_by('id')
+
+
+@pytest.mark.parametrize('write_mode', ['append', 'merge'])
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_bridge_tables_are_written_next_to_the_dataset(s3, tmp_path, write_mode, engine):
+    s3.create_bucket(Bucket = DisneyCurated.bucket)
+
+    module = BridgedCharacters()
+    module.dir_path = f'{tmp_path}/'
+    module.write_mode, module.engine = write_mode, engine
+    write_records(module.temp_file_path, RECORDS)
+    module.load()
+
+    _, characters = read_prefix(s3, CHARACTERS_CURATED_PREFIX)
+    keys, films = read_prefix(s3, CHARACTERS_BRIDGE_PREFIX.format('films'))
+
+    # one row per (character, film), partitioned like the dataset
+    assert 'films' not in characters.column_names
+    assert films.select(['id', 'films']).to_pylist() == [
+        {'id': 1, 'films': 'Fantasia'}, {'id': 1, 'films': 'Fun and Fancy Free'}, {'id': 3, 'films': 'Fantasia'}
+    ]
+    assert 'updated_at' in films.column_names
+    assert all(key.startswith(f"{CHARACTERS_BRIDGE_PREFIX.format('films')}updated_month=2024-01/") for key in keys)
+
+    # native lists are kept in the dataset, one row per character, empty and null lists included
+    assert characters.schema.field('allies').type == pa.list_(pa.string())
+    assert characters.column('allies').to_pylist() == [['Minnie'], [], None]
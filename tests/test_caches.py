@@ -0,0 +1,87 @@
+import os
+import multiprocessing
+
+from hooks import S3Hook
+from hooks.download_cache import DownloadCache
+from hooks.json_index import JSONIndex
+
+def set_keys(path, worker):
+    index = JSONIndex(path)
+    for n in range(50):
+        with index.update() as content:
+            content[f'{worker}-{n}'] = n
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def test_json_index_keeps_the_updates_of_concurrent_processes(tmp_path):
+    path = str(tmp_path / 'index.json')
+
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target = set_keys, args = (path, worker)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    assert len(JSONIndex(path).read()) == 200
+
+
+def test_download_cache_only_serves_the_cached_version(tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'))
+    first = cache.put('a.txt', 'e1', write(str(tmp_path / 'a1'), b'v1'))
+
+    with open(cache.get('a.txt', 'e1'), 'rb') as f:
+        assert f.read() == b'v1'
+    assert cache.get('a.txt', 'e2') is None
+
+    # a new version replaces the copy of the previous one
+    cache.put('a.txt', 'e2', write(str(tmp_path / 'a2'), b'v2'))
+    assert cache.get('a.txt', 'e1') is None
+    assert cache.get('a.txt', 'e2') is not None
+    assert not os.path.exists(first)
+
+    cache.discard(['a.txt'])
+    assert cache.get('a.txt', 'e2') is None
+
+
+def test_download_cache_evicts_the_least_recently_used_copies(tmp_path):
+    cache = DownloadCache(str(tmp_path / 'cache'), max_bytes = 10)
+    cache.put('a.txt', 'e', write(str(tmp_path / 'a'), b'a' * 4))
+    cache.put('b.txt', 'e', write(str(tmp_path / 'b'), b'b' * 4))
+    # `a.txt` is used after `b.txt`, so `b.txt` is evicted first
+    cache.get('a.txt', 'e')
+    cache.put('c.txt', 'e', write(str(tmp_path / 'c'), b'c' * 4))
+
+    assert cache.get('b.txt', 'e') is None
+    assert cache.get('a.txt', 'e') is not None and cache.get('c.txt', 'e') is not None
+
+    # shared with the other processes of the machine
+    assert DownloadCache(str(tmp_path / 'cache')).get('a.txt', 'e') is not None
+
+
+def test_download_file_skips_the_get_of_cached_versions(s3, tmp_path, monkeypatch):
+    hook = S3Hook('test-bucket', download_cache_dir = str(tmp_path / 'cache'))
+    s3.put_object(Bucket = 'test-bucket', Key = 'a.txt', Body = b'v1')
+
+    downloads = []
+    download = S3Hook._download
+    monkeypatch.setattr(S3Hook, '_download', lambda self, *args: downloads.append(args) or download(self, *args))
+
+    def read(name):
+        hook.download_file('a.txt', str(tmp_path / name))
+        with open(tmp_path / name, 'rb') as f:
+            return f.read()
+
+    assert read('first') == b'v1'
+    assert read('second') == b'v1'
+    assert len(downloads) == 1
+
+    # replaced out of band: the HEAD finds another ETag
+    s3.put_object(Bucket = 'test-bucket', Key = 'a.txt', Body = b'v2')
+    assert read('third') == b'v2'
+    assert len(downloads) == 2
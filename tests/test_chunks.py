@@ -0,0 +1,107 @@
+import pytest
+
+from airflow.exceptions import AirflowException
+from src.modules.base.module import BaseModule
+from src.modules.base.ndjson import write_records
+from src.modules.disney import CHARACTERS_RAW_KEY, DisneyCurated, DisneyRaw
+
+class Incremental(BaseModule):
+    dag_name = 'incremental_dag'
+    incremental_field = 'updatedAt'
+
+class Snapshot(BaseModule):
+    dag_name = 'snapshot_dag'
+
+def character(character_id, day):
+    return {'_id': character_id, 'name': f'character-{character_id}', 'updatedAt': at(day)}
+
+def at(day):
+    return f'2024-01-0{day}T00:00:00.000Z'
+
+# positions 1 and 4 are not after the watermark of day 2
+RECORDS = [
+    character(0, 5),
+    character(1, 1),
+    character(2, 3),
+    character(3, 4),
+    character(4, 2),
+    character(5, 6)
+]
+
+def chunk_ids(module, chunks):
+    return [[record['_id'] for record in module.chunk_records(RECORDS, **chunk)] for chunk in chunks]
+
+
+def test_chunks_only_hold_the_records_after_the_watermark():
+    module = Incremental()
+    module.chunk_size = 2
+
+    chunks = module.plan_record_chunks(RECORDS, at(2))
+
+    assert chunks == [
+        {'start': 0, 'stop': 3, 'watermark': at(2), 'upper': None},
+        {'start': 3, 'stop': 6, 'watermark': at(2), 'upper': None}
+    ]
+    # the records of the window, never the ones at or before the watermark
+    assert chunk_ids(module, chunks) == [[0, 2], [3, 5]]
+
+
+def test_the_limit_selects_the_oldest_records():
+    module = Incremental()
+    module.limit, module.chunk_size = 3, 2
+
+    chunks = module.plan_record_chunks(RECORDS, at(2))
+
+    # the newer records are left for the next runs: the window closes at the last selected one
+    assert {chunk['upper'] for chunk in chunks} == {at(5)}
+    assert chunk_ids(module, chunks) == [[0, 2], [3]]
+
+
+def test_in_window_bounds():
+    module = Incremental()
+
+    assert not module.in_window(character(1, 2), watermark = at(2))
+    assert module.in_window(character(1, 3), watermark = at(2), upper = at(3))
+    assert not module.in_window(character(1, 4), watermark = at(2), upper = at(3))
+    # records without the field are only loaded without a watermark
+    assert module.in_window({'_id': 1})
+    assert not module.in_window({'_id': 1}, watermark = at(2))
+    # modules without an incremental field load every record
+    assert Snapshot().in_window(character(1, 1), watermark = at(2))
+
+
+def test_chunks_of_modules_without_an_incremental_field():
+    module = Snapshot()
+    module.limit, module.chunk_size = 5, 2
+
+    chunks = module.plan_record_chunks(RECORDS, at(2))
+
+    assert [(chunk['start'], chunk['stop']) for chunk in chunks] == [(0, 2), (2, 4), (4, 5)]
+    assert chunk_ids(module, chunks) == [[0, 1], [2, 3], [4]]
+    assert module.plan_record_chunks([]) == []
+
+
+def test_chunks_only_process_the_planned_snapshot(s3, tmp_path):
+    s3.create_bucket(Bucket = DisneyRaw.bucket)
+    s3.create_bucket(Bucket = DisneyCurated.bucket)
+
+    def upload(records):
+        write_records(str(tmp_path / 'raw.jsonl.gz'), records)
+        s3.upload_file(str(tmp_path / 'raw.jsonl.gz'), DisneyRaw.bucket, CHARACTERS_RAW_KEY)
+
+    def curated():
+        module = DisneyCurated()
+        module.dir_path = f'{tmp_path}/'
+        module.chunk_size = 4
+        return module
+
+    upload(RECORDS)
+    chunks = curated().plan_chunks()
+    assert len(chunks) == 2 and len({chunk['etag'] for chunk in chunks}) == 1
+
+    assert curated().process_chunk(**chunks[0])['characters'] == 4
+
+    # a new snapshot is uploaded before the second chunk runs: its positions no longer match
+    upload(RECORDS[::-1])
+    with pytest.raises(AirflowException, match = 'changed after the chunks were planned'):
+        curated().process_chunk(**chunks[1])
@@ -0,0 +1,98 @@
+import pytest
+
+from src.modules.base.compaction import ParquetCompactor
+from src.modules.base.manifest import DatasetManifest
+from src.modules.base.merge import KeyIndex
+from tests.test_merge import PREFIX, merge, read_rows, live_objects
+
+def compactor(s3_hook, tmp_path):
+    return ParquetCompactor(s3_hook, PREFIX, str(tmp_path / 'compaction'), small_file_size = 1024 ** 2)
+
+@pytest.fixture
+def merged(s3_hook, tmp_path):
+    # three small objects in the same partition, merged by primary key
+    for n in range(3):
+        merge(s3_hook, tmp_path, f'part-{n}', list(range(n * 10, (n + 1) * 10)))
+
+def merge_during_publish(monkeypatch, s3_hook, tmp_path, ids, name):
+    # runs a merge right after the compaction read the manifest it is about to replace
+    live_files = ParquetCompactor._live_files
+    calls = []
+
+    def _live_files(self):
+        result = live_files(self)
+        calls.append(1)
+        if len(calls) == 2:
+            merge(s3_hook, tmp_path, 'concurrent', ids, name = name)
+        return result
+
+    monkeypatch.setattr(ParquetCompactor, '_live_files', _live_files)
+
+
+def test_compaction_remaps_the_key_index(s3, s3_hook, tmp_path, merged):
+    summary = compactor(s3_hook, tmp_path).run()
+
+    assert summary['compacted'] == 3 and summary['written'] == 1
+    assert sorted(read_rows(s3_hook)) == list(range(30))
+
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert live_objects(s3) == sorted(manifest.files)
+    assert len(manifest.files) == 1
+
+    index = KeyIndex.load(s3_hook, manifest.key_index, str(tmp_path / 'index.parquet'))
+    assert set(index.table.column('file').to_pylist()) == set(manifest.files)
+    assert sorted(index.keys().to_pylist()) == list(range(30))
+
+
+def test_compaction_publishes_again_after_a_concurrent_merge(s3, s3_hook, tmp_path, merged, monkeypatch):
+    # the concurrent merge only adds keys, the compacted objects are still live
+    merge_during_publish(monkeypatch, s3_hook, tmp_path, list(range(100, 105)), 'v1')
+
+    summary = compactor(s3_hook, tmp_path).run()
+
+    assert summary['compacted'] == 3 and not summary['discarded']
+    assert sorted(read_rows(s3_hook)) == list(range(30)) + list(range(100, 105))
+
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert manifest.version == 5
+    assert live_objects(s3) == sorted(manifest.files)
+
+    index = KeyIndex.load(s3_hook, manifest.key_index, str(tmp_path / 'index.parquet'))
+    assert set(index.table.column('file').to_pylist()) == set(manifest.files)
+    assert sorted(index.keys().to_pylist()) == list(range(30)) + list(range(100, 105))
+
+
+def test_compaction_is_discarded_when_a_merge_replaced_its_objects(s3, s3_hook, tmp_path, merged, monkeypatch):
+    # the concurrent merge replaces keys of a compacted object
+    merge_during_publish(monkeypatch, s3_hook, tmp_path, [0, 1], 'v2')
+
+    summary = compactor(s3_hook, tmp_path).run()
+
+    assert summary['discarded']
+    rows = read_rows(s3_hook)
+    assert sorted(rows) == list(range(30))
+    assert rows[0] == 'v2-0' and rows[1] == 'v2-1'
+
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert manifest.version == 4
+    assert live_objects(s3) == sorted(manifest.files)
+
+
+def test_compaction_is_discarded_when_a_source_was_deleted(s3, s3_hook, tmp_path, merged, monkeypatch):
+    compact = ParquetCompactor._compact
+    calls = []
+
+    def _compact(self, bin_files):
+        calls.append(1)
+        if len(calls) == 1:
+            # a merge replaces (and deletes) an object before the compaction reads it
+            merge(s3_hook, tmp_path, 'concurrent', [0], name = 'v2')
+        return compact(self, bin_files)
+
+    monkeypatch.setattr(ParquetCompactor, '_compact', _compact)
+    summary = compactor(s3_hook, tmp_path).run()
+
+    assert summary['discarded']
+    rows = read_rows(s3_hook)
+    assert sorted(rows) == list(range(30)) and rows[0] == 'v2-0'
+    assert live_objects(s3) == sorted(DatasetManifest.load(s3_hook, PREFIX).files)
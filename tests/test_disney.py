@@ -0,0 +1,70 @@
+import pytest
+import responses
+
+from airflow.exceptions import AirflowSkipException
+from src.modules.disney import CHARACTERS_RAW_KEY, DisneyRaw
+
+URL = 'http://api.disneyapi.dev/character'
+
+def page(*ids, updated_at = '2024-01-01T00:00:00.000Z'):
+    return {'info': {'totalPages': 1}, 'data': [{'_id': i, 'name': f'character-{i}', 'updatedAt': updated_at} for i in ids]}
+
+@pytest.fixture
+def raw(s3, tmp_path):
+    s3.create_bucket(Bucket = DisneyRaw.bucket)
+
+    def run():
+        # every task builds its own module, sharing the stage area of the DAG
+        module = DisneyRaw()
+        module.dir_path = f'{tmp_path}/'
+        return module
+
+    return run
+
+def run_dag(raw):
+    raw().extract()
+    raw().load()
+    raw().delete_temp_file()
+
+
+@responses.activate
+def test_responses_are_committed_after_the_load(s3, raw):
+    responses.get(URL, json = page(1, 2), headers = {'ETag': '"v1"'})
+    responses.get(URL, json = page(1, 2), headers = {'ETag': '"v1"'})
+    responses.get(URL, status = 304)
+
+    # the load never runs after the extract requested the API, i.g. its worker was killed
+    raw().extract()
+    raw().delete_temp_file()
+
+    # so the next run requests the whole snapshot again, and publishes it
+    run_dag(raw)
+    assert 'If-None-Match' not in responses.calls[1].request.headers
+    assert s3.head_object(Bucket = DisneyRaw.bucket, Key = CHARACTERS_RAW_KEY)
+
+    # only then the validators are sent
+    with pytest.raises(AirflowSkipException):
+        raw().extract()
+    assert responses.calls[2].request.headers['If-None-Match'] == '"v1"'
+
+
+@responses.activate
+def test_snapshots_without_updated_characters_are_published(s3, raw):
+    responses.get(URL, json = page(1, 2), headers = {'ETag': '"v1"'})
+    # a character was deleted, the others were not updated
+    responses.get(URL, json = page(1), headers = {'ETag': '"v2"'})
+    # the same characters are sent again with a new ETag
+    responses.get(URL, json = page(1), headers = {'ETag': '"v3"'})
+
+    run_dag(raw)
+    first = s3.head_object(Bucket = DisneyRaw.bucket, Key = CHARACTERS_RAW_KEY)['ETag']
+
+    run_dag(raw)
+    second = s3.head_object(Bucket = DisneyRaw.bucket, Key = CHARACTERS_RAW_KEY)['ETag']
+    assert second != first
+
+    # snapshots with the same content are not uploaded again
+    raw().extract()
+    with pytest.raises(AirflowSkipException, match = 'unchanged'):
+        raw().load()
+    assert s3.head_object(Bucket = DisneyRaw.bucket, Key = CHARACTERS_RAW_KEY)['ETag'] == second
@@ -0,0 +1,75 @@
+import pytest
+import responses
+
+from airflow.exceptions import AirflowException
+from hooks import DisneyApiHook
+
+URL = 'http://api.disneyapi.dev/character'
+
+def page(*ids):
+    return {'info': {'totalPages': 1}, 'data': [{'_id': i, 'name': f'character-{i}'} for i in ids]}
+
+
+@responses.activate
+def test_not_modified_responses_are_served_from_the_cache(tmp_path):
+    responses.get(URL, json = page(1, 2), headers = {'ETag': '"v1"'})
+    responses.get(URL, status = 304)
+
+    hook = DisneyApiHook(cache_dir = str(tmp_path / 'cache'))
+    assert hook.get_characters(only_if_modified = True) == page(1, 2)['data']
+
+    # the second request is conditional, and its 304 is answered from disk
+    assert hook.get_characters(only_if_modified = True) is None
+    assert hook.get_characters() == page(1, 2)['data']
+    assert responses.calls[1].request.headers['If-None-Match'] == '"v1"'
+
+
+@responses.activate
+def test_evicted_bodies_are_requested_again(tmp_path):
+    responses.get(URL, json = page(1), headers = {'ETag': '"v1"'})
+    responses.get(URL, status = 304)
+    responses.get(URL, json = page(1, 2), headers = {'ETag': '"v2"'})
+
+    hook = DisneyApiHook(cache_dir = str(tmp_path / 'cache'))
+    hook.get_characters()
+
+    # the body is evicted after its validators were sent
+    get = hook.cache.get
+    hook.cache.get = lambda key: None
+    assert hook.get_characters() == page(1, 2)['data']
+    hook.cache.get = get
+
+    assert 'If-None-Match' not in responses.calls[2].request.headers
+
+
+@responses.activate
+def test_not_modified_without_a_cache_is_an_error():
+    responses.get(URL, status = 304)
+
+    hook = DisneyApiHook()
+    assert hook.cache is None
+
+    with pytest.raises(AirflowException, match = '304'):
+        hook.get_characters()
+    assert 'If-None-Match' not in responses.calls[0].request.headers
+
+
+@responses.activate
+def test_staged_responses_are_only_served_after_commit(tmp_path):
+    responses.get(URL, json = page(1), headers = {'ETag': '"v1"'})
+    responses.get(URL, json = page(1), headers = {'ETag': '"v1"'})
+    responses.get(URL, status = 304)
+
+    def run_hook(run_id):
+        return DisneyApiHook(cache_dir = str(tmp_path / 'cache'), cache_staging_dir = str(tmp_path / run_id))
+
+    # the first run fails before committing, so the next run requests the API unconditionally
+    assert run_hook('run-1').get_characters(only_if_modified = True) == page(1)['data']
+
+    hook = run_hook('run-2')
+    assert hook.get_characters(only_if_modified = True) == page(1)['data']
+    assert 'If-None-Match' not in responses.calls[1].request.headers
+    assert hook.commit_cache() == 1
+
+    assert run_hook('run-3').get_characters(only_if_modified = True) is None
+    assert responses.calls[2].request.headers['If-None-Match'] == '"v1"'
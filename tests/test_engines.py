@@ -0,0 +1,37 @@
+import glob
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from src.modules.disney import DisneyCurated
+
+def character(character_id, **fields):
+    return {'_id': character_id, 'name': f'character-{character_id}', 'updatedAt': '2024-01-01T00:00:00.000Z', **fields}
+
+def write(records, base_dir, engine):
+    module = DisneyCurated()
+    module.engine = engine
+    module.dir_path = f'{base_dir}/'
+    module.write_dataset(records, str(base_dir / engine))
+
+    files = sorted(glob.glob(f'{base_dir}/{engine}/**/*.parquet', recursive = True))
+    return pa.concat_tables(pq.read_table(path).replace_schema_metadata() for path in files).sort_by('id')
+
+
+@pytest.mark.parametrize('records', [
+    # the keys of the first record are not the keys of the batch
+    [character(1), character(2, films = ['a', 'b'], sourceUrl = 'url-2')],
+    # no record has a list or a string column
+    [character(1), character(2)],
+])
+def test_both_engines_write_the_same_dataset(tmp_path, records):
+    pandas_table = write(records, tmp_path, 'pandas')
+    arrow_table = write(records, tmp_path, 'arrow')
+
+    assert pandas_table.schema == arrow_table.schema
+    assert pandas_table.to_pylist() == arrow_table.to_pylist()
+
+    # missing columns keep the type of their recipe
+    assert pandas_table.schema.field('films').type == pa.list_(pa.string())
+    assert pandas_table.schema.field('source_url').type == pa.large_string()
+    assert arrow_table.column('films').to_pylist()[-1] == (['a', 'b'] if 'films' in records[-1] else None)
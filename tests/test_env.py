@@ -0,0 +1,32 @@
+import pytest
+
+from airflow.secrets.metastore import MetastoreBackend
+from src.config import env
+
+@pytest.fixture
+def metastore(monkeypatch):
+    calls = []
+    def get_variable(self, key):
+        calls.append(key)
+        return None
+
+    monkeypatch.setattr(MetastoreBackend, 'get_variable', get_variable)
+    return calls
+
+
+def test_environment_variables_are_read_without_the_database(monkeypatch, metastore):
+    monkeypatch.setenv('AIRFLOW_VAR_TMP_DIR', '/stage/')
+    monkeypatch.setenv('AIRFLOW_VAR_DAGS_CUSTOM_PARAMS', '{"disney_api_raw_dag": {"limit": 10}}')
+
+    assert env.get_tmp_dir() == '/stage/'
+    assert env.get_dags_custom_params() == {'disney_api_raw_dag': {'limit': 10}}
+    assert metastore == []
+
+
+def test_missing_variables(monkeypatch, metastore):
+    monkeypatch.delenv('AIRFLOW_VAR_DAGS_CUSTOM_PARAMS', raising = False)
+    assert env.get_dags_custom_params() == {}
+
+    with pytest.raises(KeyError, match = 'API_TOKEN'):
+        env.get_variable('API_TOKEN')
+    assert metastore == ['DAGS_CUSTOM_PARAMS', 'API_TOKEN']
@@ -0,0 +1,51 @@
+import pandas as pd
+import pyarrow as pa
+
+from src.modules.base.functions import map_unique, memoize, sha256_hash
+from src.modules.base.plan import TransformPlan
+
+def describe(value):
+    return f'{type(value).__name__}:{value}'
+
+
+def test_memoize_caches_values_by_type():
+    calls = []
+    fn = memoize(lambda value: calls.append(value) or describe(value))
+
+    assert [fn(value) for value in (1, 1.0, True, 1)] == ['int:1', 'float:1.0', 'bool:True', 'int:1']
+    assert calls == [1, 1.0, True]
+    assert fn.cache_info().hits == 1
+
+    # unhashable values bypass the cache
+    assert fn(['a']) == "list:['a']" and fn(['a']) == "list:['a']"
+    assert fn.cache_info().currsize == 3
+
+
+def test_map_unique_calls_fn_once_per_distinct_value():
+    calls = []
+    batch_fn = map_unique(lambda value: calls.append(value) or describe(value))
+
+    series = pd.Series([1, True, 1.0, None, 1, 'a'], index = [5, 4, 3, 2, 1, 0], dtype = object)
+    result = batch_fn(series)
+
+    assert result.index.tolist() == [5, 4, 3, 2, 1, 0]
+    assert result.drop(2).tolist() == ['int:1', 'bool:True', 'float:1.0', 'int:1', 'str:a']
+    assert pd.isna(result[2])
+    assert calls == [1, True, 1.0, 'a']
+
+    calls.clear()
+    assert batch_fn.arrow(pa.array(['a', None, 'b', 'a'])).to_pylist() == ['str:a', None, 'str:b', 'str:a']
+    assert calls == ['a', 'b']
+
+
+def test_batch_fn_gives_the_same_values_with_both_engines():
+    plan = TransformPlan.compile({'name': {'rename': 'hashed_name', 'batch_fn': sha256_hash}})
+    names = ['Mickey', None, 'Minnie', 'Mickey']
+
+    df, _ = plan.apply(pd.DataFrame({'name': names}))
+    table, _ = plan.apply_arrow(pa.table({'name': names}))
+
+    hashed = table.column('hashed_name').to_pylist()
+    assert hashed[0] == hashed[3] != hashed[2] and hashed[1] is None
+    assert len(hashed[0]) == 64
+    assert [None if pd.isna(value) else value for value in df['hashed_name']] == hashed
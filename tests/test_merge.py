@@ -0,0 +1,150 @@
+import time
+import pytest
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hooks import S3Hook
+from src.modules.base.manifest import DatasetManifest
+from airflow.exceptions import AirflowException
+from src.modules.base import merge as merge_module
+from src.modules.base.merge import KeyIndex, ParquetMerger
+from src.modules.base.reader import DatasetReader
+
+PREFIX = 'dataset/characters/'
+
+def write_file(path, ids, name = 'v1'):
+    pq.write_table(pa.table({'id': pa.array(ids, pa.int64()), 'name': [f'{name}-{i}' for i in ids]}), path)
+    return path
+
+def merge(s3_hook, tmp_path, label, ids, name = 'v1', snapshot_keys = None):
+    file_path = write_file(str(tmp_path / f'{label}.parquet'), ids, name)
+    merger = ParquetMerger(s3_hook, PREFIX, str(tmp_path / f'work-{label}'), key = 'id')
+    return merger.run([(file_path, f'part-{label}.parquet')], pa.array(ids, pa.int64()), snapshot_keys = snapshot_keys)
+
+def read_rows(s3_hook):
+    table = DatasetReader(s3_hook, PREFIX).read()
+    return dict(zip(table.column('id').to_pylist(), table.column('name').to_pylist()))
+
+def live_objects(s3):
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket = 'test-bucket', Prefix = PREFIX).get('Contents', [])]
+    return sorted(key for key in keys if not key.startswith(f'{PREFIX}_'))
+
+
+def test_manifest_save_is_a_compare_and_swap(s3_hook):
+    first = DatasetManifest.load(s3_hook, PREFIX)
+    second = DatasetManifest.load(s3_hook, PREFIX)
+
+    first.add([{'key': f'{PREFIX}a.parquet', 'size': 1}])
+    second.add([{'key': f'{PREFIX}b.parquet', 'size': 1}])
+
+    assert first.save()
+    # both were loaded before the manifest existed: the second writer must not overwrite the first
+    assert not second.save()
+
+    second = DatasetManifest.load(s3_hook, PREFIX)
+    second.add([{'key': f'{PREFIX}b.parquet', 'size': 1}])
+    assert second.save()
+
+    # a stale copy of version 1 can't replace version 2 either
+    assert not first.save()
+
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert manifest.version == 2
+    assert sorted(manifest.files) == [f'{PREFIX}a.parquet', f'{PREFIX}b.parquet']
+
+
+def test_merge_replaces_and_deletes_keys(s3, s3_hook, tmp_path):
+    merge(s3_hook, tmp_path, 'first', list(range(10)))
+    # ids 0 and 1 are updated, id 9 is missing from the snapshot of the source
+    summary = merge(s3_hook, tmp_path, 'second', [0, 1], name = 'v2', snapshot_keys = pa.array(range(9), pa.int64()))
+
+    rows = read_rows(s3_hook)
+    assert sorted(rows) == list(range(9))
+    assert rows[0] == 'v2-0' and rows[1] == 'v2-1' and rows[2] == 'v1-2'
+    assert summary['deleted_keys'] == 1
+
+    # the replaced object was deleted, and the key index points to the live objects only
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert live_objects(s3) == sorted(manifest.files)
+
+    index = KeyIndex.load(s3_hook, manifest.key_index, str(tmp_path / 'index.parquet'))
+    assert sorted(index.keys().to_pylist()) == list(range(9))
+    assert set(index.table.column('file').to_pylist()) == set(manifest.files)
+
+
+def test_concurrent_merges_publish_every_chunk(s3, s3_hook, tmp_path, monkeypatch):
+    # a published dataset, with its manifest and key index
+    merge(s3_hook, tmp_path, 'seed', list(range(100, 110)))
+
+    put_object_if = S3Hook.put_object_if
+
+    def slow_put_object_if(self, *args, **kwargs):
+        # every writer loads the same manifest version before any of them publishes
+        time.sleep(0.3)
+        return put_object_if(self, *args, **kwargs)
+
+    monkeypatch.setattr(S3Hook, 'put_object_if', slow_put_object_if)
+
+    errors = []
+    def run_chunk(n):
+        try:
+            merge(S3Hook('test-bucket'), tmp_path, f'chunk-{n}', list(range(n * 20, (n + 1) * 20)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target = run_chunk, args = (n,)) for n in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sorted(read_rows(s3_hook)) == list(range(60)) + list(range(100, 110))
+
+    manifest = DatasetManifest.load(s3_hook, PREFIX)
+    assert manifest.version == 4
+    assert live_objects(s3) == sorted(manifest.files)
+
+    index = KeyIndex.load(s3_hook, manifest.key_index, str(tmp_path / 'index.parquet'))
+    assert sorted(index.keys().to_pylist()) == list(range(60)) + list(range(100, 110))
+    # only the index of the published manifest is left
+    index_objects = s3.list_objects_v2(Bucket = 'test-bucket', Prefix = f'{PREFIX}{KeyIndex.index_dir}')['Contents']
+    assert [obj['Key'] for obj in index_objects] == [manifest.key_index]
+
+
+def test_merge_starts_again_when_a_replaced_object_was_deleted(s3, s3_hook, tmp_path, monkeypatch):
+    merge(s3_hook, tmp_path, 'seed', list(range(10)))
+
+    rewrite = ParquetMerger._rewrite
+    calls = []
+
+    def _rewrite(self, *args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            # another merge replaces (and deletes) the object before this one reads it
+            merge(S3Hook('test-bucket'), tmp_path, 'concurrent', [0], name = 'v2')
+        return rewrite(self, *args, **kwargs)
+
+    monkeypatch.setattr(ParquetMerger, '_rewrite', _rewrite)
+    merge(s3_hook, tmp_path, 'late', [1], name = 'v3')
+
+    rows = read_rows(s3_hook)
+    assert sorted(rows) == list(range(10))
+    assert rows[0] == 'v2-0' and rows[1] == 'v3-1'
+    assert live_objects(s3) == sorted(DatasetManifest.load(s3_hook, PREFIX).files)
+
+
+def test_merges_that_keep_losing_the_race_back_off(s3, s3_hook, tmp_path, monkeypatch):
+    delays = []
+    monkeypatch.setattr(merge_module.time, 'sleep', delays.append)
+    # every publication finds a newer manifest
+    monkeypatch.setattr(ParquetMerger, '_publish', lambda self, *args: None)
+
+    with pytest.raises(AirflowException, match = 'kept changing'):
+        merge(s3_hook, tmp_path, 'late', [1])
+
+    # no delay after the last attempt, each one drawn below a doubled ceiling
+    assert len(delays) == 7
+    assert all(0 <= delay <= min(30, 0.5 * 2 ** n) for n, delay in enumerate(delays))
+    assert live_objects(s3) == []
@@ -0,0 +1,40 @@
+from src.modules.base import metrics as run_metrics
+from src.modules.base.metrics import RunMetrics
+
+def test_stages_report_their_growth_of_the_peak_rss(monkeypatch):
+    # the peak RSS of the process, read at the start and at the end of every stage
+    peaks = iter([100, 150, 150, 150, 150, 180])
+    monkeypatch.setattr(run_metrics, 'peak_rss_bytes', lambda: next(peaks))
+
+    metrics = RunMetrics('dags.test')
+    with metrics.stage('extract'):
+        pass
+    # a stage under the peak of the previous one doesn't raise it
+    with metrics.stage('load'):
+        pass
+    with metrics.stage('extract'):
+        pass
+
+    stages = metrics.summary()['stages']
+    assert stages['extract']['peak_rss_growth_bytes'] == 80
+    assert stages['extract']['process_peak_rss_bytes'] == 180
+    assert stages['load']['peak_rss_growth_bytes'] == 0
+    assert stages['load']['process_peak_rss_bytes'] == 150
+
+
+def test_nested_stages_report_their_self_time(monkeypatch):
+    # load: 0 -> 10, with two nested transforms: 2 -> 5 and 6 -> 7
+    clock = iter([0, 2, 5, 6, 7, 10])
+    monkeypatch.setattr(run_metrics.time, 'perf_counter', lambda: next(clock))
+    monkeypatch.setattr(run_metrics, 'peak_rss_bytes', lambda: 0)
+
+    metrics = RunMetrics('dags.test')
+    with metrics.stage('load'):
+        with metrics.stage('transform'):
+            pass
+        with metrics.stage('transform'):
+            pass
+
+    stages = metrics.summary()['stages']
+    assert (stages['load']['seconds'], stages['load']['self_seconds']) == (10, 6)
+    assert (stages['transform']['seconds'], stages['transform']['self_seconds']) == (4, 4)
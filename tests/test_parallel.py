@@ -0,0 +1,49 @@
+import glob
+import pytest
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from benchmarks.synthetic import make_characters
+from src.modules.base.module import BaseModule
+from src.modules.disney import DisneyCurated
+
+def check_name(value):
+    if value == 'Character 7':
+        raise ValueError(f'Invalid name {value}')
+    return value
+
+class FailingCharacters(BaseModule):
+    # workers import the module class by reference, so it must live at the top of a module
+    dag_name = 'failing_dag'
+    fields = {'_id': 'id', 'name': {'fn': check_name}}
+
+def write(module, records, base_dir, workers):
+    module.dir_path = f'{base_dir}/'
+    module.transform_workers, module.transform_group_size, module.batch_size = workers, 40, 15
+
+    count, files = module.write_dataset(records, str(base_dir / f'workers-{workers}'))
+    return count, files
+
+def read(files):
+    return pa.concat_tables(pq.read_table(path).replace_schema_metadata() for path, _ in files).sort_by('id')
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_workers_write_the_same_rows(tmp_path, engine):
+    records = make_characters(200)
+    module = DisneyCurated()
+    module.engine = engine
+
+    count, files = write(module, records, tmp_path, 1)
+    parallel_count, parallel_files = write(module, records, tmp_path, 2)
+
+    assert count == parallel_count == 200
+    assert read(files).equals(read(parallel_files))
+    # files of the groups are named after their position, so no two groups share a file
+    assert len({path for _, path in parallel_files}) == len(parallel_files)
+    assert len(glob.glob(f'{tmp_path}/workers-2/**/*.parquet', recursive = True)) == len(parallel_files)
+
+
+def test_errors_of_the_workers_reach_the_caller(tmp_path):
+    with pytest.raises(ValueError, match = 'Invalid name Character 7'):
+        write(FailingCharacters(), make_characters(100), tmp_path, 2)
@@ -0,0 +1,104 @@
+import pytest
+import pandas as pd
+import pyarrow as pa
+
+from datetime import datetime
+from src.modules.base.functions import sha256_hash
+from src.modules.base.module import BaseModule
+from src.modules.base.plan import TransformPlan
+
+class Characters(BaseModule):
+    dag_name = 'characters_dag'
+    primary_key = 'id'
+    fields = {
+        '_id': {'rename': 'id', 'type': 'int64'},
+        'name': 'character_name',
+        'secret': {'batch_fn': sha256_hash},
+        'status': {'replace': {'a': 'active', 'i': 'inactive'}, 'fillna': 'unknown'},
+        'score': {'fn': lambda value: value * 10, 'cache': True},
+        'updatedAt': {'rename': 'updated_at', 'date_format': '%Y-%m-%dT%H:%M:%S.%fZ'},
+        'films': {'list': 'native', 'type': 'string'},
+        'allies': {'list': 'explode'},
+        'enemies': {'list': 'bridge'}
+    }
+
+RECORDS = [
+    {'_id': '1', 'name': 'Mickey', 'secret': 's', 'status': 'a', 'score': 1, 'updatedAt': '2024-01-01T10:00:00.000Z',
+     'films': ['f1', 'f2'], 'allies': ['a1', 'a2'], 'enemies': ['e1']},
+    {'_id': '2', 'name': 'Pete', 'secret': 's', 'status': None, 'score': 2, 'updatedAt': '2024-02-01T10:00:00.000Z',
+     'films': [], 'allies': [], 'enemies': []}
+]
+
+def transform(records, engine):
+    module = Characters()
+    if engine == 'arrow':
+        return module.transform_table(Characters.normalize_records_arrow(records)).to_pylist()
+
+    return pa.Table.from_pandas(module.transform(Characters.normalize_records(records)), preserve_index = False).to_pylist()
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_every_field_mode(engine):
+    rows = transform(RECORDS, engine)
+
+    # the exploded list multiplies the rows of its record, an empty list keeps a single null row
+    assert [(row['id'], row['allies']) for row in rows] == [(1, 'a1'), (1, 'a2'), (2, None)]
+
+    first, last = rows[0], rows[-1]
+    assert list(first) == ['id', 'character_name', 'secret', 'status', 'score', 'updated_at', 'films', 'allies', 'enemies']
+    assert first['character_name'] == 'Mickey'
+    assert first['secret'] == last['secret'] == sha256_hash(pd.Series(['s']))[0]
+    assert (first['status'], last['status']) == ('active', 'unknown')
+    assert (first['score'], last['score']) == (10, 20)
+    assert first['updated_at'] == datetime(2024, 1, 1, 10)
+    # native and bridge lists are kept as lists until the bridges are split
+    assert (first['films'], last['films']) == (['f1', 'f2'], [])
+    assert first['enemies'] == ['e1']
+
+
+@pytest.mark.parametrize('engine', ['pandas', 'arrow'])
+def test_missing_columns_are_created_empty(engine):
+    records = [{'_id': '3', 'name': 'Goofy', 'allies': ['a3']}]
+    rows = transform(records, engine)
+
+    # their steps are not applied, `fillna` included
+    assert rows == [{'id': 3, 'character_name': 'Goofy', 'secret': None, 'status': None, 'score': None,
+                     'updated_at': None, 'films': None, 'allies': 'a3', 'enemies': None}]
+
+
+def test_split_bridges_moves_the_lists_to_bridge_tables():
+    records = [dict(RECORDS[0], allies = ['a1'], enemies = ['e1', 'e2']), RECORDS[1]]
+    module = Characters()
+
+    dataset, bridges = Characters.split_bridges(module.transform(Characters.normalize_records(records)))
+    table, arrow_bridges = Characters.split_bridges(module.transform_table(Characters.normalize_records_arrow(records)))
+
+    assert 'enemies' not in dataset.columns and 'enemies' not in table.column_names
+    # one row per (key, item), empty lists have no row
+    assert bridges['enemies'].to_dict('records') == [{'id': 1, 'enemies': 'e1'}, {'id': 1, 'enemies': 'e2'}]
+    assert arrow_bridges['enemies'].to_pylist() == bridges['enemies'].to_dict('records')
+
+
+@pytest.mark.parametrize('fields, error', [
+    ({}, 'empty'),
+    ({'a': {'renamed': 'b'}}, 'Unknown options'),
+    ({'a': {'fn': 'upper'}}, 'callable'),
+    ({'a': {'cache': True}}, 'requires a fn'),
+    ({'a': {'list': 'flatten'}}, 'Unknown list mode'),
+    ({'a': 'c', 'b': {'rename': 'c'}}, 'more than once'),
+    ({'a': 1}, 'should be dict or str')
+])
+def test_invalid_recipes_are_rejected(fields, error):
+    with pytest.raises((ValueError, TypeError), match = error):
+        TransformPlan.compile(fields)
+
+
+def test_compile_lists_the_explode_and_bridge_columns():
+    plan = Characters.get_plan()
+
+    assert plan.columns[:2] == ('id', 'character_name')
+    assert plan.exploded == ('allies',)
+    assert plan.bridges == ('enemies',)
+    assert plan.source_of('updated_at') == 'updatedAt'
+    # `cache` wraps `fn` in a memoized function
+    assert hasattr(plan.steps[4].fn, 'cache_info')
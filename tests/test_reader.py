@@ -0,0 +1,65 @@
+import pytest
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from src.modules.base.merge import ParquetMerger
+from src.modules.base.reader import DatasetReader
+
+PREFIX = 'dataset/characters/'
+
+@pytest.fixture
+def dataset(s3_hook, tmp_path):
+    # 3 partitions of 30 ids, each in a file of 3 row groups of 10 ids
+    files, tables = [], []
+    for n, partition in enumerate('abc'):
+        ids = list(range(n * 30, (n + 1) * 30))
+        table = pa.table({'id': pa.array(ids, pa.int64()), 'name': [f'name-{i}' for i in ids]})
+        file_path = str(tmp_path / f'{partition}.parquet')
+        pq.write_table(table, file_path, row_group_size = 10)
+
+        files.append((file_path, f'part={partition}/part-{partition}.parquet'))
+        tables.append(table.append_column('part', pa.array([partition] * len(ids))))
+
+    keys = pa.chunked_array([table.column('id') for table in tables]).combine_chunks()
+    ParquetMerger(s3_hook, PREFIX, str(tmp_path / 'work'), key = 'id').run(files, keys)
+
+    return pa.concat_tables(tables)
+
+@pytest.fixture
+def reads(monkeypatch):
+    # (file, row groups) read from S3
+    reads = []
+    iter_batches = pq.ParquetFile.iter_batches
+
+    def spy(self, *args, row_groups = None, **kwargs):
+        reads.append(row_groups)
+        return iter_batches(self, *args, row_groups = row_groups, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, 'iter_batches', spy)
+    return reads
+
+
+@pytest.mark.parametrize('filters, row_groups', [
+    # the statistics of the files and of the row groups
+    ([('id', '>=', 35), ('id', '<', 45)], [[0, 1]]),
+    # the partition values, then the statistics of the row groups
+    ([('part', '=', 'c'), ('id', 'in', [5, 61, 75])], [[0, 1]]),
+    ([('id', 'in', [5, 61])], [[0], [0]]),
+    # no file can hold the row: nothing is read
+    ([('part', '!=', 'b'), ('name', '=', 'name-95')], []),
+    ([], [[0, 1, 2]] * 3)
+])
+def test_pruning_skips_files_and_row_groups_but_no_matching_row(s3_hook, dataset, reads, filters, row_groups):
+    table = DatasetReader(s3_hook, PREFIX).read(columns = ['id', 'name', 'part'], filters = filters)
+
+    expected = dataset
+    for column, op, value in filters:
+        field = pc.field(column)
+        expected = expected.filter(field.isin(value) if op == 'in' else
+                                   {'>=': field >= value, '<': field < value, '=': field == value, '!=': field != value}[op])
+
+    assert reads == row_groups
+    assert table.num_rows == expected.num_rows
+    if expected.num_rows:
+        assert table.sort_by('id').to_pylist() == expected.sort_by('id').to_pylist()
@@ -0,0 +1,109 @@
+import os
+import pytest
+
+from airflow.exceptions import AirflowException
+from botocore.exceptions import ClientError
+from hooks import S3Hook
+
+def test_objects_deleted_during_a_download_are_missing(s3, s3_hook, tmp_path, monkeypatch):
+    s3.put_object(Bucket = 'test-bucket', Key = 'a.txt', Body = b'a')
+
+    def download_file(key, file_path):
+        # the object is deleted by another writer between the HEAD and the GET of the transfer
+        s3.delete_object(Bucket = 'test-bucket', Key = key)
+        raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}}, 'GetObject')
+
+    monkeypatch.setattr(s3_hook.s3_bucket, 'download_file', download_file)
+
+    with pytest.raises(AirflowException, match = 'does not exist'):
+        s3_hook.download_file('a.txt', str(tmp_path / 'a.txt'))
+
+
+def test_content_etag_matches_multipart_uploads(s3, tmp_path):
+    # 3 parts of at most 5 MiB, the minimum part size of S3
+    hook = S3Hook('test-bucket', multipart_threshold = 5 * 1024 ** 2, multipart_chunksize = 5 * 1024 ** 2)
+    file_path = str(tmp_path / 'big.bin')
+    with open(file_path, 'wb') as f:
+        f.write(os.urandom(11 * 1024 ** 2))
+
+    hook.upload_file(file_path, 'big.bin')
+
+    with open(file_path, 'rb') as f:
+        etag = hook.content_etag(f)
+    assert etag.endswith('-3')
+    assert etag == hook.get_etag('big.bin')
+
+
+def test_skip_unchanged_always_confirms_the_etag(s3, tmp_path, monkeypatch):
+    hook = S3Hook('test-bucket', etag_index_path = str(tmp_path / 'etags.json'))
+    file_path = str(tmp_path / 'a.txt')
+    with open(file_path, 'wb') as f:
+        f.write(b'v1')
+
+    assert hook.upload_file(file_path, 'a.txt', skip_unchanged = True)
+    assert not hook.upload_file(file_path, 'a.txt', skip_unchanged = True)
+
+    # replaced by another worker: the indexed ETag is stale, the HEAD finds the new one
+    s3.put_object(Bucket = 'test-bucket', Key = 'a.txt', Body = b'v2')
+    assert hook.upload_file(file_path, 'a.txt', skip_unchanged = True)
+    assert s3.get_object(Bucket = 'test-bucket', Key = 'a.txt')['Body'].read() == b'v1'
+
+    # content that changed since it was indexed is uploaded without a HEAD
+    heads = []
+    get_etag = S3Hook.get_etag
+    monkeypatch.setattr(S3Hook, 'get_etag', lambda self, key: heads.append(key) or get_etag(self, key))
+    with open(file_path, 'wb') as f:
+        f.write(b'v3')
+    assert hook.upload_file(file_path, 'a.txt', skip_unchanged = True)
+    assert heads == []
+
+
+def test_delete_file_batches_and_retries_failed_keys(s3, s3_hook, monkeypatch):
+    keys = [f'delete/{n}.txt' for n in range(2500)]
+    for key in keys[:10]:
+        s3.put_object(Bucket = 'test-bucket', Key = key, Body = b'x')
+
+    requests = []
+    delete_objects = s3_hook.client.delete_objects
+
+    def flaky_delete_objects(**kwargs):
+        objects = kwargs['Delete']['Objects']
+        requests.append(len(objects))
+        response = delete_objects(**kwargs)
+        if len(requests) == 1:
+            # the first key of the first request fails once
+            response['Errors'] = [{'Key': objects[0]['Key'], 'Code': 'SlowDown'}]
+        return response
+
+    monkeypatch.setattr(s3_hook.client, 'delete_objects', flaky_delete_objects)
+    monkeypatch.setattr('time.sleep', lambda seconds: None)
+
+    summary = s3_hook.delete_file(iter(keys), max_workers = 1)
+
+    assert sorted(requests) == [1, 500, 1000, 1000]
+    assert sorted(summary['deleted']) == sorted(keys) and summary['failed'] == {}
+    assert 'Contents' not in s3.list_objects_v2(Bucket = 'test-bucket', Prefix = 'delete/')
+
+
+def test_put_object_if_only_replaces_the_expected_version(s3, s3_hook):
+    sent = []
+
+    def send(request, **kwargs):
+        sent.append({name: value.decode() if isinstance(value, bytes) else value for name, value in request.headers.items()})
+
+    s3_hook.client.meta.events.register('before-send.s3.PutObject', send)
+
+    etag = s3_hook.put_object_if(b'v1', 'a.json', None)
+    assert etag and sent[0]['If-None-Match'] == '*'
+
+    # created by another writer, or replaced since it was read
+    assert s3_hook.put_object_if(b'v2', 'a.json', None) is None
+    assert s3_hook.put_object_if(b'v2', 'a.json', 'stale') is None
+
+    assert s3_hook.put_object_if(b'v2', 'a.json', etag) != etag
+    assert sent[-1]['If-Match'] == f'"{etag}"'
+    assert s3.get_object(Bucket = 'test-bucket', Key = 'a.json')['Body'].read() == b'v2'
+
+    # other uploads of the client are not conditional
+    s3_hook.upload_fileobj(b'v3', 'a.json')
+    assert 'If-Match' not in sent[-1] and 'If-None-Match' not in sent[-1]
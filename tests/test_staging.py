@@ -0,0 +1,67 @@
+import os
+import time
+import pytest
+
+from src.dags.base import dag as base_dag
+from src.dags.base.dag import BaseDAG
+from src.modules.base.module import BaseModule
+from src.modules.base.staging import StageArea
+from src.modules.disney import DisneyCurated, DisneyRaw
+
+def write_run(stage, run_id, size, age_minutes = 0):
+    # created directly, `run_dir` would already clean up the runs written before
+    path = stage.path(run_id)
+    os.makedirs(path)
+    file_path = os.path.join(path, 'file.bin')
+    with open(file_path, 'wb') as f:
+        f.write(b'0' * size)
+
+    modified = time.time() - age_minutes * 60
+    os.utime(file_path, (modified, modified))
+    os.utime(path, (modified, modified))
+    return path
+
+
+def test_runs_of_the_same_dag_get_their_own_dir(tmp_path):
+    stage = StageArea(f'{tmp_path}/', 'disney_dag')
+
+    first = stage.run_dir('scheduled__2024-01-01T00:00:00+00:00')
+    second = stage.run_dir('backfill__2024-01-02T00:00:00+00:00')
+
+    assert first != second and os.path.isdir(first) and os.path.isdir(second)
+    assert ':' not in first and '+' not in first
+
+    stage.remove('scheduled__2024-01-01T00:00:00+00:00')
+    assert not os.path.exists(first) and os.path.isdir(second)
+
+
+def test_cleanup_removes_stale_and_over_budget_runs(tmp_path):
+    stage = StageArea(f'{tmp_path}/', 'disney_dag', max_bytes = 150, min_free_bytes = 0,
+                      retention_hours = 1, min_idle_minutes = 10)
+
+    stale = write_run(stage, 'stale', 10, age_minutes = 120)
+    idle = write_run(stage, 'idle', 100, age_minutes = 30)
+    running = write_run(stage, 'running', 100)
+
+    summary = stage.cleanup()
+
+    # the stale run is always removed, the idle one to get under the budget, the running one never
+    assert summary == {'removed': 2, 'freed_bytes': 110}
+    assert not os.path.exists(stale) and not os.path.exists(idle)
+    assert os.path.isdir(running)
+
+
+class AppendModule(BaseModule):
+    dag_name = 'append_dag'
+
+
+@pytest.mark.parametrize('module, supported', [(AppendModule, True), (DisneyRaw, True), (DisneyCurated, False)])
+def test_max_active_runs_only_for_modules_whose_runs_can_overlap(monkeypatch, module, supported):
+    monkeypatch.setattr(base_dag, 'get_dags_custom_params', lambda: {module.dag_name: {'max_active_runs': 2}})
+
+    if supported:
+        assert BaseDAG(module = module).max_active_runs == 2
+    else:
+        # incremental runs share their watermark, merges could publish older rows over newer ones
+        with pytest.raises(ValueError, match = 'max_active_runs'):
+            BaseDAG(module = module)